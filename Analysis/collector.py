@@ -0,0 +1,386 @@
+"""
+Collect the trials the lab's stations stream while their sessions run, and merge each finished session into the
+ingest store.
+
+Stations send their trials with Experiment/trialstream.py. Every new message is appended to a journal for its session
+before it is acknowledged, so a restarted collector picks up where it left off, and repeats are dropped. Once a stream
+has ended and every one of its messages has arrived, the session's data files are written under the data directory,
+as the station itself writes them, and ingest brings the store up to date. If a session was resumed, each block is
+taken from the last stream that ran it. The collector keeps the running accuracy of every station's current session,
+prints it every report_interval seconds and sends it to anyone who asks. Run from the Analysis directory:
+
+    python collector.py serve --port 8765
+    python collector.py status --follow
+    python collector.py replay ../Experiment/*_stream.jsonl
+
+replay merges the spool files stations leave behind when they could not reach the collector.
+"""
+import argparse, asyncio, csv, glob, hashlib, json, os, threading, time
+
+from ingest import ingest
+
+default_port = 8765
+# how often the progress of every station is printed and sent to status followers, in seconds
+report_interval = 10.
+summary_fields = ['station', 'subject', 'experiment', 'session', 'block', 'trials', 'correct', 'accuracy',
+                  'updated']
+
+
+class Collector(object):
+    """
+    Merges the streams of trials from every station.
+    """
+
+    def __init__(self, data_dir='Data/Experiments', store_dir='Data/store', journal_dir=None, quiet=False):
+        """
+        :param data_dir: String. The directory to write the data files of finished sessions to, in a directory for
+                         each experiment as ingest expects.
+        :param store_dir: String. The directory of the ingest store.
+        :param journal_dir: String. The directory of the journals of the sessions; 'streams' in store_dir by default.
+        :param quiet: Boolean. Whether to keep from printing progress and merged sessions.
+        """
+        self.data_dir = data_dir
+        self.store_dir = store_dir
+        self.journal_dir = journal_dir or os.path.join(store_dir, 'streams')
+        self.quiet = quiet
+        self.sessions = {}
+        self.merged = []
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, '*.jsonl'))):
+            with open(path) as journal:
+                for line in journal:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    if message['kind'] == 'merged':
+                        self._session(message['session'])['merged'] = True
+                    else:
+                        self.accept(message, journal=False)
+
+    def _session(self, name):
+        if name not in self.sessions:
+            self.sessions[name] = {'streams': {}, 'merged': False}
+        return self.sessions[name]
+
+    def _journal(self, name, message):
+        path = os.path.join(self.journal_dir, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.jsonl')
+        with open(path, 'a') as journal:
+            journal.write(json.dumps(message) + '\n')
+
+    def accept(self, message, journal=True):
+        """
+        Take one message from a station.
+
+        :param message: The dictionary of the message.
+        :param journal: Boolean. Whether to add the message to its session's journal.
+        :return: True if the message was new, or False if it was a repeat.
+        """
+        stream = self._session(message['session'])['streams'].setdefault(message['stream'], {
+            'messages': {}, 'station': message.get('station'), 'session': None, 'count': None, 'updated': 0})
+        if message['seq'] in stream['messages']:
+            return False
+        if journal:
+            self._journal(message['session'], message)
+        stream['messages'][message['seq']] = message
+        stream['updated'] = max(stream['updated'], message.get('time', 0))
+        if message['kind'] == 'session':
+            stream['session'] = message
+        elif message['kind'] == 'end':
+            stream['count'] = message['count']
+        return True
+
+    def complete(self, name):
+        """
+        :param name: String. The name of a session.
+        :return: True if one of the session's streams has ended and all of its messages have arrived, and the session
+                has not been merged yet.
+        """
+        session = self.sessions.get(name)
+        if session is None or session['merged']:
+            return False
+        return any([stream['count'] is not None and len(stream['messages']) >= stream['count']
+                    for stream in session['streams'].values()])
+
+    def session_files(self, name):
+        """
+        Put together the data files of a finished session.
+
+        :param name: String. The name of the session.
+        :return: A (experiment, files) tuple of the experiment and a list of a (name, columns, rows) tuple for each
+                data file, as described by the session's last stream.
+        """
+        streams = sorted([stream for stream in self.sessions[name]['streams'].values() if stream['session']],
+                         key=lambda stream: stream['session']['time'], reverse=True)
+        files = []
+        for spec in streams[0]['session']['files']:
+            columns = [spec['fields'].index(column) for column in spec['columns']]
+            rows = []
+            for block in spec['blocks']:
+                # a block that was run more than once, because the session was resumed during it, is taken from the
+                # last run
+                for stream in streams:
+                    trials = [message for seq, message in sorted(stream['messages'].items())
+                              if message['kind'] == 'trial' and message['block'] == block]
+                    if trials:
+                        rows.extend([[trial['row'][i] for i in columns] for trial in trials])
+                        break
+            files.append((spec['name'], spec['columns'], rows))
+        return streams[0]['session']['experiment'], files
+
+    def merge(self, name):
+        """
+        Write the data files of a finished session and bring the ingest store up to date.
+
+        :param name: String. The name of the session.
+        :return: The list of filepaths written.
+        """
+        return self._write_session(name, *self.session_files(name))
+
+    def _write_session(self, name, experiment, files):
+        directory = os.path.join(self.data_dir, 'ex%d' % experiment)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for filename, columns, rows in files:
+            path = os.path.join(directory, os.path.basename(filename))
+            with open(path, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(columns)
+                writer.writerows(rows)
+            paths.append(path)
+        ingest(self.data_dir, self.store_dir)
+        self.sessions[name]['merged'] = True
+        self._journal(name, {'kind': 'merged', 'session': name})
+        self.merged.extend(paths)
+        if not self.quiet:
+            print('merged ' + ', '.join(paths))
+        return paths
+
+    def summary(self):
+        """
+        :return: A list with a dictionary for every station, with the keys of summary_fields, giving the progress and
+                running accuracy of the last session it started. Only the trials of a session's data files count
+                towards it.
+        """
+        latest = {}
+        for name, session in self.sessions.items():
+            for stream in session['streams'].values():
+                if stream['session'] is None:
+                    continue
+                if stream['station'] not in latest or \
+                        stream['session']['time'] > latest[stream['station']][1]['session']['time']:
+                    latest[stream['station']] = (name, stream)
+        rows = []
+        for station in sorted(latest.keys()):
+            name, stream = latest[station]
+            spec = stream['session']['files'][0]
+            correct_column = spec['fields'].index('correct')
+            block = None
+            trials = correct = 0
+            for seq in sorted(stream['messages'].keys()):
+                message = stream['messages'][seq]
+                if message['kind'] != 'trial':
+                    continue
+                block = message['block']
+                if block in spec['blocks'] and len(message['row']) == len(spec['fields']):
+                    trials += 1
+                    correct += message['row'][correct_column] == 1
+            rows.append({'station': station, 'subject': stream['session']['subject'],
+                         'experiment': stream['session']['experiment'], 'session': name,
+                         'block': 'finished' if stream['count'] is not None else block, 'trials': trials,
+                         'correct': correct, 'accuracy': float(correct) / trials if trials else None,
+                         'updated': stream['updated']})
+        return rows
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                if message.get('kind') == 'status':
+                    await self._send_status(writer, message.get('follow', False))
+                    break
+                self.accept(message)
+                writer.write((json.dumps({'ack': [message['stream'], message['seq']]}) + '\n').encode('utf-8'))
+                await writer.drain()
+                if self.complete(message['session']) and message['session'] not in self._merges:
+                    self._merges[message['session']] = asyncio.ensure_future(self._merge(message['session']))
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _merge(self, name):
+        # the files are put together here, while no new messages can arrive; writing them and ingesting can take a
+        # while, so that runs on a worker thread, one session at a time, and stations are still answered meanwhile
+        try:
+            async with self._merging:
+                if self.complete(name):
+                    experiment, files = self.session_files(name)
+                    await asyncio.get_event_loop().run_in_executor(None, self._write_session, name, experiment, files)
+        finally:
+            del self._merges[name]
+
+    async def _send_status(self, writer, follow):
+        while True:
+            writer.write((json.dumps(self.summary()) + '\n').encode('utf-8'))
+            await writer.drain()
+            if not follow:
+                return
+            await asyncio.sleep(report_interval)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(report_interval)
+            for row in self.summary():
+                print(format_summary(row))
+
+    async def serve(self, host='127.0.0.1', port=default_port, started=None):
+        """
+        Take streams from stations until cancelled.
+
+        :param host: String. The address to listen on.
+        :param port: Integer. The port to listen on; 0 picks a free one.
+        :param started: A function to call with the (host, port) being listened on once the collector is ready.
+        :return: None.
+        """
+        self._merging = asyncio.Lock()
+        self._merges = {}
+        server = await asyncio.start_server(self._handle, host, port)
+        reporter = asyncio.ensure_future(self._report()) if not self.quiet else None
+        if started is not None:
+            started(server.sockets[0].getsockname()[:2])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+
+    def replay(self, paths):
+        """
+        Take the messages in stations' spool files, and merge the sessions they finish.
+
+        :param paths: A list of the filepaths of spool files.
+        :return: The list of names of the sessions merged.
+        """
+        names = []
+        for path in paths:
+            with open(path) as spool:
+                for line in spool:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.accept(message)
+                    if message['session'] not in names:
+                        names.append(message['session'])
+        merged = [name for name in names if self.complete(name)]
+        for name in merged:
+            self.merge(name)
+        return merged
+
+
+def serve_in_thread(collector, host='127.0.0.1', port=0):
+    """
+    Run a collector on a background thread, e.g. as a local stand-in for the lab's collector while testing.
+
+    :param collector: The Collector to run.
+    :param host: String. The address to listen on.
+    :param port: Integer. The port to listen on; a free one by default.
+    :return: A (address, stop) tuple of the (host, port) the collector listens on and a function that stops it.
+    """
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    address = []
+
+    def started(listening):
+        address.extend(listening)
+        ready.set()
+
+    task = loop.create_task(collector.serve(host, port, started))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    ready.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
+
+    return tuple(address), stop
+
+
+def read_status(host='127.0.0.1', port=default_port, follow=False):
+    """
+    Ask a collector for the progress of every station.
+
+    :param host: String. The collector's address.
+    :param port: Integer. The collector's port.
+    :param follow: Boolean. Whether to keep printing the progress every report_interval seconds.
+    :return: The last list of summaries received, as from Collector.summary.
+    """
+    async def ask():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write((json.dumps({'kind': 'status', 'follow': follow}) + '\n').encode('utf-8'))
+        rows = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            rows = json.loads(line.decode('utf-8'))
+            for row in rows:
+                print(format_summary(row))
+            if not follow:
+                break
+        writer.close()
+        return rows
+    return asyncio.new_event_loop().run_until_complete(ask())
+
+
+def format_summary(row):
+    """
+    :param row: A dictionary of the progress of a station, as from Collector.summary.
+    :return: String. A line describing it.
+    """
+    return '%-16s subject %-8s ex%s %-12s %4d trials  %s  %s' % (
+        row['station'], row['subject'], row['experiment'], row['block'], row['trials'],
+        '%5.1f%% correct' % (row['accuracy'] * 100) if row['accuracy'] is not None else '    no trials',
+        time.strftime('%H:%M:%S', time.localtime(row['updated'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect the trials streamed by the stations and merge them into '
+                                                 'the ingest store.')
+    parser.add_argument('command', choices=['serve', 'status', 'replay'])
+    parser.add_argument('spools', nargs='*', help='for replay, the spool files to merge')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--data', default='Data/Experiments', help='the directory to write data files to')
+    parser.add_argument('--store', default='Data/store', help='the directory of the ingest store')
+    parser.add_argument('--follow', action='store_true', help='for status, keep printing the progress')
+    args = parser.parse_args()
+    if args.command == 'status':
+        read_status(args.host, args.port, args.follow)
+    elif args.command == 'replay':
+        print('merged %d sessions' % len(Collector(args.data, args.store).replay(args.spools)))
+    else:
+        try:
+            asyncio.new_event_loop().run_until_complete(Collector(args.data, args.store).serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
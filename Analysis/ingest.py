@@ -0,0 +1,242 @@
+"""
+Gather the per-session data files under a data directory into one typed, columnar dataset.
+
+Trial files and n-back files are parsed into numpy columns, tagged with the subject, experiment, version and session
+time taken from their filenames, and saved together, sorted and indexed by subject and trial type. Each file's parsed
+columns are cached, so a later run only parses files that are new or whose size or modification time changed.
+
+The filename schemes understood are those the experiment has used over time:
+
+    0109282015CBLTM.csv                                     subject, then the date as MMDDYYYY
+    042015_Nov_12_1022CBLTM_followup_3.csv                  subject, then the date as YYYY_Mon_DD_HHMM
+    042015_Nov_12_1022nback.csv
+    26_Tue Aug 30 10_50_50 2016_CBLTM_followup_5.csv        subject, then the date as from time.strftime('%c')
+    26_Tue Aug 30 10:50:50 2016_CBLTM_5.csv
+    26_Tue Aug 30 10:50:50 2016_nback.csv
+
+The experiment is the number of the exN directory a file is in. Run from the Analysis directory:
+
+    python ingest.py Data/Experiments Data/store
+"""
+from datetime import datetime
+import argparse, csv, hashlib, json, os, re
+
+import numpy
+
+trial_columns = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'lr_response',
+                 'response_image', 'filler1', 'filler2', 'filler3', 'filler4', 'filler5', 'rt', 'lr_rt', 'test_slot',
+                 'filler6']
+nback_columns = ['response', 'index', 'first_occurence']
+session_columns = ['subject', 'experiment', 'version', 'session_time', 'source']
+# columns not listed are stored as strings
+column_types = {'correct': numpy.int8, 'timestamp': numpy.float64, 'rt': numpy.float64, 'lr_rt': numpy.float64,
+                'test_slot': numpy.int8,
+                'index': numpy.int32, 'first_occurence': numpy.int32, 'experiment': numpy.int16,
+                'version': numpy.int16, 'session_time': 'datetime64[s]', 'source': numpy.int32}
+# values that mean nothing was recorded
+missing_values = ('', 'NaN', 'nan', 'NA')
+store_version = 3
+
+_schemes = [
+    (re.compile(r'^(?P<subject>p?\d+?)(?P<time>\d{8})(?P<kind>CBLTM)\.csv$'), '%m%d%Y'),
+    (re.compile(r'^(?P<subject>\d+?)(?P<time>\d{4}_[A-Z][a-z]{2}_\d{2}_\d{4})'
+                r'(?P<kind>CBLTM_followup_(?P<version>\d+)|nback)\.csv$'), '%Y_%b_%d_%H%M'),
+    (re.compile(r'^(?P<subject>.+?)_(?P<time>[A-Z][a-z]{2} [A-Z][a-z]{2} [ \d]\d \d{2}[_:]\d{2}[_:]\d{2} \d{4})_'
+                r'(?P<kind>CBLTM_followup_(?P<version>\d+)|CBLTM_(?P<experiment_version>\d+)|nback)\.csv$'),
+     '%a %b %d %H_%M_%S %Y'),
+]
+
+
+def parse_filename(filename):
+    """
+    Read the subject, kind of data, version and session time from a data filename.
+
+    :param filename: String. The name of the file, without its directory.
+    :return: A dictionary with 'subject', 'kind' ('trials' or 'nback'), 'version' (0 if the name has none) and
+            'session_time' (an ISO 8601 string), or None if the name follows none of the known schemes.
+    """
+    for pattern, time_format in _schemes:
+        match = pattern.match(filename)
+        if match is None:
+            continue
+        fields = match.groupdict()
+        version = fields.get('version') or fields.get('experiment_version') or 0
+        session_time = datetime.strptime(fields['time'].replace(':', '_'), time_format)
+        return {'subject': fields['subject'], 'kind': 'nback' if fields['kind'] == 'nback' else 'trials',
+                'version': int(version), 'session_time': session_time.isoformat()}
+    return None
+
+
+def parse_file(path, kind):
+    """
+    Parse a trial or n-back csv into typed columns.
+
+    :param path: String. The filepath of the csv.
+    :param kind: String. 'trials' or 'nback'.
+    :return: A dictionary of numpy arrays, one for each of trial_columns or nback_columns.
+    """
+    columns = trial_columns if kind == 'trials' else nback_columns
+    with open(path, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        rows = list(reader)
+    values = dict([(name, []) for name in columns])
+    positions = [(name, header.index(name)) for name in columns if name in header]
+    for row in rows:
+        for name, position in positions:
+            values[name].append(row[position] if position < len(row) else '')
+    for name in columns:
+        if name not in header:
+            values[name] = [''] * len(rows)
+    if kind == 'trials' and 'timestamp' not in header and 'lr_response' in header:
+        # older sessions of the flipped experiment kept the time in lr_response on trials without a follow-up
+        for i in range(0, len(rows)):
+            if _is_number(values['lr_response'][i]):
+                values['timestamp'][i], values['lr_response'][i] = values['lr_response'][i], ''
+    return dict([(name, _typed(values[name], column_types.get(name, str))) for name in columns])
+
+
+def ingest(data_dir, store_dir):
+    """
+    Bring the dataset in store_dir up to date with the data files under data_dir. Only files that are new or whose
+    size or modification time changed are parsed; the dataset is only rebuilt if some file changed.
+
+    :param data_dir: String. The directory to search for data files, e.g. Data/Experiments.
+    :param store_dir: String. The directory of the dataset; created if it does not exist.
+    :return: A (parsed, total) tuple of the number of files parsed on this run and the number in the dataset.
+    """
+    cache_dir = os.path.join(store_dir, 'files')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    state_file = os.path.join(store_dir, 'ingest.json')
+    state = {'version': store_version, 'files': {}}
+    if os.path.exists(state_file):
+        with open(state_file) as state_json:
+            state = json.load(state_json)
+        if state.get('version') != store_version:
+            state = {'version': store_version, 'files': {}}
+    files = {}
+    parsed = 0
+    for dirpath, dirnames, filenames in os.walk(data_dir):
+        dirnames.sort()
+        experiment = re.search(r'ex(\d+)', os.path.relpath(dirpath, data_dir))
+        for filename in sorted(filenames):
+            info = parse_filename(filename)
+            if info is None:
+                continue
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, data_dir)
+            stat = os.stat(path)
+            entry = state['files'].get(name)
+            cache = os.path.join(cache_dir, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.npz')
+            if entry is None or entry['bytes'] != stat.st_size or entry['mtime'] != stat.st_mtime or \
+                    not os.path.exists(cache):
+                numpy.savez(cache, **parse_file(path, info['kind']))
+                parsed += 1
+            info.update({'experiment': int(experiment.group(1)) if experiment else 0, 'bytes': stat.st_size,
+                         'mtime': stat.st_mtime, 'cache': os.path.basename(cache)})
+            files[name] = info
+    for name, entry in state['files'].items():
+        if name not in files and os.path.exists(os.path.join(cache_dir, entry['cache'])):
+            os.remove(os.path.join(cache_dir, entry['cache']))
+    outputs = [os.path.join(store_dir, name) for name in ['trials.npz', 'nback.npz', 'index.json']]
+    if parsed or set(files) != set(state['files']) or not all([os.path.exists(path) for path in outputs]):
+        _build(store_dir, cache_dir, files)
+        with open(state_file, 'w') as state_json:
+            json.dump({'version': store_version, 'files': files}, state_json, indent=1, sort_keys=True)
+    return parsed, len(files)
+
+
+def load_store(store_dir):
+    """
+    Load an ingested dataset.
+
+    :param store_dir: String. The directory of the dataset.
+    :return: A (trials, nback, index) tuple. trials and nback map each column name to its array, including the
+            session columns. index maps 'subjects' to a dictionary from "experiment/subject" to the (start, stop) rows
+            of that subject in trials, and 'trial_types' to one from "experiment/subject/trial_type" to the rows
+            of that subject's trials of that type; 'sources' lists the file each source number refers to.
+    """
+    with numpy.load(os.path.join(store_dir, 'trials.npz')) as trials_npz:
+        trials = dict(trials_npz.items())
+    with numpy.load(os.path.join(store_dir, 'nback.npz')) as nback_npz:
+        nback = dict(nback_npz.items())
+    with open(os.path.join(store_dir, 'index.json')) as index_json:
+        index = json.load(index_json)
+    return trials, nback, index
+
+
+def _build(store_dir, cache_dir, files):
+    sources = sorted(files.keys())
+    for kind, columns, output in [('trials', trial_columns, 'trials.npz'), ('nback', nback_columns, 'nback.npz')]:
+        parts = dict([(name, []) for name in columns + session_columns])
+        for source, name in enumerate(sources):
+            info = files[name]
+            if info['kind'] != kind:
+                continue
+            with numpy.load(os.path.join(cache_dir, info['cache'])) as cached:
+                n = len(cached[columns[0]])
+                for column in columns:
+                    parts[column].append(cached[column])
+            for column, value in [('subject', info['subject']), ('experiment', info['experiment']),
+                                  ('version', info['version']), ('session_time', info['session_time']),
+                                  ('source', source)]:
+                parts[column].append(numpy.array([value] * n, dtype=column_types.get(column, str)))
+        data = {}
+        for column, arrays in parts.items():
+            dtype = column_types.get(column, str)
+            data[column] = numpy.concatenate(arrays) if arrays else numpy.array([], dtype=dtype)
+        # rows of a subject together, and within them each trial type together, in the order they were run
+        sort_keys = [numpy.arange(len(data['source'])), data['source'], data['session_time']]
+        if kind == 'trials':
+            sort_keys = [sort_keys[0], data['trial_type']] + sort_keys[1:]
+        order = numpy.lexsort(sort_keys + [data['subject'], data['experiment']])
+        data = dict([(column, values[order]) for column, values in data.items()])
+        numpy.savez(os.path.join(store_dir, output), **data)
+        if kind == 'trials':
+            index = {'subjects': _runs(data, ['experiment', 'subject']),
+                     'trial_types': _runs(data, ['experiment', 'subject', 'trial_type']), 'sources': sources}
+    with open(os.path.join(store_dir, 'index.json'), 'w') as index_json:
+        json.dump(index, index_json, indent=1, sort_keys=True)
+
+
+def _runs(data, keys):
+    # map each run of rows with equal values in the key columns to its (start, stop) rows
+    runs = {}
+    n = len(data[keys[0]])
+    if not n:
+        return runs
+    changes = numpy.zeros(n, dtype=bool)
+    changes[0] = True
+    for key in keys:
+        changes[1:] |= data[key][1:] != data[key][:-1]
+    starts = list(numpy.flatnonzero(changes)) + [n]
+    for i in range(0, len(starts) - 1):
+        label = '/'.join([str(data[key][starts[i]]) for key in keys])
+        runs[label] = [int(starts[i]), int(starts[i + 1])]
+    return runs
+
+
+def _typed(values, dtype):
+    if dtype is str:
+        return numpy.array(['' if value in missing_values else value for value in values], dtype=str)
+    if dtype is numpy.float64:
+        return numpy.array([float(value) if _is_number(value) else numpy.nan for value in values], dtype=dtype)
+    return numpy.array([int(float(value)) if _is_number(value) else -1 for value in values], dtype=dtype)
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return value not in missing_values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gather session data files into one columnar dataset.')
+    parser.add_argument('data_dir', nargs='?', default=os.path.join('Data', 'Experiments'))
+    parser.add_argument('store_dir', nargs='?', default=os.path.join('Data', 'store'))
+    args = parser.parse_args()
+    n_parsed, n_files = ingest(args.data_dir, args.store_dir)
+    print('Parsed %d of %d files into %s' % (n_parsed, n_files, args.store_dir))
@@ -0,0 +1,253 @@
+"""
+Score every subject of an ingested dataset in one batched pass, grouped by experiment.
+
+Three tables are computed from the columns of the dataset, with one row per group and no loop over files or subjects:
+
+    accuracy    the proportion correct of each subject on each trial type
+    flipped     signal detection measures from the lr_response codes of the flipped task, where the signal is that
+                the picked object changed and the 'yes' response is that it did: hit and f_n are signal trials,
+                f_a and miss are noise trials
+    nback       signal detection measures from the n-back rows of the study stream: hit and miss rows are repeats,
+                f_a rows are presses on items shown for the first time. The repeats of each session are counted from
+                its rows, one for every index with a hit or a miss, so sessions with any number of repeats score
+                alike
+
+Rates are corrected with the log-linear rule, (count + .5) / (trials + 1), so that d' is finite for perfect scores.
+
+Confidence intervals are bootstrapped with every resample drawn at once as an array. Each subject's accuracy and d'
+are resampled from their own trials, stratified into signal and noise trials for d', and each experiment's mean of
+those measures is resampled over its subjects. The resamples are split into chunks that run across a process pool.
+Run from the Analysis directory, after ingest.py:
+
+    python scoring.py Data/store --resamples 10000 --out Data/scores
+"""
+from statistics import NormalDist
+import argparse, csv, multiprocessing, os
+
+import numpy
+
+from ingest import load_store
+
+try:
+    from scipy.special import ndtri as _z
+except ImportError:
+    _z = numpy.vectorize(NormalDist().inv_cdf, otypes=[numpy.float64])
+
+flipped_codes = ['hit', 'f_a', 'f_n', 'miss']
+nback_codes = ['hit', 'miss', 'f_a']
+# the resamples each pool task draws
+resample_chunk = 1000
+
+
+def score(trials, nback, stream_length=None):
+    """
+    Compute the accuracy and signal detection tables for every subject.
+
+    :param trials: The trial columns of a dataset, as from ingest.load_store.
+    :param nback: The n-back columns of a dataset, as from ingest.load_store.
+    :param stream_length: The number of items in an n-back study stream, used to count the items that were shown for
+                          the first time. The largest index recorded in each session, plus one, if not given.
+    :return: A dictionary mapping 'accuracy', 'flipped' and 'nback' to tables, each a dictionary of equal length
+            column arrays.
+    """
+    valid = trials['correct'] >= 0
+    keys, group = _groups(trials, ['experiment', 'subject', 'trial_type'], valid)
+    n = numpy.bincount(group, minlength=len(keys['subject']))
+    correct = numpy.bincount(group, weights=trials['correct'][valid], minlength=len(n)).astype(numpy.int64)
+    accuracy = dict(keys, n=n, correct=correct, accuracy=correct / n)
+
+    coded = numpy.isin(trials['lr_response'], flipped_codes)
+    keys, group = _groups(trials, ['experiment', 'subject'], coded)
+    counts = _code_counts(trials['lr_response'][coded], flipped_codes, group, len(keys['subject']))
+    flipped = dict(keys, **counts)
+    flipped.update(_detection(counts['hit'], counts['hit'] + counts['f_n'], counts['f_a'],
+                              counts['f_a'] + counts['miss']))
+
+    # the items shown for the first time in a session are the stream less the repeats, counted per session and
+    # summed over each subject's sessions; every repeat has one miss or at least one hit at the index it was shown at
+    sessions, session = _groups(nback, ['experiment', 'subject', 'source'])
+    repeat_rows = numpy.isin(nback['response'], ['hit', 'miss'])
+    stride = int(nback['index'].max()) + 1 if len(nback['index']) else 1
+    shown = numpy.unique(session[repeat_rows] * stride + nback['index'][repeat_rows].astype(numpy.int64))
+    session_repeats = numpy.bincount(shown // stride, minlength=len(sessions['source']))
+    if stream_length is None:
+        lengths = numpy.zeros(len(sessions['source']), dtype=numpy.int64)
+        numpy.maximum.at(lengths, session, nback['index'].astype(numpy.int64) + 1)
+    else:
+        lengths = numpy.full(len(sessions['source']), stream_length, dtype=numpy.int64)
+    keys, group = _groups(nback, ['experiment', 'subject'])
+    _, subject_of_session = _groups(sessions, ['experiment', 'subject'])
+    counts = _code_counts(nback['response'], nback_codes, group, len(keys['subject']))
+    repeats = numpy.bincount(subject_of_session, weights=session_repeats,
+                             minlength=len(keys['subject'])).astype(numpy.int64)
+    lures = numpy.bincount(subject_of_session, weights=lengths, minlength=len(repeats)).astype(numpy.int64) - repeats
+    # a repeat pressed for more than once is still one hit
+    counts['hit'] = repeats - counts['miss']
+    nback_table = dict(keys, lures=lures, **counts)
+    nback_table.update(_detection(counts['hit'], counts['hit'] + counts['miss'], counts['f_a'], lures))
+    return {'accuracy': accuracy, 'flipped': flipped, 'nback': nback_table}
+
+
+def bootstrap(scores, resamples=10000, confidence=.95, processes=None, seed=None):
+    """
+    Add bootstrapped confidence intervals to the tables from score, and summarise each experiment.
+
+    The accuracy table gains 'low' and 'high' columns for each subject's accuracy, and the flipped and nback tables
+    gain them for each subject's d'.
+
+    :param scores: The tables from score; changed in place.
+    :param resamples: The number of bootstrap resamples.
+    :param confidence: The coverage of the intervals, e.g. .95.
+    :param processes: The number of worker processes; one per CPU if not given, and none if 1.
+    :param seed: A seed for the resamples, so that a summary can be reproduced.
+    :return: The summary table, a dictionary of column arrays with one row for each experiment and measure:
+            'experiment', 'measure' (a trial type's accuracy, 'flipped d_prime' or 'nback d_prime'), 'subjects', and
+            the 'mean', 'low' and 'high' of that measure over the experiment's subjects.
+    """
+    accuracy, flipped, nback = scores['accuracy'], scores['flipped'], scores['nback']
+    summary = {'experiment': [], 'measure': [], 'values': []}
+    for experiment, measure in sorted(set(zip(accuracy['experiment'].tolist(), accuracy['trial_type'].tolist()))):
+        rows = (accuracy['experiment'] == experiment) & (accuracy['trial_type'] == measure)
+        summary['experiment'].append(experiment)
+        summary['measure'].append(measure + ' accuracy')
+        summary['values'].append(accuracy['accuracy'][rows])
+    for name, table in [('flipped', flipped), ('nback', nback)]:
+        for experiment in numpy.unique(table['experiment']).tolist():
+            summary['experiment'].append(experiment)
+            summary['measure'].append(name + ' d_prime')
+            summary['values'].append(table['d_prime'][table['experiment'] == experiment])
+    statistics = [('binomial', (accuracy['n'], accuracy['accuracy'])),
+                  ('detection', (flipped['hit'] + flipped['f_n'], flipped['hit_rate'],
+                                 flipped['f_a'] + flipped['miss'], flipped['fa_rate'])),
+                  ('detection', (nback['hit'] + nback['miss'], nback['hit_rate'], nback['lures'],
+                                 nback['fa_rate'])),
+                  ('means', tuple(summary['values']))]
+    chunks = [min(resample_chunk, resamples - start) for start in range(0, resamples, resample_chunk)]
+    seeds = numpy.random.SeedSequence(seed).spawn(len(statistics) * len(chunks))
+    jobs = [(kind, arrays, count, seeds[i * len(chunks) + j])
+            for i, (kind, arrays) in enumerate(statistics) for j, count in enumerate(chunks)]
+    if processes == 1:
+        results = list(map(_resample, jobs))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_resample, jobs)
+    tail = (1 - confidence) / 2 * 100
+    intervals = []
+    for i in range(0, len(statistics)):
+        draws = numpy.concatenate(results[i * len(chunks):(i + 1) * len(chunks)])
+        with numpy.errstate(all='ignore'):
+            intervals.append(numpy.nanpercentile(draws, [tail, 100 - tail], axis=0)
+                             if draws.shape[1] else numpy.zeros((2, 0)))
+    for table, (low, high) in zip([accuracy, flipped, nback], intervals[:3]):
+        table['low'], table['high'] = low, high
+    values = summary.pop('values')
+    summary = dict([(name, numpy.array(column)) for name, column in summary.items()])
+    summary['subjects'] = numpy.array([len(v) for v in values], dtype=numpy.int64)
+    summary['mean'] = numpy.array([numpy.mean(v) if len(v) else numpy.nan for v in values])
+    summary['low'], summary['high'] = intervals[3]
+    return summary
+
+
+def d_prime(hits, signal, false_alarms, noise):
+    """
+    Compute d' and the criterion c from counts, with log-linear corrected rates. Works elementwise on arrays.
+
+    :param hits: The number of 'yes' responses to signal trials.
+    :param signal: The number of signal trials.
+    :param false_alarms: The number of 'yes' responses to noise trials.
+    :param noise: The number of noise trials.
+    :return: A (d', c) tuple.
+    """
+    z_hit = _z((hits + .5) / (signal + 1.))
+    z_fa = _z((false_alarms + .5) / (noise + 1.))
+    return z_hit - z_fa, -(z_hit + z_fa) / 2
+
+
+def write_table(filename, table):
+    """
+    Write a table to a csv file, one column per entry, in the order of the dictionary.
+
+    :param filename: String. The filename for the csv, including the extension.
+    :param table: A dictionary of equal length column arrays.
+    :return: None.
+    """
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(list(table.keys()))
+        writer.writerows(zip(*[column.tolist() for column in table.values()]))
+
+
+def _groups(data, keys, rows=None):
+    # number each distinct combination of the key columns, in sorted order; returns the key columns of each group and
+    # the group of every row
+    columns = [data[key] if rows is None else data[key][rows] for key in keys]
+    if not len(columns[0]):
+        return dict([(key, column[:0]) for key, column in zip(keys, columns)]), numpy.zeros(0, dtype=numpy.intp)
+    codes = []
+    for column in columns:
+        _, code = numpy.unique(column, return_inverse=True)
+        codes.append(code.ravel())
+    order = numpy.lexsort(codes[::-1])
+    changes = numpy.ones(len(order), dtype=bool)
+    changes[1:] = numpy.any([code[order][1:] != code[order][:-1] for code in codes], axis=0)
+    group = numpy.empty(len(order), dtype=numpy.intp)
+    group[order] = numpy.cumsum(changes) - 1
+    firsts = order[changes]
+    return dict([(key, column[firsts]) for key, column in zip(keys, columns)]), group
+
+
+def _code_counts(values, codes, group, n_groups):
+    # count each response code in every group with one bincount over (group, code) pairs
+    code = numpy.searchsorted(numpy.array(sorted(codes)), values)
+    counts = numpy.bincount(group * len(codes) + code, minlength=n_groups * len(codes)).reshape(n_groups, len(codes))
+    return dict([(name, counts[:, i]) for i, name in enumerate(sorted(codes))])
+
+
+def _detection(hits, signal, false_alarms, noise):
+    with numpy.errstate(all='ignore'):
+        hit_rate, fa_rate = hits / signal, false_alarms / noise
+    d, c = d_prime(hits, signal, false_alarms, noise)
+    return {'hit_rate': hit_rate, 'fa_rate': fa_rate, 'd_prime': d, 'criterion': c}
+
+
+def _resample(job):
+    # draw one chunk of bootstrap resamples of a statistic; returns an array with one row per resample
+    kind, arrays, count, seed = job
+    rng = numpy.random.default_rng(seed)
+    if kind == 'binomial':
+        n, p = arrays
+        with numpy.errstate(all='ignore'):
+            return rng.binomial(n, numpy.nan_to_num(p), size=(count, len(n))) / n
+    if kind == 'detection':
+        signal, hit_rate, noise, fa_rate = arrays
+        hits = rng.binomial(signal, numpy.nan_to_num(hit_rate), size=(count, len(signal)))
+        false_alarms = rng.binomial(noise, numpy.nan_to_num(fa_rate), size=(count, len(noise)))
+        return d_prime(hits, signal, false_alarms, noise)[0]
+    means = numpy.full((count, len(arrays)), numpy.nan)
+    for i, values in enumerate(arrays):
+        if len(values):
+            means[:, i] = values[rng.integers(0, len(values), size=(count, len(values)))].mean(axis=1)
+    return means
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score every subject of an ingested dataset.')
+    parser.add_argument('store_dir', nargs='?', default=os.path.join('Data', 'store'))
+    parser.add_argument('--resamples', type=int, default=10000)
+    parser.add_argument('--confidence', type=float, default=.95)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stream-length', type=int, default=None)
+    parser.add_argument('--out', default=None, help='directory to write the tables to as csv files')
+    args = parser.parse_args()
+    store_trials, store_nback, _ = load_store(args.store_dir)
+    subject_scores = score(store_trials, store_nback, args.stream_length)
+    experiment_summary = bootstrap(subject_scores, args.resamples, args.confidence, args.processes, args.seed)
+    if args.out:
+        if not os.path.isdir(args.out):
+            os.makedirs(args.out)
+        for table_name, score_table in list(subject_scores.items()) + [('summary', experiment_summary)]:
+            write_table(os.path.join(args.out, table_name + '.csv'), score_table)
+    for row in zip(*[experiment_summary[name].tolist() for name in ['experiment', 'measure', 'subjects', 'mean',
+                                                                      'low', 'high']]):
+        print('ex%d  %-22s n=%-3d %6.3f  [%6.3f, %6.3f]' % row)
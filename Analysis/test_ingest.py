@@ -0,0 +1,70 @@
+import os
+
+import numpy
+import pytest
+
+from ingest import ingest, load_store, parse_file, parse_filename
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('0109282015CBLTM.csv', ('01', 'trials', 0, '2015-09-28T00:00:00')),
+    ('042015_Nov_12_1022CBLTM_followup_3.csv', ('04', 'trials', 3, '2015-11-12T10:22:00')),
+    ('042015_Nov_12_1022nback.csv', ('04', 'nback', 0, '2015-11-12T10:22:00')),
+    ('26_Tue Aug 30 10_50_50 2016_CBLTM_followup_5.csv', ('26', 'trials', 5, '2016-08-30T10:50:50')),
+    ('26_Tue Aug 30 10:50:50 2016_CBLTM_5.csv', ('26', 'trials', 5, '2016-08-30T10:50:50')),
+    ('sim00001_Fri Oct  2 08:05:23 2026_nback.csv', ('sim00001', 'nback', 0, '2026-10-02T08:05:23')),
+])
+def test_filename_schemes(filename, expected):
+    info = parse_filename(filename)
+    assert (info['subject'], info['kind'], info['version'], info['session_time']) == expected
+
+
+def test_other_files_are_not_data():
+    assert parse_filename('notes.txt') is None
+    assert parse_filename('26_Tue Aug 30 10:50:50 2016_CBLTM_5.log') is None
+
+
+def write_csv(path, lines):
+    with open(path, 'w') as csvfile:
+        csvfile.write('\n'.join(lines) + '\n')
+
+
+def test_time_kept_in_lr_response_is_moved_to_timestamp(tmp_path):
+    path = str(tmp_path / 'trials.csv')
+    write_csv(path, ['trial_type,correct,lr_response,rt',
+                     'flipped,1,hit,0.5',
+                     'unstudied,0,1470.25,0.75',
+                     'unstudied,1,NaN,'])
+    columns = parse_file(path, 'trials')
+    assert columns['lr_response'].tolist() == ['hit', '', '']
+    assert columns['timestamp'][1] == 1470.25
+    assert numpy.isnan(columns['timestamp'][0]) and numpy.isnan(columns['timestamp'][2])
+    assert columns['correct'].tolist() == [1, 0, 1]
+    assert numpy.isnan(columns['rt'][2])
+    assert columns['test_slot'].tolist() == [-1, -1, -1]
+
+
+def test_ingest_only_parses_changed_files(tmp_path):
+    data_dir = tmp_path / 'Experiments' / 'ex4'
+    os.makedirs(str(data_dir))
+    store_dir = str(tmp_path / 'store')
+    write_csv(str(data_dir / '26_Tue Aug 30 10_50_50 2016_CBLTM_followup_5.csv'),
+              ['trial_type,correct,timestamp', 'studied,1,1.5', 'unstudied,0,2.5', 'studied,0,3.5'])
+    write_csv(str(data_dir / '07_Wed Aug 31 09_00_00 2016_CBLTM_followup_5.csv'),
+              ['trial_type,correct,timestamp', 'studied,1,1.0'])
+    write_csv(str(data_dir / '26_Tue Aug 30 10_50_50 2016_nback.csv'),
+              ['response,index,first_occurence', 'hit,40,10'])
+    assert ingest(str(tmp_path / 'Experiments'), store_dir) == (3, 3)
+    assert ingest(str(tmp_path / 'Experiments'), store_dir) == (0, 3)
+    trials, nback, index = load_store(store_dir)
+    assert trials['subject'].tolist() == ['07', '26', '26', '26']
+    assert trials['experiment'].tolist() == [4, 4, 4, 4]
+    start, stop = index['trial_types']['4/26/studied']
+    assert trials['timestamp'][start:stop].tolist() == [1.5, 3.5]
+    assert index['subjects']['4/26'] == [1, 4]
+    assert nback['first_occurence'].tolist() == [10]
+    write_csv(str(data_dir / '07_Wed Aug 31 09_00_00 2016_CBLTM_followup_5.csv'),
+              ['trial_type,correct,timestamp', 'studied,1,1.0', 'studied,0,2.0'])
+    assert ingest(str(tmp_path / 'Experiments'), store_dir) == (1, 3)
+    trials, nback, index = load_store(store_dir)
+    assert index['subjects']['4/07'] == [0, 2]
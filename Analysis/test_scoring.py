@@ -0,0 +1,87 @@
+from statistics import NormalDist
+
+import numpy
+import pytest
+
+from scoring import bootstrap, d_prime, score
+
+
+def z(p):
+    return NormalDist().inv_cdf(p)
+
+
+def make_trials(rows):
+    # rows of (experiment, subject, trial_type, correct, lr_response)
+    experiment, subject, trial_type, correct, lr_response = zip(*rows)
+    return {'experiment': numpy.array(experiment, dtype=numpy.int16), 'subject': numpy.array(subject),
+            'trial_type': numpy.array(trial_type), 'correct': numpy.array(correct, dtype=numpy.int8),
+            'lr_response': numpy.array(lr_response)}
+
+
+def make_nback(rows):
+    # rows of (experiment, subject, source, response, index)
+    experiment, subject, source, response, index = zip(*rows) if rows else ([],) * 5
+    return {'experiment': numpy.array(experiment, dtype=numpy.int16), 'subject': numpy.array(subject, dtype=str),
+            'source': numpy.array(source, dtype=numpy.int32), 'response': numpy.array(response, dtype=str),
+            'index': numpy.array(index, dtype=numpy.int32)}
+
+
+def test_d_prime_uses_log_linear_rates():
+    d, c = d_prime(numpy.array([9]), numpy.array([10]), numpy.array([1]), numpy.array([10]))
+    z_hit, z_fa = z(9.5 / 11), z(1.5 / 11)
+    assert d[0] == pytest.approx(z_hit - z_fa)
+    assert c[0] == pytest.approx(-(z_hit + z_fa) / 2)
+    perfect, _ = d_prime(numpy.array([10]), numpy.array([10]), numpy.array([0]), numpy.array([10]))
+    assert numpy.isfinite(perfect[0])
+
+
+def test_accuracy_per_subject_and_trial_type():
+    trials = make_trials([(1, '01', 'studied', 1, ''), (1, '01', 'studied', 0, ''), (1, '01', 'studied', 1, ''),
+                          (1, '01', 'unstudied', 0, ''), (1, '02', 'studied', 1, ''), (1, '02', 'studied', -1, ''),
+                          (2, '01', 'studied', 1, '')])
+    accuracy = score(trials, make_nback([]))['accuracy']
+    rows = list(zip(accuracy['experiment'].tolist(), accuracy['subject'].tolist(), accuracy['trial_type'].tolist(),
+                    accuracy['n'].tolist(), accuracy['correct'].tolist()))
+    assert rows == [(1, '01', 'studied', 3, 2), (1, '01', 'unstudied', 1, 0), (1, '02', 'studied', 1, 1),
+                    (2, '01', 'studied', 1, 1)]
+    assert accuracy['accuracy'].tolist() == pytest.approx([2 / 3., 0, 1, 1])
+
+
+def test_flipped_codes_are_signal_and_noise_trials():
+    trials = make_trials([(4, '01', 'flipped', 1, 'hit'), (4, '01', 'flipped', 1, 'hit'),
+                          (4, '01', 'flipped', 1, 'f_n'), (4, '01', 'flipped', 0, 'f_a'),
+                          (4, '01', 'flipped', 0, 'miss'), (4, '01', 'flipped', 0, 'miss'),
+                          (4, '01', 'unstudied', 1, '')])
+    flipped = score(trials, make_nback([]))['flipped']
+    assert flipped['hit_rate'].tolist() == pytest.approx([2 / 3.])
+    assert flipped['fa_rate'].tolist() == pytest.approx([1 / 3.])
+    assert flipped['d_prime'][0] == pytest.approx(z(2.5 / 4) - z(1.5 / 4))
+
+
+def test_bootstrap_intervals_contain_the_estimates():
+    rng = numpy.random.default_rng(0)
+    rows = [(1, '%02d' % s, 'studied', int(rng.random() < .7), '') for s in range(0, 10) for t in range(0, 40)]
+    scores = score(make_trials(rows), make_nback([]))
+    summary = bootstrap(scores, resamples=2000, processes=1, seed=1)
+    accuracy = scores['accuracy']
+    assert numpy.all(accuracy['low'] <= accuracy['accuracy']) and numpy.all(accuracy['accuracy'] <= accuracy['high'])
+    assert summary['measure'].tolist() == ['studied accuracy']
+    assert summary['low'][0] <= summary['mean'][0] <= summary['high'][0]
+    again = bootstrap(score(make_trials(rows), make_nback([])), resamples=2000, processes=1, seed=1)
+    assert again['low'].tolist() == summary['low'].tolist()
+
+
+def test_nback_repeats_are_counted_per_session():
+    # session 0 has three repeats, one pressed for twice, and a false alarm; session 1 has two repeats
+    nback = make_nback([(4, '01', 0, 'hit', 12), (4, '01', 0, 'hit', 12), (4, '01', 0, 'miss', 40),
+                        (4, '01', 0, 'hit', 60), (4, '01', 0, 'f_a', 79),
+                        (4, '02', 1, 'f_a', 3), (4, '02', 1, 'hit', 20), (4, '02', 1, 'miss', 49)])
+    trials = make_trials([(4, '01', 'unstudied', 1, ''), (4, '02', 'unstudied', 1, '')])
+    table = score(trials, nback)['nback']
+    assert table['subject'].tolist() == ['01', '02']
+    assert table['lures'].tolist() == [80 - 3, 50 - 2]
+    assert table['hit'].tolist() == [2, 1]
+    assert table['hit_rate'].tolist() == pytest.approx([2 / 3., 1 / 2.])
+    assert table['fa_rate'].tolist() == pytest.approx([1 / 77., 1 / 48.])
+    fixed = score(trials, nback, stream_length=100)['nback']
+    assert fixed['lures'].tolist() == [97, 98]
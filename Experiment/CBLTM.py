@@ -1,84 +1,193 @@
-from psychopy import core, event, visual, gui, data
-from random import randint, choice, shuffle
-import os, csv, time
+from random import randint, randrange, choice, getstate, setstate
+from backends import PsychopyBackend
+from stimcache import StimulusCache
+from pools import StimulusPool
+from streams import place_repeats, study_stream, stream_plan_fields
+from triallog import TrialLog, read_log
+from timing import FrameTimer, FrameScheduler, timing_fields, timing_summary_fields
+from hittest import SlotHitTest
+from responses import ResponseCollector
+from manifest import load_manifest, check_pairs, manifest_paths
+from texturestore import texture_store_file
+from records import TrialRecord, trial_fields, experiment_fields, field_columns, write_rows, write_columns
+from planner import task_blocks, repeat_lags, repeat_sections, plan_sessions, session_plan, load_plans, check_plan
+from tracing import span, start_tracing, stop_tracing, span_summary_fields
+from trialstream import TrialStream
+from textscreens import InstructionScreens, TypedText
+import os, time
+
+# The display, input and timing modules the tasks run on. These are Psychopy's unless use_backend is called with
+# another backend, e.g. backends.HeadlessBackend to simulate sessions without a display. Psychopy itself is only
+# imported once a task first draws or reads input, so tools that just write data or work out the stimuli and the
+# array geometry load quickly, with or without a display.
+backend = core = event = visual = gui = None
+
+def use_backend(new_backend):
+    """
+    Run all tasks on a different display backend.
+
+    :param new_backend: A backend with core, event, visual and gui members and a decode_image function, such as
+                        backends.PsychopyBackend or backends.HeadlessBackend.
+    :return: None.
+    """
+    global backend, core, event, visual, gui
+    backend = new_backend
+    core, event, visual, gui = new_backend.core, new_backend.event, new_backend.visual, new_backend.gui
+
+use_backend(PsychopyBackend())
+
+# The stimulus sets and the manifest that indexes them, relative to the Experiment directory.
+stimulus_sets = {'exemplarset0': 'Stimuli/exemplarA/', 'exemplarset1': 'Stimuli/exemplarB/',
+                 'fillers': 'Stimuli/OBJECTSALL/'}
+manifest_file = 'Stimuli/manifest.json'
+
+# Text screens are laid out once per window and drawn again whenever their message comes back.
+instruction_screens = InstructionScreens(lambda window, message: visual.TextStim(
+    window, text=message, color='black', font='Helvetica', units='deg', height=.75))
+prompt_screens = InstructionScreens(lambda window, message: visual.TextStim(window, text=message))
+# how long to wait between checks for keys while a subject types, in seconds; the screen is only redrawn after a key
+key_poll_interval = .01
+
+# the blocks whose trials make up each experiment's data file, in the order they are saved
+data_blocks = {1: ['studied', 'unstudied', '6afc', 'memory'], 2: ['studied', 'ignore_first', '6afc', 'memory'],
+               3: ['unstudied', 'strategy', '6afc'], 4: ['flipped', 'unstudied', '6afc', 'memory'],
+               5: ['unstudied', 'hybrid', '6afc'], 6: ['unstudied', 'hybrid', '6afc']}
+
+def make_stim_cache(window, max_bytes=512 * 1024 ** 2, textures=None):
+    """
+    Make a StimulusCache that builds its images with the current backend.
+
+    :param window: The window the images are drawn to.
+    :param max_bytes: Integer. The most decoded pixel data to hold in memory, in bytes.
+    :param textures: The TextureStore of pre-resized images to take images from before decoding them, or None.
+    :return: A StimulusCache.
+    """
+    return StimulusCache(window, max_bytes=max_bytes, stim_type=visual.ImageStim, decoder=backend.decode_image,
+                         textures=textures)
+
+def slot_image_size(window_size):
+    """
+    :param window_size: The (width, height) of the window in pixels.
+    :return: The width and height, in pixels, that images are drawn at in the change detection arrays.
+    """
+    return .2 * window_size[1] / 2
 
-def write_data(filename, fieldnames, data):
+def array_slots(window_size, items_per_array=6):
+    """
+    Lay out the slots of a change detection array: a hexagon around the centre of the window, numbered clockwise
+    from 12 o'clock.
+
+    :param window_size: The (width, height) of the window in pixels.
+    :param items_per_array: Integer. The number of slots to lay out, at most 6.
+    :return: A (slots, slot_size) tuple. slots is the list of (x, y) centres of the slots in pixels from the centre of
+            the window, and slot_size the width and height of each slot, which is the size images are drawn at.
+    """
+    diameter = .8 * window_size[1] / 2
+    radius = diameter / 2
+    # hexagon geometry gives the centre of each of the 6 slots
+    slots = [(0, radius), (3 ** .5 * radius / 2, radius / 2), (3 ** .5 * radius / 2, -radius / 2),
+             (0, -radius), (-(3 ** .5 * radius / 2), -radius / 2), (-(3 ** .5 * radius / 2), radius / 2)]
+    return slots[:items_per_array], slot_image_size(window_size)
+
+def stimulus_sizes(window_size):
+    """
+    List the sizes other than their native size that images are drawn at, for building texture stores.
+
+    :param window_size: The (width, height) of the window in pixels.
+    :return: A list of (width, height) sizes in pixels.
+    """
+    size = int(round(slot_image_size(window_size)))
+    return [(size, size)]
+
+def make_response_collector():
+    """
+    Make a ResponseCollector that reads the keyboard of the current backend.
+
+    :return: A ResponseCollector.
+    """
+    return ResponseCollector(backend.keyboard.Keyboard(), core.wait)
+
+def write_data(filename, fieldnames, data, columns=None):
     """
     Write a list-of-lists to a csv file.
 
     :param filename: String. The filename for the csv, including the extension.
     :param fieldnames: List. The column names for the file.
-    :param data: A list of lists, in which each element is one row of the csv file.
+    :param data: A list of lists or TrialRecords, in which each element is one row of the csv file.
+    :param columns: The position in each row of every column, as from records.field_columns; the first
+                    len(fieldnames) items of each row if not given.
     :return: None.
     """
-    with open(filename, 'w') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames = fieldnames)
-        writer.writeheader()
-        for datum in data:
-            writer.writerow(dict([(fieldnames[i], datum[i]) for i in range(0, len(fieldnames))]))
-    print('Data saved to ' + os.getcwd())
+    with span('write_data', 'io', file=os.path.basename(filename)):
+        write_rows(filename, fieldnames, data, columns)
+    print('Data saved to ' + os.path.dirname(os.path.abspath(filename)))
 
 
-def display_instructions(window, message):
+def display_instructions(window, message, responses=None):
     """
     Display text instructions until a key is pressed.
 
     :param window: The Psychopy window to draw text to.
     :param message: String. The text to be displayed.
+    :param responses: The ResponseCollector to wait for the key press with. A new one is made if not given.
     :return: None.
     """
-    instructions = visual.TextStim(window, text=message, color='black', font='Helvetica', units='deg', height=.75)
-    instructions.draw(window)
-    window.flip()
-    key_pressed = False
-    while not key_pressed:
-        key_pressed = event.waitKeys()
-    window.flip()
+    if responses is None:
+        responses = make_response_collector()
+    with span('instructions', 'phase'):
+        instructions = instruction_screens.screen(window, message)
+        instructions.draw(window)
+        responses.start_on_flip(window)
+        window.flip()
+        responses.wait_keys()
+        # the keyboard does not take the key out of the event module's buffer, where the study task's repeat check
+        # and the typing of getQualData would read it as a response
+        event.clearEvents('keyboard')
+        window.flip()
 
-def draw_fixation(duration, window):
+def draw_fixation(duration, window, scheduler=None):
     """
     Draw a fixation cross for a given amount of time, then clear the window.
 
     :param duration: The amount of time to display the fixation cross, in seconds.
     :param window: The Psychopy window to draw the cross to.
+    :param scheduler: The FrameScheduler to present the cross with. A new one is made if not given.
     :return: None.
     """
+    if scheduler is None:
+        scheduler = FrameScheduler(window)
     vert_arm = visual.Line(window, start=[0, .04], end=[0, -.04], lineWidth=2, lineColor='gray')
     horiz_arm = visual.Line(window, start=[-.025, 0], end=[.025, 0], lineWidth=2, lineColor='gray')
-    horiz_arm.draw()
-    vert_arm.draw()
-    window.flip()
-    core.wait(duration)
-    window.flip()
+    scheduler.show('fixation', duration, [horiz_arm, vert_arm])
+    scheduler.flip('')
 
-def get_response(window, mode, mouse, shapes={}):
+def get_response(window, mode, mouse, responses, hit_test=None):
     """
-    Wait for and collect keyboard or mouse responses.
+    Wait for and collect keyboard or mouse responses. Response times are measured from the flip passed to
+    responses.start_on_flip, which should be the onset of the display being responded to.
 
     :param window: The active Psychopy window.
     :param mode: 'keyboard' if the response is a keypress or 'mouse' if a click.
     :param mouse: The mouse object to monitor.
-    :param shapes: A dictionary of Psychopy.visual shapes to monitor for a click.
-    :return: The keycode of the key pressed or the index of the shape clicked on.
+    :param responses: The ResponseCollector to collect the response with.
+    :param hit_test: The SlotHitTest that maps a click to the slot it landed in.
+    :return: A (response, response time) tuple, where the response is the name of the key pressed or the number of
+            the slot clicked on.
     """
     if mode == 'keyboard':
-        response = ''
-        while not response:
-            response = event.getKeys(keyList=['left', 'right'])
+        response, rt = responses.wait_keys(['left', 'right'])
     elif mode == 'mouse':
         #get mouse input
         mouse.setVisible(1)
         mouse.clickReset()
         mouse.setPos((0, 0))
-        response = ''
-        while not response:
-            for shape in shapes.keys():
-                if mouse.isPressedIn(shape):
-                   response = shapes[shape]
+        response, rt = responses.wait_click(mouse, hit_test)
     mouse.setVisible(0)
-    return response
+    return response, rt
 
-def object_study_task(window, studied_ims, duration, ISI, fillers=[], include_repeats=False):
+def object_study_task(window, studied_ims, duration, ISI, fillers=None, include_repeats=False, stim_cache=None,
+                      plan_file=None, trial_log=None, scheduler=None, responses=None, repeat_positions=None,
+                      lags=None):
     """
     Run the object-study portion of the experiment.
 
@@ -86,8 +195,19 @@ def object_study_task(window, studied_ims, duration, ISI, fillers=[], include_re
     :param studied_ims: The list of filepaths for the images to be studied.
     :param duration: How long each item is presented for, in seconds.
     :param ISI: How long to blank the screen between each item, in seconds.
-    :param fillers: The list of filepaths for filler objects from which to draw repeats.
+    :param fillers: The StimulusPool of filler filepaths from which to draw repeats.
     :param include_repeats: Whether or not to insert duplicate items into the stream.
+    :param stim_cache: The StimulusCache to draw images from. A new one is made if not given.
+    :param plan_file: String. If given, the study stream is saved to this csv before presentation starts.
+    :param trial_log: The TrialLog to write each response to repeated items to as it is made.
+    :param scheduler: The FrameScheduler to present the fixations and study items with. A new one is made if not given.
+    :param responses: The ResponseCollector to wait for key presses on the instruction screens with.
+    :param repeat_positions: A list of (start, lag) pairs giving the position in the stream where each repeated item
+                             is first shown and how many positions later it is shown again, as from a session plan.
+                             Placed at random, with no repeat shown inside the span of another, if not given.
+    :param lags: The lag of every repeat to place at random when repeat_positions is not given, spread over the
+                 stretches of the stream as for streams.place_repeats; planner.repeat_lags in each of
+                 planner.repeat_sections stretches by default.
     :return: A list of lists of subjects' responses to repeated items, or none if not in repeat mode.
     """
     if include_repeats:
@@ -99,119 +219,142 @@ def object_study_task(window, studied_ims, duration, ISI, fillers=[], include_re
         study_instructions = "In this first task, you will be presented with a series of objects. Please observe the objects closely, " \
         "as you will be given a memory test later in the session.\n\nIf you have any questions, the " \
         "experimenter will be happy to answer them. If you are ready to begin, press any key."
-    display_instructions(window, study_instructions)
-    studied_stream = list(studied_ims)
+    if stim_cache is None:
+        stim_cache = make_stim_cache(window)
+    if scheduler is None:
+        scheduler = FrameScheduler(window)
+    repeated_ims = []
     if include_repeats:
-        # Randomly pick how many and which objects to repeat and insert randomly into the image stream
         repeat_responses = []
-        repeats = 6
-        repeated_ims = []
-        for i in range(0, repeats):
-            im = fillers[randint(0, len(fillers) - 1)]
-            fillers.remove(im)
-            repeated_ims.append([im] * 2)
+        if repeat_positions is None:
+            if lags is None:
+                lags = repeat_lags * repeat_sections
+            repeat_positions = place_repeats(len(studied_ims), lags, sections=repeat_sections)
+        repeated_ims = fillers.draw_many(len(repeat_positions))
         hit = visual.Rect(window, width=.2*window.size[1], height=.2*window.size[1], lineColor='green', fillColor='green', opacity=.4, units='pix')
-        # insert repeated ims into study stream
-        dists0 = [10, 30, 60]
-        dists1 = [10, 30, 60]
-        for i in range(0, len(repeated_ims)):
-            if i < len(repeated_ims) / 2:
-               start = randint(0, len(studied_stream) / 2 - 60)
-               dist = choice(dists0)
-               dists0.remove(dist)
-            else:
-               start = randint(len(studied_stream) / 2, len(studied_stream) - 60)
-               dist = choice(dists1)
-               dists1.remove(dist)
-            studied_stream.insert(start, repeated_ims[i][0])
-            studied_stream.insert(start + dist, repeated_ims[i][1])
-    im_clock = core.Clock()
-    for i in range(0, len(studied_stream)):
+    # the stream is laid out an item at a time as it is shown, each item with the position it was first shown at and
+    # whether it is a repeat, so that scoring a keypress is a lookup rather than a scan of the stream
+    if plan_file:
+        write_data(plan_file, stream_plan_fields, study_stream(studied_ims, repeated_ims, repeat_positions or []))
+    stream = study_stream(studied_ims, repeated_ims, repeat_positions or [])
+    stream_length = len(studied_ims) + 2 * len(repeated_ims)
+    # decode the first item while the instructions are up, and each following item while the previous one is shown
+    upcoming = next(stream, None)
+    if upcoming is not None:
+        stim_cache.prefetch([upcoming[1]])
+    display_instructions(window, study_instructions, responses)
+
+    def check_for_repeat(frame):
+        # called after every frame of a study item; the hit highlight is drawn from the next frame on
+        nonlocal permaflag
+        flagged_repeat = event.getKeys(['space'])
+        if flagged_repeat and is_repeat:
+            permaflag = True
+            hit.setAutoDraw(True)
+            repeat_responses.append(('hit', i, first_occurrence))
+        elif flagged_repeat:
+            repeat_responses.append(('f_a', i, first_occurrence))  # false alarm
+
+    logged = 0
+    while upcoming is not None:
+        i, image, first_occurrence, is_repeat = upcoming
+        upcoming = next(stream, None)
         permaflag = False
-        draw_fixation(ISI, window)
-        im_present = visual.ImageStim(window, image=studied_stream[i], units='deg')
-        im_present.setAutoDraw(True)
-        im_clock.reset()
-        while im_clock.getTime() < duration:
-            im_present.draw()
-            window.flip()
-            if include_repeats:
-                flagged_repeat = event.getKeys(['space'])
-                if flagged_repeat and (studied_stream.count(studied_stream[i]) > 1) and (
-                    i > studied_stream.index(studied_stream[i])):
-                    permaflag = True
-                    hit.setAutoDraw(True)
-                    hit.draw()
-                    window.flip()
-                    repeat_responses.append(('hit', i, studied_stream.index(studied_stream[i])))
-                elif flagged_repeat:
-                    repeat_responses.append(('f_a', i, studied_stream.index(studied_stream[i])))  # false alarm
+        if scheduler.frame_timer is not None:
+            scheduler.frame_timer.trial = i
+        draw_fixation(ISI, window, scheduler)
+        with span('object_study_task setup', 'trial', trial=i):
+            im_present = stim_cache.stim(image, units='deg')
+            if upcoming is not None:
+                stim_cache.prefetch([upcoming[1]])
+        with span('object_study_task present', 'trial', trial=i):
+            scheduler.show('study', duration, [im_present], each_frame=check_for_repeat if include_repeats else None)
         if include_repeats:
             hit.setAutoDraw(False)
-            if (not permaflag) and (studied_stream.count(studied_stream[i]) > 1) and (i > studied_stream.index(studied_stream[i])):
-                repeat_responses.append(('miss', i, studied_stream.index(studied_stream[i])))
-        im_present.setAutoDraw(False)
-        window.flip()
-        if ((i + 1) == len(studied_stream) // 2):
+            if (not permaflag) and is_repeat:
+                repeat_responses.append(('miss', i, first_occurrence))
+            if trial_log is not None:
+                for repeat_response in repeat_responses[logged:]:
+                    trial_log.trial(repeat_response)
+                logged = len(repeat_responses)
+        scheduler.flip('')
+        if ((i + 1) == stream_length // 2):
             break_message = "You are halfway through the study task. Take a brief break. Press any key to resume."
-            display_instructions(window, break_message)
+            display_instructions(window, break_message, responses)
     return repeat_responses if include_repeats else None
 
-def object_memory_task(window, mouse, studied_ims, studied_complement, trials, ISI):
+def object_memory_task(window, mouse, studied_pairs, trials, ISI, stim_cache=None, trial_log=None, scheduler=None,
+                       responses=None, test_sides=None):
     """
     Present the 2AFC memory test task. Takes in lists of studied and filler items.
     Category selection of images is random on each trial, but the test and foil objects will always come from the
     same category.
     :param window: The Psychopy window on which to present the task.
     :param mouse: The mouse object in use.
-    :param studied_ims: The list of filenames of the studied images.
-    :param studied_complement: The list of exemplars corresponding to each study item.
+    :param studied_pairs: A StimulusPool of (studied image, complement exemplar) filename pairs.
     :param trials: The number of trials of the task to run.
     :param ISI: How long to wait between each trial.
-    :return: A list of lists of subjects' responses, whether it was correct, and which items were shown
-            on each trial.
+    :param stim_cache: The StimulusCache to draw images from. A new one is made if not given.
+    :param trial_log: The TrialLog to write each trial to as it finishes.
+    :param scheduler: The FrameScheduler to time the blank between trials with. A new one is made if not given.
+    :param responses: The ResponseCollector to collect key presses with. A new one is made if not given.
+    :param test_sides: The side of the studied image on each trial, 0 for left and 1 for right, as from a session
+                       plan. Drawn at random if not given.
+    :return: A list of TrialRecords of subjects' responses, whether it was correct, which items were shown and the
+            response time from the onset of the pair on each trial.
     """
     memory_instructions = "In this task, you will be presented with pairs of images. You will have seen one of them before during the study " \
     "portion of this experiment. If it is the image on the left, use the left arrow key to respond. If it is on the right, " \
     "use the right arrow key. If you are not sure or cannot remember, respond with your best guess. If you have any " \
     "questions, the experimenter will be happy to answer them. If you are ready to begin, press any key."
-    display_instructions(window, memory_instructions)
+    if stim_cache is None:
+        stim_cache = make_stim_cache(window)
+    if scheduler is None:
+        scheduler = FrameScheduler(window)
+    if responses is None:
+        responses = make_response_collector()
     coords = [(-1*window.size[0]/4, 0), (window.size[0]/4, 0)]
+    # pick every pair up front so that the next pair can be decoded while the current one is on screen
+    pairs = studied_pairs.draw_many(trials)
+    stim_cache.prefetch(pairs[0] if pairs else [])
+    display_instructions(window, memory_instructions, responses)
     object_responses = []
     for i in range(0, trials):
-        trial_data = []
-        trial_data.append('memory')
-        trial_idx = randint(0, len(studied_ims) - 1)
-        test_item = studied_ims[trial_idx]
-        studied_ims.remove(test_item)
-        foil_item = studied_complement[trial_idx]
-        studied_complement.remove(foil_item)
+        test_item, foil_item = pairs[i]
+        if scheduler.frame_timer is not None:
+            scheduler.frame_timer.trial = i
         #present image and foil; hold until response is received
-        test_side = choice([0, 1])
-        test_image = visual.ImageStim(window, image=test_item, units='pix', pos=coords[test_side])
-        foil_image = visual.ImageStim(window, image=foil_item, units = 'pix', pos=coords[not test_side])
-        test_image.draw()
-        foil_image.draw()
-        window.flip()
-        resp = get_response(window, mode='keyboard', mouse=mouse)
-        window.flip()
-        core.wait(ISI)
+        test_side = test_sides[i] if test_sides is not None else choice([0, 1])
+        with span('object_memory_task setup', 'trial', trial=i):
+            test_image = stim_cache.stim(test_item, units='pix', pos=coords[test_side])
+            foil_image = stim_cache.stim(foil_item, units='pix', pos=coords[not test_side])
+            if i + 1 < trials:
+                stim_cache.prefetch(pairs[i + 1])
+        with span('object_memory_task present', 'trial', trial=i):
+            test_image.draw()
+            foil_image.draw()
+            responses.start_on_flip(window)
+            scheduler.flip('')
+        with span('object_memory_task respond', 'trial', trial=i):
+            resp, rt = get_response(window, 'keyboard', mouse, responses)
+        response_time = core.getTime()
+        scheduler.show('iti', ISI)
         #add to response record
-        if (resp == ['left'] and test_side == 0) or (resp == ['right'] and test_side == 1):
+        if (resp == 'left' and test_side == 0) or (resp == 'right' and test_side == 1):
             response = 1
         else:
             response = 0
-        trial_data.append(response)
-        trial_data.append(resp[0])
-        trial_data.append(test_item)
-        trial_data.append(foil_item)
-        trial_data.append(core.getTime())
-        trial_data.append([foil_item, test_item][response])
-        trial_data = trial_data + [0, 0, 0, 0, 0] #add the null fillers
+        trial_data = TrialRecord(trial_type='memory', correct=response, raw_response=resp, test_image=test_item,
+                                 bait_image=foil_item, timestamp=response_time,
+                                 response_image=[foil_item, test_item][response], fillers=[0, 0, 0, 0, 0], rt=rt)
         object_responses.append(trial_data)
+        if trial_log is not None:
+            trial_log.trial(trial_data)
+    scheduler.flip('')
     return object_responses
 
-def cd_task(mode, window, mouse, slots, slot_size, targets, prechange, fillers, items_per_array, trials, prechange_dur, ISI):
+def cd_task(mode, window, mouse, slots, slot_size, targets, fillers, items_per_array, trials, prechange_dur, ISI, stim_cache=None,
+            trial_log=None, scheduler=None, hit_test=None, responses=None, test_slots=None):
     """
     Present the 6AFC memory task or a change detection task.
 
@@ -222,14 +365,22 @@ def cd_task(mode, window, mouse, slots, slot_size, targets, prechange, fillers,
     :param mouse: The mouse object to monitor for clicks.
     :param slots: The positions of each image, as a list of (x, y) tuples.
     :param slot_size: The size of each slot, and therefore the size of each image.
-    :param targets: A list of filenames for each of the post-change objects.
-    :param prechange: A list of filenames for each of the pre-change objects.
-    :param fillers: A list of filenames of filler objects that do not change on each trial.
+    :param targets: A StimulusPool of (post-change, pre-change) filename pairs, one drawn per trial.
+    :param fillers: A StimulusPool of filenames of filler objects that do not change on each trial.
     :param items_per_array: The number of items to present on each trial.
     :param trials: The number of trials to run.
     :param prechange_dur: How long the prechange array remains visible, in seconds
     :param ISI: The blank between the pre-change and post-change array, in seconds.
-    :return: A list of lists containing the subjects' responses and details about the display.
+    :param stim_cache: The StimulusCache to draw images from. A new one is made if not given.
+    :param trial_log: The TrialLog to write each trial to as it finishes.
+    :param scheduler: The FrameScheduler to present the pre-change array and ISI with. A new one is made if not given.
+    :param hit_test: The SlotHitTest that maps clicks to slots. A new one is made from slots and slot_size if not given.
+    :param responses: The ResponseCollector to collect clicks and key presses with. A new one is made if not given.
+    :param test_slots: The slot of the changing item on each trial, numbered from 1, as from a session plan. Drawn at
+                       random if not given.
+    :return: A list of TrialRecords containing the subjects' responses, details about the display, the response
+            time in seconds from the onset of the post-change array and, in "flipped" mode, the answer to the
+            follow-up question and its response time.
     """
     if mode == '6afc':
         instructions = "In this task, you will be presented with a series of arrays of six images. You will have seen one of them before " \
@@ -266,167 +417,245 @@ def cd_task(mode, window, mouse, slots, slot_size, targets, prechange, fillers,
         "\n\nIf you have difficulty remembering, see if you can tell which object is different from the first array. If an object changes from the " \
         "first array, it will always change into a familiar object, so this can help you identify it.\n\nIf you have any questions, the experimenter "\
         "will be happy to answer them. Press any key to begin."
-    display_instructions(window, instructions)
-    cd_data = []
+    if stim_cache is None:
+        stim_cache = make_stim_cache(window)
+    if scheduler is None:
+        scheduler = FrameScheduler(window)
+    if hit_test is None:
+        hit_test = SlotHitTest(slots[:items_per_array], slot_size)
+    if responses is None:
+        responses = make_response_collector()
+    # pick the stimuli for every trial up front so that the next trial can be decoded during the current one
+    trial_plans = []
     for i in range(0, trials):
-        trial_data = []
-        trial_data.append(mode)
-        test_slot = randint(1, items_per_array)
-        trial_idx = randint(0, len(targets) - 1)
-        test_im = targets[trial_idx]
-        targets.remove(test_im)
-        bait_im = prechange[trial_idx]
-        prechange.remove(bait_im)
-        filler_ims = []
-        for slot in range(1, items_per_array + 1):
-            filler_im = choice(fillers)
-            filler_ims.append(filler_im)
-            fillers.remove(filler_im)
-        # create a dictionary with the slot number mapped to the image it will contain; does not include
-        # the test image, which will be overwritten in the full-CD mode branch
-        # here, convert image index to ImageStim by indexing out of the 'images' argument
-        # Because ImageStim objects do not have an "isPressedIn" method, draw invisible Rect objects
-        # over the top. Monitor these for a click instead.
-        image_pos = {}
-        ghosts = {}
-        for i in range(1, items_per_array + 1):
-            ghosts[
-                visual.Rect(window, pos=slots[i - 1], units='pix', width=slot_size, height=slot_size,
-                            opacity=0.0)] = i
-            if i == test_slot:
-                if mode != '6afc':
-                    image_pos[i] = visual.ImageStim(window, image=bait_im, size=slot_size, units='pix',
-                                                    pos=slots[i - 1])
+        test_slot = test_slots[i] if test_slots is not None else randint(1, items_per_array)
+        test_im, bait_im = targets.draw()
+        filler_ims = fillers.draw_many(items_per_array)
+        trial_plans.append((test_slot, test_im, bait_im, filler_ims))
+    stim_cache.prefetch(_cd_trial_images(trial_plans[0]) if trial_plans else [])
+    display_instructions(window, instructions, responses)
+    cd_data = []
+    for trial in range(0, trials):
+        test_slot, test_im, bait_im, filler_ims = trial_plans[trial]
+        if scheduler.frame_timer is not None:
+            scheduler.frame_timer.trial = trial
+        with span('cd_task setup', 'trial', mode=mode, trial=trial):
+            # create a dictionary with the slot number mapped to the image it will contain; does not include
+            # the test image, which will be overwritten in the full-CD mode branch
+            image_paths = {}
+            for i in range(1, items_per_array + 1):
+                if i == test_slot:
+                    image_paths[i] = bait_im if mode != '6afc' else test_im
                 else:
-                    image_pos[i] = visual.ImageStim(window, image=test_im, size=slot_size, units='pix',
-                                                    pos=slots[i - 1])
-            else:
-                image_pos[i] = visual.ImageStim(window, image=filler_ims[i - 1], size=slot_size, units='pix',
-                                                pos=slots[i - 1])
-        # initialize the visual.ImageStims and transparent "ghost shapes",
-        # draw them to the screen, then collect response
-        if mode != '6afc':
-            for i in image_pos.keys():
-                img = image_pos[i]
-                img.draw(window)
-            window.flip()
-            core.wait(prechange_dur)
-            window.flip()
-            core.wait(ISI)
-            image_pos[test_slot] = visual.ImageStim(window, image=test_im, size=slot_size, units='pix', pos=slots[test_slot - 1])
-        for i in image_pos.keys():
-            img = image_pos[i]
-            img.draw(window)
-            list(ghosts.keys())[i - 1].draw(window)
-        window.flip()
-        response = get_response(window, 'mouse', mouse, ghosts)
-        window.flip()
-        if response == test_slot:
-            correct = 1
-        else:
-            correct = 0
-        if mode == 'flipped':
-            strat_inst = "Did the object you picked change from the first array? Please use the arrow keys to respond, " \
-            "left for 'no' and right for 'yes'."
-            instructions = visual.TextStim(window, text=strat_inst)
-            instructions.draw(window)
+                    image_paths[i] = filler_ims[i - 1]
+            image_pos = dict([(i, stim_cache.stim(image_paths[i], units='pix', size=slot_size, pos=slots[i - 1]))
+                              for i in image_paths.keys()])
+            if trial + 1 < trials:
+                stim_cache.prefetch(_cd_trial_images(trial_plans[trial + 1]))
+            # the post-change array is finished off a step per frame while the ISI is up, so that the work cannot
+            # hold up a frame of the pre-change array
+            post_pos = dict(image_pos)
+            arrays = {}
+            prepare = _prepare_response_array(window, stim_cache, slots, slot_size, post_pos, test_slot, test_im,
+                                              arrays)
+            if mode != '6afc':
+                prechange_array = composite_array(window, [image_pos[i] for i in sorted(image_pos.keys())])
+        # draw the arrays to the screen, then collect response
+        with span('cd_task present', 'trial', mode=mode, trial=trial):
+            if mode != '6afc':
+                scheduler.show('prechange', prechange_dur, [prechange_array])
+                scheduler.show('isi', ISI, idle=prepare)
+                image_paths[test_slot] = test_im
+            for step in prepare:
+                pass
+            arrays['postchange'].draw(window)
+            responses.start_on_flip(window)
+            scheduler.flip('')
+        with span('cd_task respond', 'trial', mode=mode, trial=trial):
+            response, rt = get_response(window, 'mouse', mouse, responses, hit_test=hit_test)
             window.flip()
-            lr_input = get_response(window, 'keyboard', mouse=mouse)
-            if lr_input==['right']:
-                if correct:
-                   lr_response = 'hit' #picked right object and noticed change
-                elif not correct:
-                   lr_response='f_a' #picked wrong object, declared change
-            elif lr_input==['left']:
-                if correct:
-                   lr_response = 'f_n' #picked right object, said no change
-                elif not correct:
-                   lr_response = 'miss' #wrong object, no change
+            if response == test_slot:
+                correct = 1
             else:
-                lr_correct = 0
-        trial_data.append(correct)
-        trial_data.append(response)
-        trial_data.append(test_im)
-        trial_data.append(bait_im)
+                correct = 0
+            if mode == 'flipped':
+                strat_inst = "Did the object you picked change from the first array? Please use the arrow keys to respond, " \
+                "left for 'no' and right for 'yes'."
+                instructions = prompt_screens.screen(window, strat_inst)
+                instructions.draw(window)
+                responses.start_on_flip(window)
+                window.flip()
+                lr_input, lr_rt = get_response(window, 'keyboard', mouse, responses)
+                if lr_input=='right':
+                    if correct:
+                       lr_response = 'hit' #picked right object and noticed change
+                    elif not correct:
+                       lr_response='f_a' #picked wrong object, declared change
+                elif lr_input=='left':
+                    if correct:
+                       lr_response = 'f_n' #picked right object, said no change
+                    elif not correct:
+                       lr_response = 'miss' #wrong object, no change
+        trial_data = TrialRecord(trial_type=mode, correct=correct, raw_response=response, test_image=test_im,
+                                 bait_image=bait_im, timestamp=core.getTime(), response_image=image_paths[response],
+                                 fillers=filler_ims, rt=rt, test_slot=test_slot)
         if mode == 'flipped':
-            trial_data.append(lr_response)
-        else:
-            trial_data.append(core.getTime())
-        trial_data.append(image_pos[response].image)
-        [trial_data.append(filler) for filler in filler_ims]
+            trial_data.lr_response = lr_response
+            trial_data.lr_rt = lr_rt
         cd_data.append(trial_data)
+        if trial_log is not None:
+            trial_log.trial(trial_data)
     return cd_data
 
-def getQualData(window):
+def composite_array(window, stims):
+    """
+    Draw an array of stimuli offscreen and capture it as a single stimulus, so that showing the array takes one draw
+    call however many images it holds. The stimuli can be moved or reused afterwards without changing the capture.
+
+    :param window: The Psychopy window the array is drawn to.
+    :param stims: The list of stimuli that make up the array.
+    :return: A BufferImageStim of the array.
+    """
+    return visual.BufferImageStim(window, stim=stims)
+
+def _prepare_response_array(window, stim_cache, slots, slot_size, image_pos, test_slot, test_im, arrays):
+    """
+    Finish building the post-change array of a change detection trial, then composite it.
+    This is a generator, so that the steps can be run in the idle time of the frames before the array is shown.
+
+    :param window: The Psychopy window the array is drawn to.
+    :param stim_cache: The StimulusCache to draw images from.
+    :param slots: The positions of each image, as a list of (x, y) tuples.
+    :param slot_size: The size of each slot, and therefore the size of each image.
+    :param image_pos: The dictionary of slot numbers to ImageStims; the test image is put into its slot.
+    :param test_slot: The slot number of the test image.
+    :param test_im: The filepath of the test image.
+    :param arrays: The dictionary to put the composited array into, under 'postchange'.
+    :return: A generator that yields once the test image is built.
+    """
+    image_pos[test_slot] = stim_cache.stim(test_im, units='pix', size=slot_size, pos=slots[test_slot - 1])
+    yield
+    arrays['postchange'] = composite_array(window, [image_pos[i] for i in sorted(image_pos.keys())])
+
+def _cd_trial_images(trial_plan):
+    """
+    List every image a change detection trial will draw.
+
+    :param trial_plan: A (test_slot, test_im, bait_im, filler_ims) tuple.
+    :return: A list of filepaths.
+    """
+    test_slot, test_im, bait_im, filler_ims = trial_plan
+    return [test_im, bait_im] + filler_ims
+
+def getQualData(window, trial_log=None, responses=None):
     """
     Run the qualitative data task. Subjects are presented with a screen on which to type.
     :param window: The Psychopy window on which to show the text.
+    :param trial_log: The TrialLog to write the response to once it is entered.
+    :param responses: The ResponseCollector to wait for a key press on the instruction screen with.
     :return: The string that subjects' typed.
     """
     qinst = "Please describe your approach to the task you just completed. Did you find it easier or harder than "\
     "the first task you completed? Were you able to use the provided strategy? Did the strategy help, or did you find it hard to "\
     "use or unituitive? Please respond with a few sentences. When you have finished entering your response, please press the enter key." \
     "Press any key to advance to the next screen and begin typing."
-    display_instructions(window, qinst)
-    strat=''
-    echo = visual.TextStim(window, text=strat,color="black", units='deg', height = .5, wrapWidth = 12)
+    display_instructions(window, qinst, responses)
+    echo = visual.TextStim(window, text='', color="black", units='deg', height = .5, wrapWidth = 12)
     echo.setAutoDraw(True)
-    #until return pressed, listen for letter keys & add to text string
-    cap_next = True
-    punctuation = {'period': '.', 'space': ' ', 'apostrophe':"'", 'question': '?', 'exclamation': '!',
-                   'comma': ',', 'colon':':', 'semicolon':';', 'parenleft': '(', 'parenright':')'}
-    while event.getKeys(keyList=['return'])==[] or len(strat) == 0:
-        letterlist=event.getKeys()
-        for l in letterlist:
-            if l == 'lshift':
-                cap_next = True
-            elif l =='backspace' and len(strat) > 0:
-                strat=strat[:-1]
-            elif l in punctuation.keys():
-                strat += punctuation[l]
-            elif l != 'backspace' and not len(l) > 1:
-                if cap_next:
-                   strat += l.capitalize()
-                   cap_next = False
-                else:
-                   strat += l
-        #continually redraw text onscreen until return pressed
-        echo.setText(strat)
-        window.flip()
+    typed = TypedText(echo)
+    #until return pressed, listen for letter keys & add to text string; the text is only laid out and the window only
+    #flipped after a key changed it, and between keys the loop sleeps rather than spinning
+    entered = False
+    while not entered:
+        keys = event.getKeys()
+        for key in keys:
+            if key == 'return':
+                if typed.text:
+                    entered = True
+                    break
+            else:
+                typed.press(key)
+        if typed.update():
+            window.flip()
+        elif not keys:
+            core.wait(key_poll_interval, hogCPUperiod=0)
+    strat = typed.text
     echo.setAutoDraw(False)
     event.clearEvents()
+    if trial_log is not None:
+        trial_log.trial([strat])
     return strat
 
-def run_experiment(experiment, win):
+def run_experiment(experiment, win, resume_log=None, data_dir='', plan_file=None, collector=None, trials_per_task=1,
+                   record_spans=False):
     """
     Run a particular experiment from beginning to end and save the data.
 
+    Every trial is streamed to a session log as it finishes. If a session is cut short, passing its log as
+    resume_log skips the blocks that were finished, restores the stimulus assignment and random state saved after the
+    last of them, and carries on from the next block.
+
+    Every stimulus assignment and randomised choice of the session comes from a session plan, which is saved in the
+    session log. It is the subject's plan in plan_file if one is given, as made by planner.py for a whole cohort, and
+    otherwise a plan drawn for this session alone.
+
+    If a collector is given, every trial is also streamed to it as it finishes, for Analysis/collector.py to merge with
+    the sessions of the other stations. Trials it cannot take wait in a spool file next to the session log.
+
     :param experiment: The integer of the experiment to run.
     :param win: The Psychopy window to use.
+    :param resume_log: String. The log file of an interrupted session to resume, or None to start a new session.
+    :param data_dir: String. The directory to save data files to; the working directory by default.
+    :param plan_file: String. The file of session plans to take the subject's plan from, or None.
+    :param collector: The address of the collector to stream trials to, as 'host:port', or None.
+    :param trials_per_task: Integer. The number of trials of each task. It sets how many exemplars are studied, so
+                            experiment 4 needs enough of them for the repeats of its study stream; a resumed session
+                            keeps the number it was started with.
+    :param record_spans: Whether to time the setup, every block and the stages of every trial, and save the spans as
+                         a Chrome trace and a latency summary next to the data.
     :return: None.
     """
-    # import images
-    exemplar0 = 'Stimuli/exemplarA/'
-    exemplar1 = 'Stimuli/exemplarB/'
-    fillers = 'Stimuli/OBJECTSALL/'
-
-    images = {'exemplarset0': [exemplar0 + im for im in sorted(os.listdir(exemplar0))[1:]],
-              'exemplarset1': [exemplar1 + im for im in sorted(os.listdir(exemplar1))[1:]],
-              'fillers': [fillers + im for im in sorted(os.listdir(fillers))[1:]]}
-
-    # subject info
-    exp_info = {'SubjID': ''}
-    ex_info_dlg = gui.DlgFromDict(dictionary=exp_info, title='Experiment Log')
+    if record_spans:
+        start_tracing()
+
+    # import images; the manifest is only rebuilt for directories that changed since it was saved, and a missing,
+    # unreadable or unpaired exemplar stops the session before it starts
+    with span('load manifest', 'setup'):
+        manifest = load_manifest(manifest_file, stimulus_sets)
+        check_pairs(manifest, 'exemplarset0', 'exemplarset1')
+    images = manifest_paths(manifest)
+
+    if resume_log:
+        session, finished, saved_state = read_log(resume_log)
+        if session is None:
+            raise ValueError('%s has no session record' % resume_log)
+        if session['experiment'] != experiment:
+            raise ValueError('%s is a log of experiment %d, not %d' % (resume_log, session['experiment'], experiment))
+        exp_info = {'SubjID': session['subject']}
+        session_time = session['time']
+        log_name = resume_log
+        # the stimuli are restored from the saved state below; logs from before session plans have no plan, and their
+        # blocks draw at random from the saved random state
+        plan = session.get('plan', {'exemplars': [], 'exemplar_sets': [], 'studied_order': [], 'fillers': [],
+                                    'blocks': {}})
+        trials_per_task = plan.get('trials_per_task', trials_per_task)
+    else:
+        finished = {}
+        # subject info
+        exp_info = {'SubjID': ''}
+        ex_info_dlg = gui.DlgFromDict(dictionary=exp_info, title='Experiment Log')
+        session_time = time.strftime("%c")
+        log_name = os.path.join(data_dir, exp_info['SubjID'] + '_' + session_time + '_CBLTM_' + str(experiment) + '.log')
     # output file
-    file_name = exp_info['SubjID'] + '_' + time.strftime("%c") + '_CBLTM_'+ str(experiment) + '.csv'
+    file_name = os.path.join(data_dir, exp_info['SubjID'] + '_' + session_time + '_CBLTM_'+ str(experiment) + '.csv')
+    # output file nback
+    nback_file_name = os.path.join(data_dir, exp_info['SubjID'] + '_' + session_time + '_nback.csv')
+    nback_field_names = ['response', 'index', 'first_occurence']
 
     # Initialize mouse
     mouse = event.Mouse(win)
     mouse.setVisible(0)
 
-    # image categories and order
-    trials_per_task = 1
-
     # study task parameters
     study_dur = 3
     ISI_study = .5
@@ -435,47 +664,117 @@ def run_experiment(experiment, win):
     items_per_array = 6
     prechange_dur = 5 if experiment > 4 else 1.2
     ISI_cd = .4
-    imsize = .2*win.size[1] / 2
-    # carve up the window into a grid with the approprite number of slots
-    # used to draw items and to draw the transparent shapes that will be used for mouse input
-    diameter = .8*win.size[1] / 2
-    radius = diameter / 2
-    slot_size = imsize  # this is the size of the images used; slot will be precisely as large
-    # These coordinates represent the center of the "slot" to which the images will be drawn. The slots are numbered
-    # clockwise, starting at 12 o'clock.
-    # This utilizes hexagon geometry to calculate the center of the 6 slots.
-    slots = [(0, radius), (3 ** .5 * radius / 2, radius / 2), (3 ** .5 * radius / 2, -radius / 2),
-             (0, -radius), (-(3 ** .5 * radius / 2), -radius / 2), (-(3 ** .5 * radius / 2), radius / 2)]
-
-    #How many tasks requiring studied and unstudied images, respectively, there are in each
-    #experiment.
-    task_blocks = {1: (3, 1), 2: (4, 0), 3: (2, 1), 4: (3, 1), 5: (2, 1), 6: (2, 1)}[experiment]
+    # carve up the window into slots, used to draw items and to draw the transparent shapes that will be used for
+    # mouse input; each slot is precisely as large as the images drawn in it
+    slots, slot_size = array_slots(win.size)
+    # clicks are mapped to slots by checking them against the bounds of every slot at once
+    hit_test = SlotHitTest(slots[:items_per_array], slot_size)
+
+    # key presses and clicks are timed from the onset of whatever they respond to
+    responses = make_response_collector()
+
+    # save the trials as binary columns next to the csv as well, for loading without parsing
+    save_columns = True
+
+    # decoded images are shared by every task; once the cache is full the least recently drawn are dropped. If
+    # texturestore.py has been run for this window size, images come pre-resized from its store instead of being
+    # decoded at all
+    cache_size_mb = 512
+    with span('load textures', 'setup'):
+        textures = backend.load_textures(texture_store_file(win.size), manifest)
+    stim_cache = make_stim_cache(win, max_bytes=cache_size_mb * 1024 ** 2, textures=textures)
+
+    # time stamp every flip of the fixations, study items, pre-change arrays and ISIs
+    record_frame_timing = True
+    measured_rate = win.getActualFrameRate() if hasattr(win, 'getActualFrameRate') else None
+    frame_dur = 1. / measured_rate if measured_rate else None
+    frame_timer = FrameTimer(win, core.getTime, frame_dur) if record_frame_timing else None
+    # every timed phase is held for a whole number of frames, worked out here once for the session
+    scheduler = FrameScheduler(win, frame_dur, frame_timer, durations=[study_dur, ISI_study, prechange_dur, ISI_cd])
+
+    # the plan's exemplars are studied first, then unstudied; planner.task_blocks has how many of each an experiment uses
+    n_studied = task_blocks[experiment][0] * trials_per_task
+
+    if not resume_log:
+        with span('plan session', 'setup'):
+            if plan_file:
+                plan = session_plan(load_plans(plan_file), exp_info['SubjID'])
+            else:
+                plan = session_plan(plan_sessions(experiment, [exp_info['SubjID']], len(images['exemplarset0']),
+                                                  len(images['fillers']), trials_per_task, items_per_array,
+                                                  seed=randrange(2 ** 32)), exp_info['SubjID'])
+        check_plan(plan, experiment, len(images['exemplarset0']), len(images['fillers']), trials_per_task,
+                   items_per_array)
 
-    # Select studied and unstudied images. Both need to come from the exemplar sets.
+    # Select studied and unstudied images, as the plan lays them out. Both need to come from the exemplar sets.
     # Studied images will be used in the memory and change blindness tasks, and
     # unstudied images will be used in the baseline change blindness task.
-
-    allexemplars = list(range(0, len(images['exemplarset0'])))
-    shuffle(allexemplars)
-
     studied = []
     studied_complement = []
     unstudied = []
     unstudied_complement = []
     exemplar_choices = ['exemplarset0', 'exemplarset1']
-    for i in range(0, task_blocks[0] * trials_per_task):
-        exemplar_id = allexemplars[i]
-        first_member = choice([0, 1])
+    for i in range(0, len(plan['exemplars'])):
+        exemplar_id = plan['exemplars'][i]
+        first_member = plan['exemplar_sets'][i]
         exemplar_pair = exemplar_choices[first_member]
-        studied.append(images[exemplar_pair][exemplar_id])
-        studied_complement.append(images[exemplar_choices[not first_member]][exemplar_id])
-
-    for i in range(task_blocks[0] * trials_per_task, (task_blocks[0] + task_blocks[1]) * trials_per_task):
-        exemplar_id = allexemplars[i]
-        first_member = choice([0, 1])
-        exemplar_pair = exemplar_choices[first_member]
-        unstudied.append(images[exemplar_pair][exemplar_id])
-        unstudied_complement.append(images[exemplar_choices[not first_member]][exemplar_id])
+        targets, complements = (studied, studied_complement) if i < n_studied else (unstudied, unstudied_complement)
+        targets.append(images[exemplar_pair][exemplar_id])
+        complements.append(images[exemplar_choices[not first_member]][exemplar_id])
+
+    # each task draws its stimuli without replacement from these shared pools, in the order the plan gives
+    studied_pool = StimulusPool([(studied[i], studied_complement[i]) for i in plan['studied_order']], rng=None)
+    unstudied_pool = StimulusPool(zip(unstudied, unstudied_complement), rng=None)
+    filler_pool = StimulusPool([images['fillers'][i] for i in plan['fillers']], rng=None)
+    pools = {'studied': studied_pool, 'unstudied': unstudied_pool, 'fillers': filler_pool}
+
+    def session_state():
+        # everything that later blocks draw on: the random state and whatever stimuli are left to assign
+        return {'random': getstate(), 'pools': dict([(name, pool.items) for name, pool in pools.items()])}
+
+    trial_stream = None
+    if collector:
+        stream_files = [{'name': os.path.basename(file_name), 'fields': trial_fields,
+                         'columns': experiment_fields[experiment], 'blocks': data_blocks[experiment]}]
+        if experiment == 4:
+            stream_files.append({'name': os.path.basename(nback_file_name), 'fields': nback_field_names,
+                                 'columns': nback_field_names, 'blocks': ['study']})
+        trial_stream = TrialStream(collector, os.path.basename(file_name), exp_info['SubjID'], experiment,
+                                   stream_files, log_name[:-4] + '_stream.jsonl')
+    trial_log = TrialLog(log_name, stream=trial_stream)
+    if resume_log:
+        trial_log.write('resume', time=time.strftime("%c"), finished=list(finished.keys()))
+        setstate((saved_state['random'][0], tuple(saved_state['random'][1]), saved_state['random'][2]))
+        if not plan['exemplars']:
+            # logs from before session plans keep the studied images in their saved state instead
+            studied[:] = saved_state['studied']
+        for name, pool in pools.items():
+            pool.items = [tuple(item) if isinstance(item, list) else item for item in saved_state['pools'][name]]
+    else:
+        trial_log.write('session', experiment=experiment, subject=exp_info['SubjID'], time=session_time, plan=plan)
+        trial_log.checkpoint(session_state())
+
+    def run_block(name, task, *args, **kwargs):
+        """
+        Run one task of the session, logging its trials and checkpointing the session once it is done.
+        A block that was finished before the session was interrupted is not run again; its logged trials are used.
+
+        :param name: String. The name of the block, unique within the experiment.
+        :param task: The task function to run.
+        :param restore: A function turning the logged rows of a finished block back into what the task returns.
+        :return: What the task returns.
+        """
+        restore = kwargs.pop('restore', lambda rows: rows)
+        if name in finished:
+            return restore(finished[name])
+        trial_log.begin_block(name)
+        if frame_timer is not None:
+            frame_timer.block = name
+        kwargs.update(plan['blocks'].get(name, {}))
+        with span(name, 'block'):
+            block_data = task(*args, trial_log=trial_log, responses=responses, **kwargs)
+        trial_log.checkpoint(session_state())
+        return block_data
 
     exp_instructions = "Before the experiment begins, please take a moment to silence your cell phone." \
     "\nThis experiment will make use of the chinrest in front of you to make sure you are a fixed distance from the monitor, " \
@@ -484,96 +783,126 @@ def run_experiment(experiment, win):
     "\n\nWhen the experimenter clears you to start, press any key."
 
     completed_instructions = "Thank you for your participation. Please see experimenter for your debriefing. Press any key to exit."
-    display_instructions(win, exp_instructions)
+    display_instructions(win, exp_instructions, responses)
 
+    # every task records the same fields for a trial; each experiment has its own fixed set of columns to save
+    field_names = experiment_fields[experiment]
     if experiment == 1:
-        field_names = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'response_image',
-                      'filler1', 'filler2', 'filler3', 'filler4', 'filler5']
-        object_study_task(win, studied, study_dur, ISI_study)
-        studied_CD_data = cd_task('studied', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                  items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        unstudied_CD_data = cd_task('unstudied', win, mouse, slots, slot_size, unstudied, unstudied_complement,
-                                    images['fillers'], items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        afc6_data = cd_task('6afc', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                 items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        memory_data = object_memory_task(win, mouse, studied, studied_complement, trials_per_task, ISI_cd)
+        run_block('study', object_study_task, win, studied, study_dur, ISI_study,
+                  stim_cache=stim_cache, scheduler=scheduler)
+        studied_CD_data = run_block('studied', cd_task, 'studied', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                    items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                    stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        unstudied_CD_data = run_block('unstudied', cd_task, 'unstudied', win, mouse, slots, slot_size, unstudied_pool,
+                                      filler_pool, items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                      stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        afc6_data = run_block('6afc', cd_task, '6afc', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                              items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                              stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        memory_data = run_block('memory', object_memory_task, win, mouse, studied_pool, trials_per_task, ISI_cd,
+                                stim_cache=stim_cache, scheduler=scheduler)
 
         experiment_data = studied_CD_data + unstudied_CD_data + afc6_data + memory_data
     elif experiment == 2:
-        field_names = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'response_image',
-            'filler1', 'filler2', 'filler3', 'filler4', 'filler5']
-        object_study_task(win, studied, study_dur, ISI_study)
-        studied_CD_data = cd_task('studied', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                  items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        ignore_CD_data = cd_task('ignore_first', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                 items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        afc6_data = cd_task('6afc', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                 items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        memory_data = object_memory_task(win, mouse, studied, studied_complement, trials_per_task, ISI_cd)
+        run_block('study', object_study_task, win, studied, study_dur, ISI_study,
+                  stim_cache=stim_cache, scheduler=scheduler)
+        studied_CD_data = run_block('studied', cd_task, 'studied', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                    items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                    stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        ignore_CD_data = run_block('ignore_first', cd_task, 'ignore_first', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                   items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                   stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        afc6_data = run_block('6afc', cd_task, '6afc', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                              items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                              stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        memory_data = run_block('memory', object_memory_task, win, mouse, studied_pool, trials_per_task, ISI_cd,
+                                stim_cache=stim_cache, scheduler=scheduler)
 
         experiment_data = studied_CD_data + ignore_CD_data + afc6_data + memory_data
     elif experiment == 3:
-        field_names = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp',
-                      'response_image', 'filler1', 'filler2', 'filler3', 'filler4', 'filler5']
-
-        object_study_task(win, studied, study_dur, ISI_study)
-        unstudied_CD_data = cd_task('unstudied', win, mouse, slots, slot_size, unstudied, unstudied_complement,
-                                    images['fillers'], items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        strategy_CD_data = cd_task('strategy', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                   items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        strat_data = getQualData(win)
-        afc6_data = cd_task('6afc', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                                 items_per_array, trials_per_task, prechange_dur, ISI_cd)
+        run_block('study', object_study_task, win, studied, study_dur, ISI_study,
+                  stim_cache=stim_cache, scheduler=scheduler)
+        unstudied_CD_data = run_block('unstudied', cd_task, 'unstudied', win, mouse, slots, slot_size, unstudied_pool,
+                                      filler_pool, items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                      stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        strategy_CD_data = run_block('strategy', cd_task, 'strategy', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                     items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                     stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        strat_data = run_block('qual', getQualData, win, restore=lambda rows: rows[0][0])
+        afc6_data = run_block('6afc', cd_task, '6afc', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                              items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                              stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
 
         experiment_data = unstudied_CD_data + strategy_CD_data + afc6_data
-        stratfile = open(exp_info['SubjID'] + '_strat_data_ex3_' + time.strftime("%c") + '.txt', 'w')
+        stratfile = open(os.path.join(data_dir, exp_info['SubjID'] + '_strat_data_ex3_' + session_time + '.txt'), 'w')
         stratfile.write(strat_data)
         stratfile.close()
     elif experiment == 4:
-        field_names = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'lr_response',
-                      'response_image', 'filler1', 'filler2', 'filler3', 'filler4', 'filler5']
-        # output file nback
-        nback_file_name = exp_info['SubjID'] + '_' + time.strftime("%c") + '_nback.csv'
-        nback_field_names = ['response', 'index', 'first_occurence']
-
-        nback_responses = object_study_task(win, studied, study_dur, ISI_study, images['fillers'], include_repeats = True)
-        flipped_CD_data = cd_task('flipped', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        unstudied_CD_data = cd_task('unstudied', win, mouse, slots, slot_size, unstudied, unstudied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        memory_6AFC_data = cd_task('6afc', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        memory_2AFC = object_memory_task(win, mouse, studied, studied_complement, trials_per_task, ISI_cd)
+        nback_plan_file_name = os.path.join(data_dir, exp_info['SubjID'] + '_' + session_time + '_nback_plan.csv')
+
+        nback_responses = run_block('study', object_study_task, win, studied, study_dur, ISI_study, filler_pool, include_repeats = True,
+                                    stim_cache=stim_cache, plan_file=nback_plan_file_name, scheduler=scheduler)
+        flipped_CD_data = run_block('flipped', cd_task, 'flipped', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                    items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                    stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        unstudied_CD_data = run_block('unstudied', cd_task, 'unstudied', win, mouse, slots, slot_size, unstudied_pool, filler_pool,
+                                      items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                      stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        memory_6AFC_data = run_block('6afc', cd_task, '6afc', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                     items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                     stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        memory_2AFC = run_block('memory', object_memory_task, win, mouse, studied_pool, trials_per_task, ISI_cd,
+                                stim_cache=stim_cache, scheduler=scheduler)
         experiment_data = flipped_CD_data + unstudied_CD_data + memory_6AFC_data + memory_2AFC
         write_data(nback_file_name, nback_field_names, nback_responses)
     elif experiment == 5:
-        field_names = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'response_image',
-                       'filler1', 'filler2', 'filler3', 'filler4', 'filler5']
-
-        object_study_task(win, studied, study_dur, ISI_study)
-        unstudied_CD_data = cd_task('unstudied', win, mouse, slots, slot_size, unstudied, unstudied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        afc6_data = cd_task('6afc', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        hybrid_CD_data = cd_task('hybrid', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
+        run_block('study', object_study_task, win, studied, study_dur, ISI_study,
+                  stim_cache=stim_cache, scheduler=scheduler)
+        unstudied_CD_data = run_block('unstudied', cd_task, 'unstudied', win, mouse, slots, slot_size, unstudied_pool, filler_pool,
+                                      items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                      stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        afc6_data = run_block('6afc', cd_task, '6afc', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                              items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                              stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        hybrid_CD_data = run_block('hybrid', cd_task, 'hybrid', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                   items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                   stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
         experiment_data = unstudied_CD_data + hybrid_CD_data + afc6_data
     elif experiment == 6:
-        field_names = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'response_image',
-            'filler1', 'filler2', 'filler3', 'filler4', 'filler5']
-        object_study_task(win, studied, study_dur, ISI_study)
-        unstudied_CD_data = cd_task('unstudied', win, mouse, slots, slot_size, unstudied, unstudied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        hybrid_CD_data = cd_task('hybrid', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
-        afc6_data = cd_task('6afc', win, mouse, slots, slot_size, studied, studied_complement, images['fillers'],
-                    items_per_array, trials_per_task, prechange_dur, ISI_cd)
+        run_block('study', object_study_task, win, studied, study_dur, ISI_study,
+                  stim_cache=stim_cache, scheduler=scheduler)
+        unstudied_CD_data = run_block('unstudied', cd_task, 'unstudied', win, mouse, slots, slot_size, unstudied_pool, filler_pool,
+                                      items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                      stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        hybrid_CD_data = run_block('hybrid', cd_task, 'hybrid', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                                   items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                                   stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
+        afc6_data = run_block('6afc', cd_task, '6afc', win, mouse, slots, slot_size, studied_pool, filler_pool,
+                              items_per_array, trials_per_task, prechange_dur, ISI_cd,
+                              stim_cache=stim_cache, scheduler=scheduler, hit_test=hit_test)
 
         experiment_data = unstudied_CD_data + hybrid_CD_data + afc6_data
 
-    write_data(file_name, field_names, experiment_data)
-
-    display_instructions(win, completed_instructions)
+    stim_cache.close()
+    trial_log.close()
+    experiment_columns = field_columns(field_names)
+    write_data(file_name, field_names, experiment_data, experiment_columns)
+    if save_columns:
+        write_columns(file_name[:-4] + '.npz', field_names, experiment_data, experiment_columns)
+    if trial_stream is not None:
+        trial_stream.close()
+        if os.path.exists(trial_stream.spool_path):
+            print('Not everything reached the collector; what is left is in ' + trial_stream.spool_path)
+    if frame_timer is not None:
+        write_data(file_name[:-4] + '_timing.csv', timing_fields, frame_timer.rows)
+        write_data(file_name[:-4] + '_timing_summary.csv', timing_summary_fields, frame_timer.summary())
+    if record_spans:
+        tracer = stop_tracing()
+        tracer.save_chrome_trace(file_name[:-4] + '_trace.json')
+        write_data(file_name[:-4] + '_spans.csv', span_summary_fields, tracer.summary())
+
+    display_instructions(win, completed_instructions, responses)
     win.close()
 
-run_experiment(1, win = visual.Window([1080, 720], allowGUI=True, monitor='testMonitor', color='white', units='pix'))
\ No newline at end of file
+if __name__ == '__main__':
+    run_experiment(1, win = visual.Window([1080, 720], allowGUI=True, monitor='testMonitor', color='white', units='pix'))
\ No newline at end of file
@@ -0,0 +1,401 @@
+import importlib, os, random
+from functools import partial
+
+
+class LazyModule(object):
+    """
+    Stand in for a module that is only imported when one of its attributes is first used.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: String. The full name of the module, e.g. 'psychopy.visual'.
+        """
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+class PsychopyBackend(object):
+    """
+    Present sessions on screen with Psychopy and collect responses from a participant.
+
+    Psychopy's modules are imported the first time a task uses them rather than when the backend is made, so that
+    loading the experiment code does not load the windowing stack, and works on a machine without a display.
+    """
+
+    def __init__(self):
+        from stimcache import decode_image
+        from texturestore import TextureStore
+        self.core = LazyModule('psychopy.core')
+        self.event = LazyModule('psychopy.event')
+        self.visual = LazyModule('psychopy.visual')
+        self.gui = LazyModule('psychopy.gui')
+        self.keyboard = LazyModule('psychopy.hardware.keyboard')
+        self.decode_image = decode_image
+        self.texture_store = TextureStore
+
+    def load_textures(self, path, manifest):
+        """
+        Open the store of pre-resized textures, if one has been built.
+
+        :param path: String. The filename of the texture store.
+        :param manifest: The current stimulus manifest, to leave out images that have changed since the store was built.
+        :return: A TextureStore, or None if there is no store at path.
+        """
+        if not os.path.exists(path):
+            return None
+        return self.texture_store(path, manifest)
+
+
+class HeadlessBackend(object):
+    """
+    Run sessions without a display, on a virtual clock, with responses made by a SimulatedObserver.
+
+    It stands in for the parts of psychopy.core, event, visual, gui and hardware.keyboard that the tasks use. Waits only move the virtual
+    clock forward, and each flip moves it forward by one frame. The backend keeps track of what is on the virtual
+    screen, so the observer can respond to the displays the tasks actually build.
+
+    As on a real display, a key read from hardware.keyboard also stays in the event module's buffer until the event
+    module reads it or its events are cleared, so a task that reads the event module after a keyboard read sees the
+    earlier key unless it clears them.
+    """
+
+    def __init__(self, observer=None, subject='sim', frame_rate=60.):
+        """
+        :param observer: The SimulatedObserver making responses; one with the default parameters if not given.
+        :param subject: String. The subject ID entered into the subject info dialog.
+        :param frame_rate: The refresh rate of the virtual display, in Hz.
+        """
+        self.observer = observer if observer is not None else SimulatedObserver()
+        self.subject = subject
+        self.frame_dur = 1. / frame_rate
+        self.time = 0.
+        self.screen = []
+        self.last_array = []
+        self.seen = set()
+        self.onsets = 0
+        self.detected_change = False
+        self._judged_onset = None
+        self._typed = None
+        self.key_buffer = []
+        self.core = _Namespace(wait=self.wait, getTime=self.get_time, Clock=partial(HeadlessClock, self))
+        self.event = _Namespace(getKeys=self.get_event_keys, waitKeys=self.wait_keys, clearEvents=self.clear_events,
+                                Mouse=partial(HeadlessMouse, self))
+        self.visual = _Namespace(Window=partial(HeadlessWindow, self), ImageStim=HeadlessStim, TextStim=HeadlessStim,
+                                 Line=HeadlessStim, Rect=HeadlessStim, BufferImageStim=HeadlessBufferStim)
+        self.gui = _Namespace(DlgFromDict=partial(HeadlessDialog, self))
+        self.keyboard = _Namespace(Keyboard=partial(HeadlessKeyboard, self))
+
+    def decode_image(self, path):
+        """
+        Stand in for decoding an image; nothing is read from disk.
+
+        :param path: String. The filepath of the image.
+        :return: A HeadlessImage for the filepath.
+        """
+        return HeadlessImage(path)
+
+    def load_textures(self, path, manifest):
+        """
+        Nothing is uploaded on the virtual display, so images are never taken from a texture store.
+
+        :return: None.
+        """
+        return None
+
+    def wait(self, duration, **kwargs):
+        self.time += duration
+
+    def get_time(self):
+        return self.time
+
+    def present(self, screen):
+        """
+        Show a new frame on the virtual screen.
+
+        :param screen: The list of stimuli drawn for this frame.
+        :return: None.
+        """
+        incoming = _image_positions(screen)
+        outgoing = _image_positions(self.screen)
+        if incoming != outgoing:
+            if outgoing:
+                self.last_array = outgoing
+            self.seen.update(set(outgoing.values()) - set(incoming.values()))
+            if incoming:
+                self.onsets += 1
+        self.screen = screen
+        self.time += self.frame_dur
+
+    def choose_slot(self):
+        """
+        Have the observer pick one of the images on screen with the mouse.
+
+        :return: The (x, y) position of the chosen image.
+        """
+        self.time += self.observer.response_time()
+        images = _image_positions(self.screen)
+        changed = [pos for pos, path in images.items() if pos in self.last_array and self.last_array[pos] != path]
+        familiar = [pos for pos, path in images.items() if path in self.seen]
+        pos, self.detected_change = self.observer.choose_slot(list(images.keys()), changed, familiar)
+        return pos
+
+    def get_event_keys(self, keyList=None, **kwargs):
+        # keys left in the event module's buffer by keyboard reads come before any new press
+        buffered = [name for name in self.key_buffer if keyList is None or name in keyList]
+        if buffered:
+            self.key_buffer = [name for name in self.key_buffer if keyList is not None and name not in keyList]
+            return buffered
+        return self.get_keys(keyList)
+
+    def get_keys(self, keyList=None, **kwargs):
+        images = _image_positions(self.screen)
+        if keyList == ['left', 'right']:
+            self.time += self.observer.response_time()
+            if len(images) == 2:
+                # two images side by side: the 2AFC memory test
+                (left, left_path), (right, right_path) = sorted(images.items())
+                return [self.observer.choose_side(left_path in self.seen, right_path in self.seen)]
+            # otherwise the follow-up question of the flipped task: did the picked object change?
+            return [self.observer.report_change(self.detected_change)]
+        if keyList == ['space']:
+            # judge each study item once, on its first frame
+            if len(images) != 1 or self._judged_onset == self.onsets:
+                return []
+            self._judged_onset = self.onsets
+            return ['space'] if self.observer.flag_repeat(list(images.values())[0] in self.seen) else []
+        if keyList == ['return']:
+            return ['return'] if self._typed == [] else []
+        if keyList is None:
+            if self._typed is None:
+                self._typed = [_key_name(c) for c in self.observer.typed_response]
+            if self._typed == []:
+                return ['return']
+            keys, self._typed = self._typed[:1], self._typed[1:]
+            return keys
+        return []
+
+    def wait_keys(self, **kwargs):
+        self.time += self.observer.response_time()
+        return ['space']
+
+    def clear_events(self, eventType=None):
+        self.key_buffer = []
+        self._typed = None
+
+
+class SimulatedObserver(object):
+    """
+    A virtual participant who responds to the displays with fixed probabilities.
+    """
+
+    def __init__(self, p_detect_change=.6, p_recognize=.75, p_spot_repeat=.8, p_false_alarm=.02, mean_rt=1.,
+                 typed_response='simulated response', seed=None):
+        """
+        :param p_detect_change: Probability of noticing which image changed between two arrays.
+        :param p_recognize: Probability of recognizing a familiar image, when no change was noticed.
+        :param p_spot_repeat: Probability of pressing space for a repeated image during the study task.
+        :param p_false_alarm: Probability of pressing space for an image that was not repeated.
+        :param mean_rt: Mean response time, in seconds; response times are exponentially distributed.
+        :param typed_response: String. What the observer types when asked for a written response.
+        :param seed: The seed for the observer's own random number generator.
+        """
+        self.p_detect_change = p_detect_change
+        self.p_recognize = p_recognize
+        self.p_spot_repeat = p_spot_repeat
+        self.p_false_alarm = p_false_alarm
+        self.mean_rt = mean_rt
+        self.typed_response = typed_response
+        self.rng = random.Random(seed)
+
+    def response_time(self):
+        return self.rng.expovariate(1. / self.mean_rt)
+
+    def choose_slot(self, positions, changed, familiar):
+        """
+        :param positions: The positions of all the images on screen.
+        :param changed: The positions of images that differ from the previous array.
+        :param familiar: The positions of images that have been seen before.
+        :return: A (position, noticed_change) tuple.
+        """
+        if len(changed) == 1 and self.rng.random() < self.p_detect_change:
+            return changed[0], True
+        if familiar and self.rng.random() < self.p_recognize:
+            return self.rng.choice(familiar), False
+        return self.rng.choice(positions), False
+
+    def choose_side(self, left_familiar, right_familiar):
+        if left_familiar != right_familiar and self.rng.random() < self.p_recognize:
+            return 'left' if left_familiar else 'right'
+        return self.rng.choice(['left', 'right'])
+
+    def report_change(self, noticed_change):
+        return 'right' if noticed_change else 'left'
+
+    def flag_repeat(self, repeated):
+        return self.rng.random() < (self.p_spot_repeat if repeated else self.p_false_alarm)
+
+
+class HeadlessImage(object):
+    """
+    Placeholder for a decoded image; only the filepath is kept.
+    """
+    width = 1
+    height = 1
+
+    def __init__(self, path):
+        self.path = path
+
+    def getbands(self):
+        return ('L',)
+
+
+class HeadlessWindow(object):
+
+    def __init__(self, backend, size=(1080, 720), **kwargs):
+        self.backend = backend
+        self.size = size
+        self.drawn = []
+        self.autodraw = []
+        self.on_flip = []
+
+    def flip(self):
+        self.backend.present(self.autodraw + self.drawn)
+        self.drawn = []
+        on_flip, self.on_flip = self.on_flip, []
+        for function, args, kwargs in on_flip:
+            function(*args, **kwargs)
+        return self.backend.time
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.on_flip.append((function, args, kwargs))
+
+    def close(self):
+        pass
+
+
+class HeadlessStim(object):
+
+    def __init__(self, win, **kwargs):
+        self.win = win
+        self.image = None
+        self.pos = (0, 0)
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        self.win.drawn.append(self)
+
+    def setAutoDraw(self, value):
+        if value and self not in self.win.autodraw:
+            self.win.autodraw.append(self)
+        elif not value and self in self.win.autodraw:
+            self.win.autodraw.remove(self)
+
+    def setText(self, text):
+        self.text = text
+
+
+class HeadlessBufferStim(HeadlessStim):
+    """
+    Stand in for a composite of several stimuli. The images and positions are copied when it is made, as the
+    capture of a BufferImageStim would be.
+    """
+
+    def __init__(self, win, stim=(), **kwargs):
+        HeadlessStim.__init__(self, win, **kwargs)
+        self.stims = [HeadlessStim(win, image=part.image, pos=tuple(part.pos)) for part in stim]
+
+
+class HeadlessMouse(object):
+
+    def __init__(self, backend, win=None, **kwargs):
+        self.backend = backend
+        self.target = None
+
+    def setVisible(self, visible):
+        pass
+
+    def setPos(self, pos):
+        pass
+
+    def clickReset(self):
+        self.target = None
+
+    def getPos(self):
+        if self.target is None:
+            self.target = self.backend.choose_slot()
+        return self.target
+
+    def getPressed(self):
+        self.getPos()
+        return [1, 0, 0]
+
+    def isPressedIn(self, shape):
+        return tuple(shape.pos) == tuple(self.getPos())
+
+
+class HeadlessKeyboard(object):
+
+    def __init__(self, backend, **kwargs):
+        self.backend = backend
+        self.clock = HeadlessClock(backend)
+
+    def getKeys(self, keyList=None, **kwargs):
+        # any key, as on an instruction screen, is one the observer takes a while to press
+        names = self.backend.wait_keys() if keyList is None else self.backend.get_keys(keyList=keyList)
+        self.backend.key_buffer.extend(names)
+        return [HeadlessKeyPress(name, self.clock.getTime(), self.backend.time) for name in names]
+
+    def clearEvents(self):
+        pass
+
+
+class HeadlessKeyPress(object):
+
+    def __init__(self, name, rt, tDown):
+        self.name = name
+        self.rt = rt
+        self.tDown = tDown
+
+
+class HeadlessClock(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.start = backend.time
+
+    def reset(self):
+        self.start = self.backend.time
+
+    def getTime(self):
+        return self.backend.time - self.start
+
+
+class HeadlessDialog(object):
+
+    def __init__(self, backend, dictionary, **kwargs):
+        dictionary['SubjID'] = backend.subject
+        self.OK = True
+
+
+class _Namespace(object):
+
+    def __init__(self, **members):
+        self.__dict__.update(members)
+
+
+def _image_positions(screen):
+    # map the position of each image on a frame to its filepath, looking inside composites
+    parts = [part for stim in screen for part in getattr(stim, 'stims', [stim])]
+    return dict([(tuple(part.pos), part.image.path) for part in parts if isinstance(part.image, HeadlessImage)])
+
+
+def _key_name(character):
+    names = {'.': 'period', ' ': 'space', "'": 'apostrophe', '?': 'question', '!': 'exclamation', ',': 'comma',
+             ':': 'colon', ';': 'semicolon', '(': 'parenleft', ')': 'parenright'}
+    return names.get(character, character)
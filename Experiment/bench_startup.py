@@ -0,0 +1,77 @@
+"""
+Time how long the experiment code takes to import, to catch changes that make it load the display stack again.
+
+Each module is imported in a fresh interpreter several times. The median time is reported, along with any of the
+heavy modules that the import pulled in. The script exits with an error if a median is over the budget or a heavy
+module was loaded. Run from the Experiment directory:
+
+    python bench_startup.py --repeats 20 --budget 0.1
+"""
+import argparse, json, subprocess, sys
+
+# modules whose import should stay cheap, and the modules they must not load just by being imported
+startup_modules = ['CBLTM', 'records', 'streams', 'pools', 'planner', 'manifest', 'triallog', 'trialstream', 'timing', 'backends']
+heavy_modules = ['psychopy', 'pyglet', 'numpy', 'PIL']
+
+_probe = """
+import sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(repr((elapsed, sorted(set(name.split('.')[0] for name in sys.modules) & set(%r)))))
+"""
+
+
+def time_import(module, repeats=10):
+    """
+    Time the import of a module in fresh interpreters.
+
+    :param module: String. The name of the module to import.
+    :param repeats: Integer. The number of interpreters to time it in.
+    :return: A (times, loaded) tuple of the list of import times in seconds and the heavy modules the import loaded.
+    """
+    times = []
+    loaded = set()
+    for i in range(0, repeats):
+        output = subprocess.check_output([sys.executable, '-c', _probe % (module, heavy_modules)])
+        elapsed, heavy = eval(output.decode('utf-8').strip().splitlines()[-1])
+        times.append(elapsed)
+        loaded.update(heavy)
+    return times, sorted(loaded)
+
+
+def bench_startup(modules=startup_modules, repeats=10):
+    """
+    :param modules: The names of the modules to time.
+    :param repeats: Integer. The number of interpreters to time each module in.
+    :return: A list with a dictionary for each module, giving its 'module' name, 'median' and 'max' import times in
+            seconds, and the heavy modules it 'loaded'.
+    """
+    results = []
+    for module in modules:
+        times, loaded = time_import(module, repeats)
+        times.sort()
+        results.append({'module': module, 'median': times[len(times) // 2], 'max': times[-1], 'loaded': loaded})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the import of the experiment modules.')
+    parser.add_argument('modules', nargs='*', default=startup_modules)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=.1, help='the longest median import time allowed, in seconds')
+    parser.add_argument('--out', default=None, help='a json file to save the results to')
+    args = parser.parse_args()
+    bench_results = bench_startup(args.modules, args.repeats)
+    failed = False
+    for result in bench_results:
+        over = result['median'] > args.budget
+        failed = failed or over or bool(result['loaded'])
+        print('%-10s median %6.1f ms  max %6.1f ms  %s%s' % (result['module'], result['median'] * 1000,
+                                                           result['max'] * 1000, 'OVER BUDGET ' if over else '',
+                                                           'loaded ' + ', '.join(result['loaded'])
+                                                           if result['loaded'] else ''))
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump({'budget': args.budget, 'results': bench_results}, out_file, indent=1)
+    sys.exit(1 if failed else 0)
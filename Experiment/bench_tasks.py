@@ -0,0 +1,193 @@
+"""
+Benchmark how long the tasks take to prepare each trial, and how fast data is written, as the stimulus library grows.
+
+The real task functions are run on the headless backend, which stands in for Psychopy's display, input and clock and
+does not read images from disk, with synthetic libraries of each size. Each case is run twice: once with tracing on,
+to time the setup stage of every trial from its spans, and once under tracemalloc, to measure what it allocates.
+Results are printed as a table and can be saved as json, and compared with the json of an earlier run to catch
+regressions. Run from the Experiment directory:
+
+    python bench_tasks.py --sizes 1000 10000 100000 --out bench.json
+    python bench_tasks.py --compare bench.json
+"""
+from contextlib import redirect_stdout
+import argparse, io, json, os, platform, shutil, sys, tempfile, time, tracemalloc
+
+import CBLTM
+from backends import HeadlessBackend, SimulatedObserver
+from hittest import SlotHitTest
+from pools import StimulusPool
+from planner import repeat_lags, repeat_sections
+from records import TrialRecord, experiment_fields, field_columns
+from streams import min_study_items
+from timing import FrameScheduler
+from tracing import start_tracing, stop_tracing
+
+bench_tasks = ['cd_task', 'object_memory_task', 'object_study_task', 'object_study_task repeats', 'write_data']
+bench_sizes = [1000, 10000, 100000]
+# the shortest study stream that the repeats of a session fit into
+min_repeat_stream = min_study_items(repeat_lags * repeat_sections, repeat_sections)
+# how much slower than the compared run a case's median setup latency may get before it counts as a regression
+regression_ratio = 1.5
+
+
+def synthetic_library(n_fillers, n_exemplars):
+    """
+    :param n_fillers: Integer. The number of filler images.
+    :param n_exemplars: Integer. The number of exemplar pairs.
+    :return: A dictionary mapping each stimulus set to a list of made-up filepaths, like manifest.manifest_paths.
+    """
+    return {'exemplarset0': ['Stimuli/synthetic/A/%06d.jpg' % i for i in range(0, n_exemplars)],
+            'exemplarset1': ['Stimuli/synthetic/B/%06d.jpg' % i for i in range(0, n_exemplars)],
+            'fillers': ['Stimuli/synthetic/fillers/%06d.jpg' % i for i in range(0, n_fillers)]}
+
+
+def run_case(task, library, trials, data_dir):
+    """
+    Run one task once on a fresh headless session.
+
+    :param task: String. One of bench_tasks.
+    :param library: The synthetic library, as from synthetic_library.
+    :param trials: Integer. The number of trials to run, or rows to write for write_data.
+    :param data_dir: String. The directory write_data writes to.
+    :return: The number of trials run.
+    """
+    backend = HeadlessBackend(SimulatedObserver(seed=0), subject='bench')
+    CBLTM.use_backend(backend)
+    window = backend.visual.Window([1080, 720])
+    fillers = StimulusPool(library['fillers'])
+    pairs = StimulusPool(zip(library['exemplarset0'], library['exemplarset1']))
+    if task == 'write_data':
+        rows = [TrialRecord(trial_type='studied', correct=1, raw_response=3, test_image=test_im,
+                            bait_image=bait_im, timestamp=i * 10., response_image=test_im,
+                            fillers=fillers.draw_many(5), rt=.8) for i, (test_im, bait_im) in
+                enumerate(pairs.draw_many(trials))]
+        fieldnames = experiment_fields[1]
+        with redirect_stdout(io.StringIO()):
+            CBLTM.write_data(os.path.join(data_dir, 'bench.csv'), fieldnames, rows, field_columns(fieldnames))
+        return trials
+    mouse = backend.event.Mouse(window)
+    stim_cache = CBLTM.make_stim_cache(window)
+    scheduler = FrameScheduler(window)
+    responses = CBLTM.make_response_collector()
+    if task == 'cd_task':
+        slots, slot_size = CBLTM.array_slots(window.size)
+        CBLTM.cd_task('studied', window, mouse, slots, slot_size, pairs, fillers, len(slots), trials, 1.2, .4,
+                      stim_cache=stim_cache, scheduler=scheduler, hit_test=SlotHitTest(slots, slot_size),
+                      responses=responses)
+    elif task == 'object_memory_task':
+        CBLTM.object_memory_task(window, mouse, pairs, trials, .4, stim_cache=stim_cache, scheduler=scheduler,
+                                 responses=responses)
+    else:
+        repeats = task.endswith('repeats')
+        trials = max(trials, min_repeat_stream) if repeats else trials
+        CBLTM.object_study_task(window, library['exemplarset0'][:trials], 3, .5, fillers, include_repeats=repeats,
+                                stim_cache=stim_cache, scheduler=scheduler, responses=responses)
+    stim_cache.close()
+    return trials
+
+
+def bench_case(task, n_fillers, trials):
+    """
+    Time and measure the allocations of one task on a library of one size.
+
+    :param task: String. One of bench_tasks.
+    :param n_fillers: Integer. The number of fillers in the synthetic library.
+    :param trials: Integer. The number of trials to run, or rows to write for write_data.
+    :return: A dictionary of the results: the 'task', 'fillers' and 'trials', the 'total' time in seconds, the
+            'setup_mean', 'setup_p50', 'setup_p95' and 'setup_max' latency of preparing a trial in seconds (for
+            write_data, the time per row), and the 'peak_bytes' and 'retained_bytes' allocated while it ran, which
+            include the session's copy of the library in its stimulus pools.
+    """
+    library = synthetic_library(n_fillers, max(trials, min_repeat_stream))
+    data_dir = tempfile.mkdtemp()
+    try:
+        tracer = start_tracing()
+        started = time.perf_counter()
+        try:
+            trials = run_case(task, library, trials, data_dir)
+        finally:
+            stop_tracing()
+        total = time.perf_counter() - started
+        if task == 'write_data':
+            setup = sorted([end - start for name, category, thread, start, end, args in tracer.spans
+                            if name == 'write_data'])
+            setup = [duration / trials for duration in setup]
+        else:
+            setup_name = task.split()[0] + ' setup'
+            setup = sorted([end - start for name, category, thread, start, end, args in tracer.spans
+                            if name == setup_name])
+        tracemalloc.start()
+        try:
+            run_case(task, library, trials, data_dir)
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(data_dir)
+    n = len(setup)
+    return {'task': task, 'fillers': n_fillers, 'trials': trials, 'total': total,
+            'setup_mean': sum(setup) / n if n else None, 'setup_p50': setup[n // 2] if n else None,
+            'setup_p95': setup[min(n - 1, int(n * .95))] if n else None, 'setup_max': setup[-1] if n else None,
+            'peak_bytes': peak, 'retained_bytes': retained}
+
+
+def bench_tasks_scaling(tasks=bench_tasks, sizes=bench_sizes, trials=100):
+    """
+    :param tasks: The tasks to benchmark, from bench_tasks.
+    :param sizes: The numbers of fillers of the synthetic libraries.
+    :param trials: Integer. The number of trials of each task, or rows to write for write_data.
+    :return: A list of the results of bench_case for every task and size, giving the scaling curve of each task.
+    """
+    return [bench_case(task, size, trials) for task in tasks for size in sizes]
+
+
+def compare(results, previous):
+    """
+    Compare results with those of an earlier run.
+
+    :param results: The list of results of this run.
+    :param previous: The list of results of the earlier run.
+    :return: A list of (task, fillers, ratio) tuples, one for each case in both runs, where ratio is this run's
+            median setup latency over the earlier run's.
+    """
+    earlier = dict([((result['task'], result['fillers']), result) for result in previous])
+    ratios = []
+    for result in results:
+        old = earlier.get((result['task'], result['fillers']))
+        if old is not None and old['setup_p50'] and result['setup_p50'] is not None:
+            ratios.append((result['task'], result['fillers'], result['setup_p50'] / old['setup_p50']))
+    return ratios
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark trial preparation and data writing on the headless '
+                                                 'backend.')
+    parser.add_argument('--tasks', nargs='+', default=bench_tasks)
+    parser.add_argument('--sizes', nargs='+', type=int, default=bench_sizes)
+    parser.add_argument('--trials', type=int, default=100)
+    parser.add_argument('--out', default=None, help='a json file to save the results to')
+    parser.add_argument('--compare', default=None, help='the json file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=regression_ratio,
+                        help='the slowdown over the earlier run that counts as a regression')
+    args = parser.parse_args()
+    bench_results = bench_tasks_scaling(args.tasks, args.sizes, args.trials)
+    print('%-26s %8s %6s %10s %10s %10s %8s %10s' % ('task', 'fillers', 'trials', 'setup p50', 'setup p95',
+                                                     'setup max', 'total', 'peak'))
+    for result in bench_results:
+        print('%-26s %8d %6d %8.1fus %8.1fus %8.1fus %7.2fs %8.1fMB' % (
+            result['task'], result['fillers'], result['trials'], result['setup_p50'] * 1e6,
+            result['setup_p95'] * 1e6, result['setup_max'] * 1e6, result['total'], result['peak_bytes'] / 1e6))
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump({'python': sys.version.split()[0], 'platform': platform.platform(),
+                       'time': time.strftime('%c'), 'trials': args.trials, 'results': bench_results}, out_file,
+                      indent=1)
+    regressed = False
+    if args.compare:
+        with open(args.compare) as compare_file:
+            for task_name, size, ratio in compare(bench_results, json.load(compare_file)['results']):
+                regressed = regressed or ratio > args.threshold
+                print('%-26s %8d  %.2fx%s' % (task_name, size, ratio, '  REGRESSION' if ratio > args.threshold
+                                              else ''))
+    sys.exit(1 if regressed else 0)
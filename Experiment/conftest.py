@@ -0,0 +1,20 @@
+import os
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def stimulus_library(tmp_path, monkeypatch):
+    """
+    A small stimulus library in a fresh working directory, laid out as CBLTM.stimulus_sets expects, with enough
+    exemplars and fillers for one trial of each task of any experiment but the fourth.
+    """
+    for directory, names in [('Stimuli/exemplarA', ['%d.jpg' % i for i in range(0, 12)]),
+                             ('Stimuli/exemplarB', ['%04d.jpg' % i for i in range(0, 12)]),
+                             ('Stimuli/OBJECTSALL', ['%04d.jpg' % i for i in range(0, 40)])]:
+        os.makedirs(str(tmp_path / directory))
+        for i, name in enumerate(names):
+            Image.new('RGB', (8, 8), (i, i, i)).save(str(tmp_path / directory / name))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
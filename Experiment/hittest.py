@@ -0,0 +1,23 @@
+class SlotHitTest(object):
+    """
+    Map a position on screen to the square slot it falls in, checking the bounds of every slot at once.
+    """
+
+    def __init__(self, slots, slot_size):
+        """
+        :param slots: The centre of each slot, as a list of (x, y) tuples. Slots are numbered from 1 in this order.
+        :param slot_size: The width and height of each slot, in the same units as the centres.
+        """
+        import numpy
+        self.centres = numpy.asarray(slots, dtype=float)
+        self.half_size = slot_size / 2.
+
+    def slot_at(self, pos):
+        """
+        :param pos: An (x, y) position, e.g. from mouse.getPos().
+        :return: The number of the slot the position falls in, or None if it is outside every slot.
+        """
+        import numpy
+        inside = numpy.all(numpy.abs(self.centres - numpy.asarray(pos, dtype=float)) <= self.half_size, axis=1)
+        hits = numpy.flatnonzero(inside)
+        return int(hits[0]) + 1 if len(hits) else None
@@ -0,0 +1,160 @@
+"""
+Build, check and load the index of the stimulus library.
+
+The manifest records every image of each stimulus set with its pixel dimensions and a hash of its contents, so that a
+missing, corrupt or unpaired image is found before a session starts rather than when a trial tries to draw it. It is
+rebuilt incrementally: a set is only rescanned when its directory has changed, and only new or modified files in it
+are decoded again.
+
+Images named by number are listed in numeric order, so that exemplar sets whose names are padded with different
+numbers of zeros, e.g. exemplarA/46.jpg and exemplarB/0046.jpg, still pair up index for index.
+
+Files edited in place do not change their directory, so sessions will not notice them. Run from the Experiment
+directory to rebuild the manifest from scratch, decoding and hashing every image, after changing the library:
+
+    python manifest.py
+"""
+import hashlib, json, os, tempfile
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff')
+# version 2 manifests list images named by number in numeric order
+manifest_version = 2
+
+
+def build_manifest(sets, previous=None):
+    """
+    Index the images of each stimulus set.
+
+    :param sets: A dictionary mapping each set name to the directory of its images.
+    :param previous: A manifest to reuse entries from; a set whose directory has not changed since is copied over,
+                     and files in it whose size and modification time have not changed are not decoded again.
+    :return: The manifest, as a dictionary.
+    """
+    old_sets = previous['sets'] if previous and previous.get('version') == manifest_version else {}
+    manifest = {'version': manifest_version, 'sets': {}}
+    for name, directory in sets.items():
+        old = old_sets.get(name)
+        mtime = os.stat(directory).st_mtime
+        if old is not None and old['dir'] == directory and old['mtime'] == mtime:
+            manifest['sets'][name] = old
+            continue
+        known = dict([(entry['name'], entry) for entry in old['files']]) if old is not None else {}
+        files = []
+        for filename in sorted(os.listdir(directory), key=image_key):
+            if filename.startswith('.') or os.path.splitext(filename)[1].lower() not in image_extensions:
+                continue
+            stat = os.stat(os.path.join(directory, filename))
+            entry = known.get(filename)
+            if entry is None or entry['bytes'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                entry = _index_image(directory, filename, stat)
+            files.append(entry)
+        manifest['sets'][name] = {'dir': directory, 'mtime': mtime, 'files': files}
+    return manifest
+
+
+def image_key(filename):
+    """
+    :param filename: String. The name of an image file.
+    :return: The key images are listed in order of: the number an image is named by, so that padding with zeros makes
+            no difference, and then its name. Images not named by a number come after those that are.
+    """
+    stem = os.path.splitext(filename)[0]
+    return (0, int(stem), filename) if stem.isdigit() else (1, 0, filename)
+
+
+def check_pairs(manifest, set0, set1):
+    """
+    Check that two exemplar sets pair up image for image: the same number of images, named by the same number, or
+    else with the same filename, at every index.
+
+    :param manifest: The manifest to check.
+    :param set0: String. The name of the first exemplar set.
+    :param set1: String. The name of the second exemplar set.
+    :return: None.
+    """
+    names0 = [entry['name'] for entry in manifest['sets'][set0]['files']]
+    names1 = [entry['name'] for entry in manifest['sets'][set1]['files']]
+    if len(names0) != len(names1):
+        raise ValueError('%s has %d images but %s has %d' % (set0, len(names0), set1, len(names1)))
+    for i in range(0, len(names0)):
+        if _pair_name(names0[i]) != _pair_name(names1[i]):
+            raise ValueError('image %d of %s is %s but its pair in %s is %s' % (i, set0, names0[i], set1, names1[i]))
+
+
+def load_manifest(path, sets):
+    """
+    Load the manifest, bringing it up to date with the stimulus directories and saving it if anything changed.
+
+    :param path: String. The filename of the manifest; it is built from scratch if it does not exist.
+    :param sets: A dictionary mapping each set name to the directory of its images.
+    :return: The manifest, as a dictionary.
+    """
+    previous = None
+    if os.path.exists(path):
+        with open(path) as manifest_file:
+            try:
+                previous = json.load(manifest_file)
+            except ValueError:
+                previous = None
+    manifest = build_manifest(sets, previous)
+    if manifest != previous:
+        save_manifest(path, manifest)
+    return manifest
+
+
+def save_manifest(path, manifest):
+    """
+    Write the manifest to disk. It is written to a temporary file of its own first, so an interrupted save leaves the
+    old one, and sessions starting together, e.g. simulate.py's workers, can save it at the same time.
+
+    :param path: String. The filename of the manifest.
+    :param manifest: The manifest to save.
+    :return: None.
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def manifest_paths(manifest):
+    """
+    :param manifest: A manifest.
+    :return: A dictionary mapping each set name to the list of filepaths of its images, in order.
+    """
+    return dict([(name, [os.path.join(entry['dir'], image['name']) for image in entry['files']])
+                 for name, entry in manifest['sets'].items()])
+
+
+def _pair_name(filename):
+    # images named by number pair by their number, and any others by their filename
+    stem = os.path.splitext(filename)[0]
+    return int(stem) if stem.isdigit() else filename
+
+
+def _index_image(directory, filename, stat):
+    from PIL import Image
+    path = os.path.join(directory, filename)
+    with open(path, 'rb') as image_file:
+        digest = hashlib.sha1(image_file.read()).hexdigest()
+    try:
+        with Image.open(path) as im:
+            width, height = im.size
+            im.load()
+    except (IOError, SyntaxError) as error:
+        raise ValueError('%s is not a readable image: %s' % (path, error))
+    return {'name': filename, 'width': width, 'height': height, 'sha1': digest, 'bytes': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+if __name__ == '__main__':
+    from CBLTM import stimulus_sets, manifest_file
+    stimulus_manifest = build_manifest(stimulus_sets)
+    save_manifest(manifest_file, stimulus_manifest)
+    check_pairs(stimulus_manifest, 'exemplarset0', 'exemplarset1')
+    for set_name, set_entry in sorted(stimulus_manifest['sets'].items()):
+        print('%s: %d images in %s' % (set_name, len(set_entry['files']), set_entry['dir']))
@@ -0,0 +1,249 @@
+"""
+Plan the stimulus assignment of many sessions at once, counterbalanced across subjects.
+
+A session plan fixes every random choice a session would otherwise make as it runs: which exemplars are studied and
+which are left unstudied, whether each is shown as exemplar A or B, the order the studied pairs are tested in, the
+fillers, the test slot of every change detection trial, the side of the studied image on every 2AFC trial, and where
+the repeats of the n-back study stream go and at what lag. Plans for a whole cohort are drawn together as arrays, one
+row per subject, and balanced over consecutive subjects:
+
+    exemplar A/B    subjects come in pairs that see the same exemplars, each shown as A to one and as B to the other,
+                    and half of each subject's exemplars are A
+    test slots      every trial takes every slot once over each group of items_per_array subjects, and each subject's
+                    trials use the slots equally often
+    2AFC sides      every trial has the studied image on the left for one of each pair of subjects, and on the right
+                    for the other
+    repeat lags     each half of the study stream uses every lag once, and over each group of len(repeat_lags)
+                    subjects every repeat takes every lag; the repeats are placed in the stream so that none is
+                    shown inside the span of another, which keeps every lag as planned
+
+Run from the Experiment directory, with the manifest up to date, to plan sessions of an experiment for subjects 01 to
+200:
+
+    python planner.py 1 200 --seed 7 --out plans_ex1.npz
+"""
+from streams import place_repeats, min_study_items
+import argparse, random
+
+# how many pairs each experiment takes from the studied and the unstudied exemplars, per trial of a task
+task_blocks = {1: (3, 1), 2: (4, 0), 3: (2, 1), 4: (3, 1), 5: (2, 1), 6: (2, 1)}
+# the blocks of each experiment that run change detection trials, that run 2AFC memory trials, and that insert repeats
+# into the study stream
+experiment_blocks = {1: (['studied', 'unstudied', '6afc'], ['memory'], []),
+                     2: (['studied', 'ignore_first', '6afc'], ['memory'], []),
+                     3: (['unstudied', 'strategy', '6afc'], [], []),
+                     4: (['flipped', 'unstudied', '6afc'], ['memory'], ['study']),
+                     5: (['unstudied', '6afc', 'hybrid'], [], []),
+                     6: (['unstudied', 'hybrid', '6afc'], [], [])}
+# the lags of the repeats in each of the stretches an n-back study stream is divided into, so that there are
+# repeat_sections times as many repeats as lags
+repeat_lags = [10, 30, 60]
+repeat_sections = 2
+study_repeats = repeat_sections * len(repeat_lags)
+# version 2 plans give the start of every repeat as its position in the finished stream
+plan_version = 2
+
+
+def plan_sessions(experiment, subjects, n_exemplars, n_fillers, trials_per_task=1, items_per_array=6, seed=None):
+    """
+    Draw the plans of many sessions of an experiment in one batch.
+
+    :param experiment: The integer of the experiment.
+    :param subjects: The list of subject IDs to plan sessions for, in the order they are counterbalanced in.
+    :param n_exemplars: Integer. The number of exemplar pairs in the stimulus library.
+    :param n_fillers: Integer. The number of fillers in the stimulus library.
+    :param trials_per_task: Integer. The number of trials of each task.
+    :param items_per_array: Integer. The number of items in each change detection array.
+    :param seed: The seed for the plans, so that they can be drawn again.
+    :return: The plans, as a dictionary of arrays with one row per subject; see session_plan for one subject's plan.
+    """
+    import numpy
+    rng = numpy.random.default_rng(seed)
+    n = len(subjects)
+    cd_blocks, memory_blocks, repeat_blocks = experiment_blocks[experiment]
+    n_studied, n_unstudied = [blocks * trials_per_task for blocks in task_blocks[experiment]]
+    n_exemplars_used = n_studied + n_unstudied
+    n_fillers_used = (len(cd_blocks) * trials_per_task * items_per_array +
+                      len(repeat_blocks) * study_repeats)
+    if n_exemplars_used > n_exemplars:
+        raise ValueError('experiment %d needs %d exemplars but there are %d' % (experiment, n_exemplars_used,
+                                                                               n_exemplars))
+    if n_fillers_used > n_fillers:
+        raise ValueError('experiment %d needs %d fillers but there are %d' % (experiment, n_fillers_used, n_fillers))
+    n_repeat_studied = min_study_items(repeat_lags * repeat_sections, repeat_sections)
+    if repeat_blocks and n_studied < n_repeat_studied:
+        raise ValueError('experiment %d studies %d items, too few for the repeats of its study stream; it needs '
+                         'trials_per_task of at least %d' % (experiment, n_studied,
+                                                             -(-n_repeat_studied // task_blocks[experiment][0])))
+    pairs = numpy.arange(n) // 2
+    exemplars = _sample(rng, (n + 1) // 2, n_exemplars, n_exemplars_used)[pairs]
+    lags = numpy.array(repeat_lags)[numpy.concatenate([_balanced(rng, n, len(repeat_lags), len(repeat_lags))
+                                                       for _ in range(0, repeat_sections)], axis=1)]
+    # each subject's repeats are placed around its own lags, which is quick as it only depends on the number of repeats
+    starts = numpy.zeros(lags.shape, dtype=numpy.int64)
+    if repeat_blocks:
+        stream_rng = random.Random(int(rng.integers(0, 2 ** 63)))
+        for i in range(0, n):
+            positions = place_repeats(n_studied, lags[i].tolist(), stream_rng, repeat_sections)
+            starts[i] = [start for start, lag in positions]
+    plans = {'version': numpy.array(plan_version), 'experiment': numpy.array(experiment),
+             'subjects': numpy.array([str(subject) for subject in subjects]),
+             'n_exemplars': numpy.array(n_exemplars), 'n_fillers': numpy.array(n_fillers),
+             'trials_per_task': numpy.array(trials_per_task), 'items_per_array': numpy.array(items_per_array),
+             'cd_blocks': numpy.array(cd_blocks, dtype=str), 'memory_blocks': numpy.array(memory_blocks, dtype=str),
+             'repeat_blocks': numpy.array(repeat_blocks, dtype=str),
+             'exemplars': exemplars,
+             'exemplar_sets': _balanced(rng, n, n_exemplars_used, 2),
+             'studied_order': numpy.argsort(rng.random((n, n_studied)), axis=1),
+             'fillers': _sample(rng, n, n_fillers, n_fillers_used),
+             'test_slots': _balanced(rng, n, len(cd_blocks) * trials_per_task, items_per_array).reshape(
+                 n, len(cd_blocks), trials_per_task) + 1,
+             'test_sides': _balanced(rng, n, len(memory_blocks) * trials_per_task, 2).reshape(
+                 n, len(memory_blocks), trials_per_task),
+             'repeat_starts': starts[:, None, :].repeat(len(repeat_blocks), axis=1),
+             'repeat_lags': lags[:, None, :].repeat(len(repeat_blocks), axis=1)}
+    return plans
+
+
+def session_plan(plans, subject):
+    """
+    Pick one subject's plan out of a batch.
+
+    :param plans: The plans, as from plan_sessions or load_plans.
+    :param subject: The subject ID.
+    :return: The plan as a dictionary of lists, which can be saved as json. 'exemplars' are the exemplar pairs the
+            session uses, studied first, and 'exemplar_sets' whether each is shown as exemplar A (0) or B (1);
+            'studied_order' is the order the studied pairs are tested in, and 'fillers' the fillers in the order they
+            are drawn, both as indices. 'blocks' maps each block that draws anything to the keyword arguments of its
+            task: 'test_slots', 'test_sides' or 'repeat_positions', a list of (start, lag) pairs.
+    """
+    matches = (plans['subjects'] == str(subject)).nonzero()[0]
+    if not len(matches):
+        raise ValueError('there is no plan for subject %s' % subject)
+    i = matches[0]
+    blocks = {}
+    for j, name in enumerate(plans['cd_blocks'].tolist()):
+        blocks[name] = {'test_slots': plans['test_slots'][i, j].tolist()}
+    for j, name in enumerate(plans['memory_blocks'].tolist()):
+        blocks[name] = {'test_sides': plans['test_sides'][i, j].tolist()}
+    for j, name in enumerate(plans['repeat_blocks'].tolist()):
+        blocks[name] = {'repeat_positions': list(zip(plans['repeat_starts'][i, j].tolist(),
+                                                     plans['repeat_lags'][i, j].tolist()))}
+    plan = {'subject': str(subject), 'blocks': blocks}
+    for name in ['version', 'experiment', 'n_exemplars', 'n_fillers', 'trials_per_task', 'items_per_array']:
+        plan[name] = int(plans[name])
+    for name in ['exemplars', 'exemplar_sets', 'studied_order', 'fillers']:
+        plan[name] = plans[name][i].tolist()
+    return plan
+
+
+def save_plans(path, plans):
+    """
+    :param path: String. The filename for the plans, including the .npz extension.
+    :param plans: The plans, as from plan_sessions.
+    :return: None.
+    """
+    import numpy
+    numpy.savez(path, **plans)
+
+
+def load_plans(path):
+    """
+    :param path: String. The filename of the plans.
+    :return: The plans, as a dictionary of arrays.
+    """
+    import numpy
+    with numpy.load(path) as plans_npz:
+        plans = dict(plans_npz.items())
+    if int(plans['version']) != plan_version:
+        raise ValueError('%s holds version %d plans, not %d' % (path, int(plans['version']), plan_version))
+    return plans
+
+
+def check_plan(plan, experiment, n_exemplars, n_fillers, trials_per_task, items_per_array):
+    """
+    Check that a session plan was drawn for the experiment and stimulus library a session is about to run.
+
+    :param plan: One subject's plan, as from session_plan.
+    :param experiment: The integer of the experiment.
+    :param n_exemplars: Integer. The number of exemplar pairs in the stimulus library.
+    :param n_fillers: Integer. The number of fillers in the stimulus library.
+    :param trials_per_task: Integer. The number of trials of each task.
+    :param items_per_array: Integer. The number of items in each change detection array.
+    :return: None.
+    """
+    expected = [('experiment', experiment), ('n_exemplars', n_exemplars), ('n_fillers', n_fillers),
+                ('trials_per_task', trials_per_task), ('items_per_array', items_per_array)]
+    for name, value in expected:
+        if plan[name] != value:
+            raise ValueError('the plan for subject %s has %s %d but the session has %d' % (plan['subject'], name,
+                                                                                          plan[name], value))
+
+
+def balance(plans):
+    """
+    Count how evenly a batch of plans spreads each counterbalanced choice.
+
+    :param plans: The plans, as from plan_sessions or load_plans.
+    :return: A dictionary mapping 'exemplar_sets', 'test_slots', 'test_sides' and 'repeat_lags' to the largest
+            difference, over exemplars, trials or repeats, between how often the most and the least used level was
+            assigned to it.
+    """
+    import numpy
+    n = len(plans['subjects'])
+    # each exemplar's sets are counted over the subjects that were shown it
+    exemplar_sets = numpy.zeros((int(plans['n_exemplars']), 2), dtype=numpy.int64)
+    numpy.add.at(exemplar_sets, (plans['exemplars'].ravel(), plans['exemplar_sets'].ravel()), 1)
+    counts = {'exemplar_sets': exemplar_sets[exemplar_sets.sum(axis=1) > 0]}
+    for name, levels in [('test_slots', numpy.arange(1, int(plans['items_per_array']) + 1)),
+                         ('test_sides', numpy.arange(0, 2)), ('repeat_lags', numpy.array(repeat_lags))]:
+        counts[name] = (plans[name].reshape(n, -1)[:, :, None] == levels).sum(axis=0)
+    return dict([(name, int((count.max(axis=1) - count.min(axis=1)).max()) if count.size else 0)
+                 for name, count in counts.items()])
+
+
+def _balanced(rng, n_subjects, n_items, levels):
+    # each consecutive group of `levels` subjects shares one shuffled sequence in which every level appears equally
+    # often, and each subject of the group shifts its levels by its place in the group, so that every item takes every
+    # level once within the group
+    import numpy
+    groups = -(-n_subjects // levels)
+    base = numpy.tile(numpy.arange(levels), (groups, -(-n_items // levels)))[:, :n_items]
+    base = rng.permuted(base, axis=1)
+    subjects = numpy.arange(n_subjects)
+    return (base[subjects // levels] + (subjects % levels)[:, None]) % levels
+
+
+def _sample(rng, n_rows, n_items, k):
+    # k distinct indices below n_items for every row, in random order
+    import numpy
+    keys = rng.random((n_rows, n_items), dtype=numpy.float32)
+    chosen = numpy.argpartition(keys, k - 1, axis=1)[:, :k] if k < n_items else numpy.argsort(keys, axis=1)
+    order = numpy.argsort(numpy.take_along_axis(keys, chosen, axis=1), axis=1)
+    return numpy.take_along_axis(chosen, order, axis=1)
+
+
+if __name__ == '__main__':
+    import time
+    from CBLTM import stimulus_sets, manifest_file
+    from manifest import load_manifest, manifest_paths
+    parser = argparse.ArgumentParser(description='Plan counterbalanced sessions of an experiment.')
+    parser.add_argument('experiment', type=int)
+    parser.add_argument('n_subjects', type=int)
+    parser.add_argument('--first', type=int, default=1, help='the number of the first subject')
+    parser.add_argument('--id-format', default='%02d', help='how subject numbers are written as subject IDs')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--trials-per-task', type=int, default=1)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args()
+    library = manifest_paths(load_manifest(manifest_file, stimulus_sets))
+    subject_ids = [args.id_format % i for i in range(args.first, args.first + args.n_subjects)]
+    started = time.perf_counter()
+    session_plans = plan_sessions(args.experiment, subject_ids, len(library['exemplarset0']), len(library['fillers']),
+                                  args.trials_per_task, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    out_file = args.out or 'plans_ex%d.npz' % args.experiment
+    save_plans(out_file, session_plans)
+    print('Planned %d sessions in %.3f s, saved to %s' % (len(subject_ids), elapsed, out_file))
+    for choice_name, choice_spread in sorted(balance(session_plans).items()):
+        print('%s: most and least used levels differ by at most %d' % (choice_name, choice_spread))
@@ -0,0 +1,49 @@
+import random
+
+
+class StimulusPool(object):
+    """
+    A set of stimuli that are drawn at random, or in a planned order, without replacement.
+
+    Draws swap the chosen item with the last one and pop it, so each draw costs the same no matter how large the
+    pool is. Items can be anything, e.g. filepaths or (target, complement) pairs that have to be drawn together.
+    """
+
+    def __init__(self, items, rng=random):
+        """
+        :param items: An iterable of the stimuli in the pool. The pool keeps its own copy.
+        :param rng: The random number generator to draw with; the random module unless given. If None, the items are
+                    drawn in the order given, e.g. as a session plan laid them out.
+        """
+        self.items = list(items)
+        self.rng = rng
+        if rng is None:
+            # drawing from the end of the list needs no swap, so the list is kept in reverse
+            self.items.reverse()
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self):
+        """
+        Remove and return one item chosen at random.
+
+        :return: The drawn item.
+        """
+        items = self.items
+        if not items:
+            raise IndexError('draw from an empty StimulusPool')
+        idx = self.rng.randrange(len(items)) if self.rng is not None else len(items) - 1
+        items[idx], items[-1] = items[-1], items[idx]
+        return items.pop()
+
+    def draw_many(self, n):
+        """
+        Remove and return several distinct items chosen at random.
+
+        :param n: Integer. The number of items to draw.
+        :return: A list of the drawn items, in the order they were drawn.
+        """
+        if n > len(self.items):
+            raise IndexError('cannot draw %d items from a StimulusPool of %d' % (n, len(self.items)))
+        return [self.draw() for i in range(0, n)]
@@ -0,0 +1,112 @@
+"""
+Trial records with a fixed schema, and writers that lay them out as csv or as binary columns.
+"""
+import csv
+from operator import itemgetter
+
+# every field a task can record for a trial, in the order the fields are stored
+trial_fields = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'lr_response',
+                'response_image', 'filler1', 'filler2', 'filler3', 'filler4', 'filler5', 'rt', 'lr_rt', 'test_slot',
+                'filler6']
+# the name of the numpy type of each field in the binary columns; fields not listed are stored as strings
+trial_field_types = {'correct': 'int8', 'timestamp': 'float64', 'rt': 'float64', 'lr_rt': 'float64', 'test_slot': 'int8'}
+filler_fields = ['filler1', 'filler2', 'filler3', 'filler4', 'filler5', 'filler6']
+
+# the columns each experiment saves, in the order they are written
+_common_fields = ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'timestamp', 'response_image',
+                  'filler1', 'filler2', 'filler3', 'filler4', 'filler5', 'rt', 'test_slot', 'filler6']
+experiment_fields = {1: _common_fields, 2: _common_fields, 3: _common_fields,
+                     4: ['trial_type', 'correct', 'raw_response', 'test_image', 'bait_image', 'lr_response',
+                         'response_image', 'filler1', 'filler2', 'filler3', 'filler4', 'filler5', 'rt', 'lr_rt',
+                         'timestamp', 'test_slot', 'filler6'],
+                     5: _common_fields, 6: _common_fields}
+
+
+class TrialRecord(list):
+    """
+    One trial of a task. It is a list of fixed length holding the fields of trial_fields in order, so it is logged
+    and read back as a plain list, and each field can also be read and set by name.
+    """
+    __slots__ = ()
+
+    def __init__(self, fillers=(), **fields):
+        """
+        :param fillers: The filler images drawn for the slots of the array, in slot order, stored in filler1 to
+                        filler6. The one drawn for the test slot is not shown.
+        :param fields: The value of each field by name. Fields not given are left empty.
+        """
+        list.__init__(self, [fields.pop(name, '') for name in trial_fields])
+        unknown = sorted(fields.keys())
+        if unknown:
+            raise TypeError('unknown trial fields: ' + ', '.join(unknown))
+        for i in range(0, len(fillers)):
+            self[trial_fields.index(filler_fields[i])] = fillers[i]
+
+
+def _field(index):
+    return property(itemgetter(index), lambda record, value: record.__setitem__(index, value))
+
+for _index, _name in enumerate(trial_fields):
+    setattr(TrialRecord, _name, _field(_index))
+
+
+def field_columns(fieldnames, schema=trial_fields):
+    """
+    Work out once where each column to be written is stored in a row.
+
+    :param fieldnames: The names of the columns to write, in order.
+    :param schema: The names of the fields of a row, in the order they are stored.
+    :return: The list of row indices for the columns.
+    """
+    return [schema.index(name) for name in fieldnames]
+
+
+def write_rows(filename, fieldnames, rows, columns=None):
+    """
+    Write rows to a csv file in one pass, picking the columns out of each row by position.
+
+    :param filename: String. The filename for the csv, including the extension.
+    :param fieldnames: List. The column names for the file.
+    :param rows: An iterable of rows, each a list or TrialRecord.
+    :param columns: The index in each row of every column, as from field_columns; the first len(fieldnames) items of
+                    each row if not given.
+    :return: None.
+    """
+    if columns is None:
+        columns = list(range(0, len(fieldnames)))
+    # itemgetter returns a bare value rather than a tuple when there is only one column
+    pick = itemgetter(*columns) if len(columns) > 1 else lambda row: (row[columns[0]],)
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(fieldnames)
+        writer.writerows(map(pick, rows))
+
+
+def write_columns(filename, fieldnames, rows, columns=None, types=trial_field_types):
+    """
+    Write rows to a numpy .npz file holding one array per column, so they can be loaded without parsing.
+    Empty values are stored as NaN in float columns and as -1 in integer columns.
+
+    :param filename: String. The filename for the file, including the .npz extension.
+    :param fieldnames: List. The column names for the file.
+    :param rows: A list of rows, each a list or TrialRecord.
+    :param columns: The index in each row of every column, as from field_columns; the first len(fieldnames) items of
+                    each row if not given.
+    :param types: A dictionary of the numpy type name of each column; columns not listed are stored as strings.
+    :return: None.
+    """
+    import numpy
+    if columns is None:
+        columns = list(range(0, len(fieldnames)))
+    arrays = {}
+    for name, index in zip(fieldnames, columns):
+        values = [row[index] for row in rows]
+        dtype = types.get(name, str)
+        if dtype == 'float64':
+            values = [numpy.nan if value == '' else value for value in values]
+        elif dtype is str:
+            values = [str(value) for value in values]
+        else:
+            values = [-1 if value == '' else value for value in values]
+        arrays[name] = numpy.array(values, dtype=dtype)
+    numpy.savez(filename, **arrays)
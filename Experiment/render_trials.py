@@ -0,0 +1,340 @@
+"""
+Rebuild the displays of logged change detection trials as images, to check what subjects were shown.
+
+Each trial row gives the test, bait and filler images, and the slot the subject clicked. The pre-change and post-change
+arrays are laid out with the slot geometry of run_experiment and drawn on a white window like the session's, with the
+test slot outlined in green and a wrong response in red. Object memory trials are drawn as their two-image display.
+Every data file becomes one contact sheet of its trials, or a directory of images with one per display. Files are
+rendered in parallel on a process pool, and each process keeps the images it has decoded and resized for the trials
+that follow, so this needs Pillow but not Psychopy or a display. Run from the Experiment directory:
+
+    python render_trials.py ../Analysis/Data/Experiments ../Analysis/Data/renders --stimuli Stimuli
+
+The fillers are logged in the slots they were drawn for, filler1 to filler6. Sessions logged before the test slot and
+the sixth filler were recorded only give the test slot on correct trials, so on their wrong trials no slot is marked as
+the test, and their sixth slot is drawn as a grey placeholder, as are images missing from the stimuli directory.
+"""
+from collections import OrderedDict
+from multiprocessing import Pool
+import argparse, csv, os, re
+
+from CBLTM import array_slots
+from records import filler_fields
+
+window_size = (1080, 720)
+items_per_array = 6
+# how many decoded and resized images each process keeps for later trials
+image_cache_size = 4096
+# the size images whose files are missing are drawn at when the display did not resize them
+missing_image_size = 200
+# trial types shown without a pre-change array
+no_prechange_types = ('6afc', '6AFC', 'memory6AFC')
+test_colour = (0, 170, 0)
+wrong_colour = (220, 0, 0)
+placeholder_colour = (200, 200, 200)
+label_height = 14
+# zlib level of the png files; sheets of a whole session compress slowly at higher levels for little gain
+png_compression = 1
+
+_images = OrderedDict()
+_directories = {}
+_font = None
+
+
+def label_font():
+    """
+    :return: The font labels are written in: Pillow's bitmap font, which draws far faster than its scalable default.
+    """
+    global _font
+    if _font is None:
+        from PIL import ImageFont
+        _font = ImageFont.load_default_imagefont() if hasattr(ImageFont, 'load_default_imagefont') else \
+            ImageFont.load_default()
+    return _font
+
+
+def resolve_image(path, stimuli_dir):
+    """
+    Find the file of a logged image. Older sessions logged paths relative to the stimuli directory, newer ones
+    relative to the Experiment directory, and older sessions did not always pad the numbers of the files the way they
+    are named, so a file that is not found is looked up by its number.
+
+    :param path: String. The image as logged, e.g. 'exemplarA/187.jpg' or 'Stimuli/exemplarA/187.jpg'.
+    :param stimuli_dir: String. The stimuli directory.
+    :return: The filepath of the image, or None if it cannot be found.
+    """
+    relative = path.replace('\\', '/')
+    if relative.startswith('Stimuli/'):
+        relative = relative[len('Stimuli/'):]
+    filepath = os.path.join(stimuli_dir, relative)
+    if os.path.exists(filepath):
+        return filepath
+    directory, filename = os.path.split(filepath)
+    stem, extension = os.path.splitext(filename)
+    if not stem.isdigit():
+        return None
+    if directory not in _directories:
+        numbered = {}
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                number = os.path.splitext(name)[0]
+                if number.isdigit():
+                    numbered[int(number)] = name
+        _directories[directory] = numbered
+    name = _directories[directory].get(int(stem))
+    return os.path.join(directory, name) if name is not None else None
+
+
+def load_image(path, stimuli_dir, size=None):
+    """
+    Decode an image at the size it is drawn at, keeping it for later trials.
+
+    :param path: String. The image as logged, or None for an image that was not logged.
+    :param stimuli_dir: String. The stimuli directory.
+    :param size: The (width, height) to draw the image at in pixels, or None to draw it at its own size.
+    :return: An RGB PIL image. Images that were not logged or cannot be found are drawn as grey placeholders.
+    """
+    from PIL import Image, ImageDraw
+    key = (path, stimuli_dir, size)
+    image = _images.get(key)
+    if image is not None:
+        _images.move_to_end(key)
+        return image
+    filepath = resolve_image(path, stimuli_dir) if path else None
+    if filepath is not None:
+        with Image.open(filepath) as original:
+            image = original.convert('RGB')
+        if size is not None and image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+    else:
+        image = Image.new('RGB', size or (missing_image_size, missing_image_size), placeholder_colour)
+        ImageDraw.Draw(image).text((2, 2), os.path.basename(path) if path else '?', fill=(0, 0, 0),
+                                   font=label_font())
+    _images[key] = image
+    if len(_images) > image_cache_size:
+        _images.popitem(last=False)
+    return image
+
+
+def trial_layout(row, items=items_per_array):
+    """
+    Work out what was shown in each slot of a change detection trial from its logged row.
+
+    :param row: A dictionary of the trial's fields, as from csv.DictReader.
+    :param items: Integer. The number of slots in the arrays.
+    :return: A (test_slot, prechange, postchange) tuple. test_slot is the slot of the test image, or None if the row
+            does not say. prechange and postchange map each slot to the image shown in it, with None for an image that
+            was not logged; prechange is None for trials without a pre-change array.
+    """
+    logged_slot = row.get('test_slot', '')
+    if logged_slot not in ('', None, '-1'):
+        test_slot = int(logged_slot)
+    else:
+        # older sessions only say where the test image was when the subject clicked it
+        test_slot = int(row['raw_response']) if row.get('correct') == '1' else None
+    # the fillers are logged for the slots they were drawn for, whichever slot the test image was in
+    fillers = [row.get(field) or None for field in filler_fields]
+    postchange = dict([(slot, fillers[slot - 1] if slot <= len(fillers) else None) for slot in range(1, items + 1)])
+    if test_slot is not None:
+        postchange[test_slot] = row['test_image']
+    if row.get('trial_type') in no_prechange_types:
+        return test_slot, None, postchange
+    prechange = dict(postchange)
+    if test_slot is not None:
+        prechange[test_slot] = row['bait_image']
+    return test_slot, prechange, postchange
+
+
+def render_array(images, stimuli_dir, scale=1., marks=()):
+    """
+    Draw a change detection array as it appeared in the window.
+
+    :param images: A dictionary mapping each slot to its image, as from trial_layout.
+    :param stimuli_dir: String. The stimuli directory.
+    :param scale: Float. The size to draw the window at, relative to window_size.
+    :param marks: A list of (slot, colour) pairs of slots to outline.
+    :return: An RGB PIL image of the window.
+    """
+    from PIL import Image, ImageDraw
+    width, height = int(window_size[0] * scale), int(window_size[1] * scale)
+    slots, slot_size = array_slots(window_size, len(images))
+    size = max(1, int(round(slot_size * scale)))
+    canvas = Image.new('RGB', (width, height), 'white')
+    corners = {}
+    for slot, path in images.items():
+        x, y = slots[slot - 1]
+        corners[slot] = (int(round(width / 2. + x * scale - size / 2.)),
+                         int(round(height / 2. - y * scale - size / 2.)))
+        canvas.paste(load_image(path, stimuli_dir, (size, size)), corners[slot])
+    draw = ImageDraw.Draw(canvas)
+    for slot, colour in marks:
+        if slot in corners:
+            left, top = corners[slot]
+            draw.rectangle([left - 2, top - 2, left + size + 1, top + size + 1], outline=colour, width=2)
+    return canvas
+
+
+def render_memory(row, stimuli_dir, scale=1.):
+    """
+    Draw the two-image display of an object memory trial, with the test image on the side the subject picked if
+    they were right and on the other side if not.
+
+    :param row: A dictionary of the trial's fields, as from csv.DictReader.
+    :param stimuli_dir: String. The stimuli directory.
+    :param scale: Float. The size to draw the window at, relative to window_size.
+    :return: An RGB PIL image of the window.
+    """
+    from PIL import Image, ImageDraw
+    width, height = int(window_size[0] * scale), int(window_size[1] * scale)
+    canvas = Image.new('RGB', (width, height), 'white')
+    test_side = ['left', 'right'].index(row['raw_response']) if row['raw_response'] in ('left', 'right') else 0
+    if row.get('correct') != '1':
+        test_side = 1 - test_side
+    draw = ImageDraw.Draw(canvas)
+    for side, path in [(test_side, row['test_image']), (1 - test_side, row['bait_image'])]:
+        image = load_image(path, stimuli_dir)
+        if scale != 1.:
+            image = load_image(path, stimuli_dir, (max(1, int(image.size[0] * scale)),
+                                                   max(1, int(image.size[1] * scale))))
+        left = int(width / 2. + (side * 2 - 1) * width / 4. - image.size[0] / 2.)
+        top = int(height / 2. - image.size[1] / 2.)
+        canvas.paste(image, (left, top))
+        if path == row['test_image']:
+            draw.rectangle([left - 2, top - 2, left + image.size[0] + 1, top + image.size[1] + 1],
+                           outline=test_colour, width=2)
+    return canvas
+
+
+def render_trial(row, stimuli_dir, scale=1.):
+    """
+    :param row: A dictionary of the trial's fields, as from csv.DictReader.
+    :param stimuli_dir: String. The stimuli directory.
+    :param scale: Float. The size to draw the window at, relative to window_size.
+    :return: A (prechange, postchange) tuple of RGB PIL images of the displays, where prechange is None for trials
+            without a pre-change array.
+    """
+    if row.get('trial_type') == 'memory':
+        return None, render_memory(row, stimuli_dir, scale)
+    test_slot, prechange, postchange = trial_layout(row)
+    marks = [(test_slot, test_colour)] if test_slot is not None else []
+    if row.get('correct') != '1' and row.get('raw_response', '').isdigit():
+        marks.append((int(row['raw_response']), wrong_colour))
+    return (render_array(prechange, stimuli_dir, scale) if prechange is not None else None,
+            render_array(postchange, stimuli_dir, scale, marks))
+
+
+def trial_label(number, row):
+    """
+    :return: String. A line describing a trial, for the contact sheet.
+    """
+    if row.get('trial_type') == 'memory':
+        return '%d %s %s %s' % (number, row['trial_type'], row['raw_response'], 'correct' if row.get('correct') == '1'
+                                else 'wrong')
+    test_slot = trial_layout(row)[0]
+    return '%d %s test %s picked %s' % (number, row.get('trial_type', ''), test_slot if test_slot is not None else '?',
+                                         row.get('raw_response', ''))
+
+
+def read_trials(path):
+    """
+    :param path: String. The filepath of a data file.
+    :return: A list of a dictionary for each trial with a test image, or None if the file is not a trial data file.
+    """
+    with open(path, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        if 'test_image' not in (reader.fieldnames or []):
+            return None
+        return [row for row in reader if row.get('test_image') and row.get('raw_response') is not None]
+
+
+def render_file(job):
+    """
+    Render the trials of one data file, as a contact sheet or as an image of each display.
+
+    :param job: A (path, out_path, stimuli_dir, scale, columns, per_trial) tuple: the data file; the filepath of the
+                contact sheet, or the directory of the images if per_trial is True; the stimuli directory; the size to
+                draw the window at relative to window_size; and the number of trials in each row of the sheet.
+    :return: A (path, trials) tuple of the data file and the number of trials rendered.
+    """
+    from PIL import Image, ImageDraw
+    path, out_path, stimuli_dir, scale, columns, per_trial = job
+    rows = read_trials(path)
+    if not rows:
+        return path, 0
+    if per_trial:
+        if not os.path.isdir(out_path):
+            os.makedirs(out_path)
+        for number, row in enumerate(rows, 1):
+            prechange, postchange = render_trial(row, stimuli_dir, scale)
+            if prechange is not None:
+                prechange.save(os.path.join(out_path, '%03d_prechange.png' % number), compress_level=png_compression)
+            postchange.save(os.path.join(out_path, '%03d_postchange.png' % number), compress_level=png_compression)
+        return path, len(rows)
+    width, height = int(window_size[0] * scale), int(window_size[1] * scale)
+    cell_width, cell_height = 2 * width + 4, height + label_height
+    sheet_rows = (len(rows) + columns - 1) // columns
+    sheet = Image.new('RGB', (columns * (cell_width + 8), sheet_rows * (cell_height + 8)), (128, 128, 128))
+    draw = ImageDraw.Draw(sheet)
+    for i, row in enumerate(rows):
+        left, top = (i % columns) * (cell_width + 8), (i // columns) * (cell_height + 8)
+        prechange, postchange = render_trial(row, stimuli_dir, scale)
+        if prechange is not None:
+            sheet.paste(prechange, (left, top))
+        else:
+            draw.rectangle([left, top, left + width - 1, top + height - 1], fill=placeholder_colour)
+        sheet.paste(postchange, (left + width + 4, top))
+        draw.text((left + 2, top + height + 1), trial_label(i + 1, row), fill=(255, 255, 255), font=label_font())
+    directory = os.path.dirname(out_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    sheet.save(out_path, compress_level=png_compression)
+    return path, len(rows)
+
+
+def render_archive(data_dir, out_dir, stimuli_dir='Stimuli', scale=None, columns=6, per_trial=False,
+                   processes=None):
+    """
+    Render every trial data file under a directory, keeping its layout of subdirectories.
+
+    :param data_dir: String. The directory to search for data files, e.g. ../Analysis/Data/Experiments.
+    :param out_dir: String. The directory to write the contact sheets, or directories of images, to.
+    :param stimuli_dir: String. The stimuli directory.
+    :param scale: Float. The size to draw the window at, relative to window_size; .25 for contact sheets and 1 for
+                  images of each display if not given.
+    :param columns: Integer. The number of trials in each row of a contact sheet.
+    :param per_trial: Boolean. Whether to write an image of each display instead of a contact sheet.
+    :param processes: Integer. The number of processes to render with; one per CPU if not given.
+    :return: A list of (path, trials) tuples of each data file and the number of trials rendered from it.
+    """
+    if scale is None:
+        scale = 1. if per_trial else .25
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(data_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.csv') or re.search('nback', filename):
+                continue
+            stem = os.path.join(out_dir, os.path.relpath(dirpath, data_dir), os.path.splitext(filename)[0])
+            jobs.append((os.path.join(dirpath, filename), stem if per_trial else stem + '.png', stimuli_dir, scale,
+                         columns, per_trial))
+    if processes == 1:
+        return [render_file(job) for job in jobs]
+    with Pool(processes) as pool:
+        return list(pool.imap_unordered(render_file, jobs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the displays of logged trials as images.')
+    parser.add_argument('data_dir', help='the directory of data files, e.g. ../Analysis/Data/Experiments')
+    parser.add_argument('out_dir', help='the directory to write the images to')
+    parser.add_argument('--stimuli', default='Stimuli', help='the stimuli directory')
+    parser.add_argument('--scale', type=float, default=None, help='the size of the window in the images')
+    parser.add_argument('--columns', type=int, default=6, help='the trials in each row of a contact sheet')
+    parser.add_argument('--per-trial', action='store_true', help='write an image of each display instead of a '
+                                                                 'contact sheet')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+    results = render_archive(args.data_dir, args.out_dir, args.stimuli, args.scale, args.columns, args.per_trial,
+                             args.processes)
+    print('rendered %d trials from %d files' % (sum([trials for path, trials in results]),
+                                                 len([path for path, trials in results if trials])))
@@ -0,0 +1,56 @@
+class ResponseCollector(object):
+    """
+    Collect key presses and mouse clicks with their response times, measured from the onset of a display.
+
+    Key presses come from an event-driven keyboard, which stamps each press when it happens rather than when it is
+    polled, so the collector can sleep between polls without losing timing accuracy. The onset is marked by
+    resetting the keyboard's clock on the flip that shows the display.
+    """
+
+    def __init__(self, keyboard, wait, poll_interval=.001):
+        """
+        :param keyboard: The keyboard to read presses from, e.g. a psychopy.hardware.keyboard.Keyboard.
+        :param wait: The function to sleep with between polls, e.g. core.wait.
+        :param poll_interval: How long to sleep between polls, in seconds.
+        """
+        self.keyboard = keyboard
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    def start_on_flip(self, window):
+        """
+        Time responses from the next flip of the window, and drop any presses made before it.
+
+        :param window: The window whose next flip shows the display being responded to.
+        :return: None.
+        """
+        self.keyboard.clearEvents()
+        window.callOnFlip(self.keyboard.clock.reset)
+
+    def wait_keys(self, key_list=None):
+        """
+        Wait for a key press.
+
+        :param key_list: The list of key names to accept, or None for any key.
+        :return: A (key name, response time) tuple.
+        """
+        while True:
+            keys = self.keyboard.getKeys(keyList=key_list, waitRelease=False)
+            if keys:
+                return keys[0].name, keys[0].rt
+            self.wait(self.poll_interval, hogCPUperiod=0)
+
+    def wait_click(self, mouse, hit_test):
+        """
+        Wait for a click inside one of the slots of a hit test.
+
+        :param mouse: The mouse object to monitor.
+        :param hit_test: The SlotHitTest that maps a click to the slot it landed in.
+        :return: A (slot number, response time) tuple.
+        """
+        while True:
+            if mouse.getPressed()[0]:
+                slot = hit_test.slot_at(mouse.getPos())
+                if slot is not None:
+                    return slot, self.keyboard.clock.getTime()
+            self.wait(self.poll_interval, hogCPUperiod=0)
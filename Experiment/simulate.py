@@ -0,0 +1,103 @@
+"""
+Run many virtual sessions of an experiment on the headless backend, spread across a process pool.
+
+Run from the Experiment directory, e.g. to simulate 1000 sessions of experiment 1:
+
+    python simulate.py 1 1000 --out simulated
+
+Experiment 4 repeats items in its study stream, which only fit in a stream of enough studied items:
+
+    python simulate.py 4 1000 --trials-per-task 80 --out simulated
+
+With --collector, the sessions stream their trials to a collector as real stations do, e.g. to try out
+Analysis/collector.py before a study.
+"""
+from backends import HeadlessBackend, SimulatedObserver
+from multiprocessing import Pool
+import argparse, os, random
+
+
+def simulate_session(experiment, subject, seed, data_dir, observer_params={}, plan_file=None, collector=None,
+                     trials_per_task=1, record_spans=False):
+    """
+    Run one virtual session and save its data as the real experiment would.
+
+    :param experiment: The integer of the experiment to run.
+    :param subject: String. The subject ID for the session's data files.
+    :param seed: The seed for both the stimulus assignment and the observer.
+    :param data_dir: String. The directory to save the data files to.
+    :param observer_params: A dictionary of keyword arguments for the SimulatedObserver.
+    :param plan_file: String. The file of session plans to take the subject's plan from, or None to draw one.
+    :param collector: The address of a collector to stream trials to, as 'host:port', or None.
+    :param trials_per_task: Integer. The number of trials of each task.
+    :param record_spans: Whether to save a trace of the session's phases and trial stages next to its data.
+    :return: The subject ID.
+    """
+    import CBLTM
+    backend = HeadlessBackend(SimulatedObserver(seed=seed, **observer_params), subject=subject)
+    CBLTM.use_backend(backend)
+    random.seed(seed)
+    CBLTM.run_experiment(experiment, backend.visual.Window([1080, 720]), data_dir=data_dir, plan_file=plan_file,
+                         collector=collector, trials_per_task=trials_per_task, record_spans=record_spans)
+    return subject
+
+
+def _simulate_session(args):
+    return simulate_session(*args)
+
+
+def simulate_sessions(experiment, n_sessions, data_dir, observer_params={}, processes=None, first_seed=0,
+                      plan_file=None, collector=None, trials_per_task=1, record_spans=False):
+    """
+    Run many virtual sessions in parallel.
+
+    :param experiment: The integer of the experiment to run.
+    :param n_sessions: Integer. The number of sessions to run.
+    :param data_dir: String. The directory to save the data files to; created if it does not exist.
+    :param observer_params: A dictionary of keyword arguments for the SimulatedObserver.
+    :param processes: Integer. The number of worker processes; one per CPU if not given.
+    :param first_seed: Integer. Session i is seeded with first_seed + i, so runs can be repeated exactly.
+    :param plan_file: String. A file of session plans from planner.py. If given, session i runs the plan of subject
+                      first_seed + i in the file, under that subject's ID.
+    :param collector: The address of a collector to stream trials to, as 'host:port', or None.
+    :param trials_per_task: Integer. The number of trials of each task; experiment 4 needs enough for its repeats.
+    :param record_spans: Whether to save a trace of each session's phases and trial stages next to its data.
+    :return: The list of subject IDs that were run.
+    """
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    if plan_file:
+        from planner import load_plans
+        subjects = load_plans(plan_file)['subjects'][first_seed:first_seed + n_sessions].tolist()
+    else:
+        subjects = ['sim%05d' % (first_seed + i) for i in range(0, n_sessions)]
+    jobs = [(experiment, subjects[i], first_seed + i, data_dir, observer_params, plan_file, collector,
+             trials_per_task, record_spans) for i in range(0, len(subjects))]
+    pool = Pool(processes)
+    try:
+        return pool.map(_simulate_session, jobs, chunksize=max(1, n_sessions // (4 * (processes or os.cpu_count()))))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate sessions of an experiment without a display.')
+    parser.add_argument('experiment', type=int)
+    parser.add_argument('sessions', type=int)
+    parser.add_argument('--out', default='simulated', help='directory to save the data files to')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first session')
+    parser.add_argument('--plans', default=None, help='a file of session plans from planner.py to run')
+    parser.add_argument('--collector', default=None, help='the host:port of a collector to stream trials to')
+    parser.add_argument('--trials-per-task', type=int, default=1)
+    parser.add_argument('--trace', action='store_true', help='save a trace of every session next to its data')
+    parser.add_argument('--p-detect-change', type=float, default=.6)
+    parser.add_argument('--p-recognize', type=float, default=.75)
+    parser.add_argument('--p-spot-repeat', type=float, default=.8)
+    parser.add_argument('--p-false-alarm', type=float, default=.02)
+    args = parser.parse_args()
+    observer_params = {'p_detect_change': args.p_detect_change, 'p_recognize': args.p_recognize,
+                       'p_spot_repeat': args.p_spot_repeat, 'p_false_alarm': args.p_false_alarm}
+    simulate_sessions(args.experiment, args.sessions, args.out, observer_params, args.processes, args.seed,
+                      args.plans, args.collector, args.trials_per_task, args.trace)
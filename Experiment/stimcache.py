@@ -0,0 +1,139 @@
+from collections import OrderedDict
+
+
+def decode_image(path):
+    """
+    Read and fully decode an image file.
+
+    :param path: String. The filepath of the image.
+    :return: The decoded PIL image, with its file handle already closed.
+    """
+    from PIL import Image
+    im = Image.open(path)
+    im.load()
+    return im
+
+
+class StimulusCache(object):
+    """
+    Session-wide cache of decoded stimulus images and the ImageStims built from them.
+
+    Images are kept in least-recently-used order and evicted once the decoded pixels exceed max_bytes. Images
+    can be decoded ahead of time on a background thread with prefetch(), so that the trial loop only has to look
+    them up. Images held by a TextureStore are taken from it instead of being decoded, already resized to the size
+    they are drawn at where the store has that size.
+    """
+
+    def __init__(self, window, max_bytes=512 * 1024 ** 2, workers=1, stim_type=None, decoder=decode_image,
+                 textures=None):
+        """
+        :param window: The Psychopy window the ImageStims are drawn to.
+        :param max_bytes: Integer. The most decoded pixel data to hold in memory, in bytes.
+        :param workers: Integer. The number of background threads used to decode prefetched images.
+        :param stim_type: The class of the image stimuli to build; Psychopy's visual.ImageStim if not given.
+        :param decoder: The function that reads and decodes an image from its filepath.
+        :param textures: The TextureStore of pre-resized images to use before decoding, or None.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if stim_type is None:
+            from psychopy.visual import ImageStim as stim_type
+        self.window = window
+        self.stim_type = stim_type
+        self.decoder = decoder
+        self.textures = textures
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._images = OrderedDict()
+        self._stims = {}
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def prefetch(self, paths):
+        """
+        Start decoding images on the background thread if they are not already cached or in flight.
+
+        :param paths: An iterable of image filepaths.
+        :return: None.
+        """
+        for path in paths:
+            if self.textures is not None and self.textures.has(path):
+                continue
+            if path not in self._images and path not in self._pending:
+                self._pending[path] = self._executor.submit(self.decoder, path)
+
+    def image(self, path):
+        """
+        Get the decoded image for a filepath, waiting on a prefetch or decoding it now if need be.
+
+        :param path: String. The filepath of the image.
+        :return: The decoded PIL image.
+        """
+        if path in self._images:
+            self._images.move_to_end(path)
+            return self._images[path]
+        future = self._pending.pop(path, None)
+        if future is not None:
+            im = future.result()
+        else:
+            im = self.textures.image(path) if self.textures is not None else None
+            if im is None:
+                im = self.decoder(path)
+        self._images[path] = im
+        self.n_bytes += _image_bytes(im)
+        self._evict()
+        return im
+
+    def stim(self, path, units='pix', size=None, pos=(0, 0)):
+        """
+        Get a reusable ImageStim for a filepath. The texture is only uploaded the first time a given image is
+        requested at a given size; later requests just move it.
+
+        :param path: String. The filepath of the image.
+        :param units: The Psychopy units for size and pos.
+        :param size: The size to draw the image at, or None for its native size.
+        :param pos: The (x, y) position to draw the image at.
+        :return: An ImageStim.
+        """
+        im = self.image(path)
+        spec = (units, size)
+        variants = self._stims.setdefault(path, {})
+        if spec not in variants:
+            pixel_size = _pixel_size(units, size)
+            if self.textures is not None and pixel_size is not None and self.textures.has(path, pixel_size):
+                im = self.textures.image(path, pixel_size)
+            variants[spec] = self.stim_type(self.window, image=im, units=units, size=size, pos=pos)
+        else:
+            variants[spec].pos = pos
+        return variants[spec]
+
+    def close(self):
+        """
+        Stop the background decoder and drop everything in the cache.
+
+        :return: None.
+        """
+        self._executor.shutdown(wait=False)
+        self._pending.clear()
+        self._images.clear()
+        self._stims.clear()
+        self.n_bytes = 0
+
+    def _evict(self):
+        # always keep the most recent image, even if it alone is over the limit
+        while self.n_bytes > self.max_bytes and len(self._images) > 1:
+            path, im = self._images.popitem(last=False)
+            self._stims.pop(path, None)
+            self.n_bytes -= _image_bytes(im)
+
+
+def _pixel_size(units, size):
+    # the (width, height) a stimulus is drawn at in pixels, when that can be told without asking the window
+    if units != 'pix' or size is None:
+        return None
+    if isinstance(size, (int, float)):
+        size = (size, size)
+    return (int(round(size[0])), int(round(size[1])))
+
+
+def _image_bytes(im):
+    return im.width * im.height * len(im.getbands())
@@ -0,0 +1,113 @@
+"""
+Lay out the study stream of the n-back study task: the studied items in order, with some items shown twice.
+
+Every repeat is given by its start, the position in the finished stream of its first showing, and its lag, how many
+positions later it is shown again. place_repeats picks the starts for a list of lags so that the span of every repeat,
+from its first showing to its second, overlaps no other, which keeps every lag exactly as planned. study_stream then
+yields the stream an item at a time, so a stream of any length is laid out as it is presented, in constant time per
+item and without holding more than the repeats in memory.
+"""
+import random
+
+# column names for the saved stream plan; 'first_occurence' matches the nback file
+stream_plan_fields = ['index', 'image', 'first_occurence', 'is_repeat']
+
+
+def _sections(stream_length, sections):
+    # the (first, end) positions of each of the equal stretches a stream is divided into
+    return [(stream_length * s // sections, stream_length * (s + 1) // sections) for s in range(0, sections)]
+
+
+def _section_lags(lags, sections):
+    # the indices of the lags placed in each stretch: the first len(lags) // sections in the first, and so on
+    n = len(lags)
+    return [list(range(n * s // sections, n * (s + 1) // sections)) for s in range(0, sections)]
+
+
+def min_study_items(lags, sections=1):
+    """
+    :param lags: The lag of every repeat.
+    :param sections: Integer. The number of stretches the repeats are spread over, as for place_repeats.
+    :return: The fewest studied items a stream needs for its repeats to fit.
+    """
+    n_items = max(0, sum([lag + 1 for lag in lags]) - 2 * len(lags))
+    while True:
+        bounds = _sections(n_items + 2 * len(lags), sections)
+        if all([end - first >= sum([lags[i] + 1 for i in indices])
+                for (first, end), indices in zip(bounds, _section_lags(lags, sections))]):
+            return n_items
+        n_items += 1
+
+
+def place_repeats(n_items, lags, rng=random, sections=1):
+    """
+    Pick where the repeats of a study stream go, with no repeat shown inside the span of another.
+
+    The stream, of the studied items and both showings of every repeat, is divided into equal stretches, and the lags
+    are shared out over them in order, the first len(lags) // sections to the first stretch and so on. Within its
+    stretch, every arrangement of the spans and the items between them is equally likely. The time it takes depends
+    on the number of repeats, not on the length of the stream.
+
+    :param n_items: Integer. The number of studied items.
+    :param lags: The lag of every repeat: how many positions after its first showing it is shown again, at least 1.
+    :param rng: The random number generator to draw with; the random module by default.
+    :param sections: Integer. The number of stretches to spread the repeats over.
+    :return: A list of a (start, lag) pair for each lag, in the order of lags.
+    """
+    positions = [None] * len(lags)
+    bounds = _sections(n_items + 2 * len(lags), sections)
+    for (first, end), indices in zip(bounds, _section_lags(lags, sections)):
+        free = (end - first) - sum([lags[i] + 1 for i in indices])
+        if free < 0 or min([lags[i] for i in indices] or [1]) < 1:
+            raise ValueError('a study stream of %d items is too short for repeats at lags %s; it needs at least %d '
+                             'items' % (n_items, ', '.join([str(lag) for lag in lags]),
+                                        min_study_items(lags, sections)))
+        order = list(indices)
+        rng.shuffle(order)
+        # the spans and the free positions between them are laid out by choosing which of free + len(order) places
+        # in a row hold spans
+        cuts = sorted(rng.sample(range(0, free + len(order)), len(order)))
+        position = first
+        previous = -1
+        for i, cut in zip(order, cuts):
+            position += cut - previous - 1
+            positions[i] = (position, lags[i])
+            position += lags[i] + 1
+            previous = cut
+    return positions
+
+
+def study_stream(items, repeated, positions):
+    """
+    Lay out a study stream lazily.
+
+    :param items: An iterable of the studied image filepaths, in order; each is shown once.
+    :param repeated: The list of image filepaths to repeat, one for each position.
+    :param positions: The list of (start, lag) pairs of the repeats, as from place_repeats; no two showings may fall
+                      on the same position.
+    :return: A generator of an (index, image, first_occurence, is_repeat) tuple for every position of the stream, in
+            order, with the columns of stream_plan_fields. first_occurence is the position at which the image was first
+            shown, and is_repeat is 1 on the second showing of a repeat.
+    """
+    showings = {}
+    for image, (start, lag) in zip(repeated, positions):
+        for index, is_repeat in [(start, 0), (start + lag, 1)]:
+            if index in showings:
+                raise ValueError('two repeats are shown at position %d of the study stream' % index)
+            showings[index] = (image, start, is_repeat)
+    items = iter(items)
+    remaining = len(showings)
+    index = 0
+    while True:
+        if index in showings:
+            image, first, is_repeat = showings[index]
+            remaining -= 1
+            yield index, image, first, is_repeat
+        else:
+            image = next(items, None)
+            if image is None:
+                if remaining:
+                    raise ValueError('the study stream ran out of items before position %d' % max(showings.keys()))
+                return
+            yield index, image, index, 0
+        index += 1
@@ -0,0 +1,38 @@
+import pytest
+
+import CBLTM
+from backends import HeadlessBackend, SimulatedObserver
+from pools import StimulusPool
+
+
+@pytest.fixture
+def backend():
+    headless = HeadlessBackend(SimulatedObserver(p_spot_repeat=0., p_false_alarm=0., typed_response='my answer',
+                                                 seed=1))
+    CBLTM.use_backend(headless)
+    yield headless
+    CBLTM.use_backend(CBLTM.PsychopyBackend())
+
+
+def test_keyboard_presses_stay_in_the_event_buffer(backend):
+    keyboard = backend.keyboard.Keyboard()
+    assert [key.name for key in keyboard.getKeys()] == ['space']
+    assert backend.event.getKeys(['space']) == ['space']
+    assert backend.event.getKeys(['space']) == []
+    keyboard.getKeys()
+    backend.event.clearEvents('keyboard')
+    assert backend.event.getKeys(['space']) == []
+
+
+def test_key_dismissing_study_instructions_is_not_a_repeat_response(backend):
+    window = backend.visual.Window([1080, 720])
+    studied = ['Stimuli/study/%02d.jpg' % i for i in range(0, 8)]
+    fillers = StimulusPool(['Stimuli/fillers/%02d.jpg' % i for i in range(0, 4)], rng=None)
+    responses = CBLTM.object_study_task(window, studied, .1, .1, fillers, include_repeats=True,
+                                        repeat_positions=[(1, 2), (5, 3)])
+    assert sorted(responses) == [('miss', 3, 1), ('miss', 8, 5)]
+
+
+def test_key_dismissing_typing_instructions_is_not_typed(backend):
+    window = backend.visual.Window([1080, 720])
+    assert CBLTM.getQualData(window) == 'My answer'
@@ -0,0 +1,41 @@
+import CBLTM
+from backends import HeadlessBackend, SimulatedObserver
+from pools import StimulusPool
+from timing import FrameScheduler, FrameTimer
+
+
+class SlowStimCache(object):
+    # a stimulus cache whose stims take two frames of the virtual clock to build, as a large image can
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def stim(self, path, **kwargs):
+        self.backend.time += 2 * self.backend.frame_dur
+        return self.cache.stim(path, **kwargs)
+
+    def prefetch(self, paths):
+        self.cache.prefetch(paths)
+
+
+def test_building_the_response_array_leaves_the_prechange_array_on_time():
+    backend = HeadlessBackend(SimulatedObserver(seed=3))
+    CBLTM.use_backend(backend)
+    try:
+        window = backend.visual.Window([1080, 720])
+        frame_timer = FrameTimer(window, backend.get_time)
+        stim_cache = CBLTM.make_stim_cache(window)
+        slots, slot_size = CBLTM.array_slots(window.size)
+        pairs = StimulusPool([('A/%d.jpg' % i, 'B/%d.jpg' % i) for i in range(0, 4)])
+        fillers = StimulusPool(['F/%d.jpg' % i for i in range(0, 24)])
+        scheduler = FrameScheduler(window, frame_timer=frame_timer)
+        CBLTM.cd_task('studied', window, backend.event.Mouse(window), slots, slot_size, pairs, fillers, len(slots), 4,
+                      .5, .9, stim_cache=SlowStimCache(backend, stim_cache), scheduler=scheduler)
+        stim_cache.close()
+    finally:
+        CBLTM.use_backend(CBLTM.PsychopyBackend())
+    prechange = [row for row in frame_timer.rows if row[2] == 'prechange']
+    assert len(prechange) == 4
+    # frames, dropped frames and whether the phase was late
+    assert [row[7:] for row in prechange] == [[30, 0, 0]] * 4
@@ -0,0 +1,29 @@
+from CBLTM import array_slots
+from hittest import SlotHitTest
+
+
+def test_every_slot_is_hit_up_to_its_edges():
+    slots, slot_size = array_slots((1080, 720))
+    hit_test = SlotHitTest(slots, slot_size)
+    # just inside the edges, which are only hit up to rounding
+    half = .999 * slot_size / 2.
+    for number, (x, y) in enumerate(slots, 1):
+        for dx, dy in [(0, 0), (half, half), (-half, half), (half, -half), (-half, -half)]:
+            assert hit_test.slot_at((x + dx, y + dy)) == number
+
+
+def test_positions_outside_every_slot_miss():
+    slots, slot_size = array_slots((1080, 720))
+    hit_test = SlotHitTest(slots, slot_size)
+    assert hit_test.slot_at((0, 0)) is None
+    assert hit_test.slot_at((540, 360)) is None
+    x, y = slots[0]
+    assert hit_test.slot_at((x, y + slot_size / 2. + 1)) is None
+
+
+def test_fewer_slots_than_the_hexagon():
+    slots, slot_size = array_slots((1080, 720), items_per_array=3)
+    hit_test = SlotHitTest(slots, slot_size)
+    full_slots, _ = array_slots((1080, 720))
+    assert hit_test.slot_at(full_slots[2]) == 3
+    assert hit_test.slot_at(full_slots[3]) is None
@@ -0,0 +1,78 @@
+import json, os
+from multiprocessing import Pool
+
+import pytest
+from PIL import Image
+
+from manifest import build_manifest, check_pairs, load_manifest, manifest_paths
+
+
+def make_images(directory, names):
+    os.makedirs(directory)
+    for name in names:
+        Image.new('RGB', (4, 4)).save(os.path.join(directory, name))
+
+
+def test_pairs_names_padded_differently(tmp_path):
+    make_images(str(tmp_path / 'A'), ['46.jpg', '187.jpg', '5.jpg'])
+    make_images(str(tmp_path / 'B'), ['0187.jpg', '046.jpg', '0005.jpg'])
+    manifest = build_manifest({'A': str(tmp_path / 'A'), 'B': str(tmp_path / 'B')})
+    check_pairs(manifest, 'A', 'B')
+    paths = manifest_paths(manifest)
+    assert [os.path.basename(path) for path in paths['A']] == ['5.jpg', '46.jpg', '187.jpg']
+    assert [os.path.basename(path) for path in paths['B']] == ['0005.jpg', '046.jpg', '0187.jpg']
+
+
+def test_unpaired_images_are_found(tmp_path):
+    make_images(str(tmp_path / 'A'), ['1.jpg', '2.jpg'])
+    make_images(str(tmp_path / 'B'), ['01.jpg', '03.jpg'])
+    manifest = build_manifest({'A': str(tmp_path / 'A'), 'B': str(tmp_path / 'B')})
+    with pytest.raises(ValueError):
+        check_pairs(manifest, 'A', 'B')
+
+
+def test_sets_of_different_sizes_are_found(tmp_path):
+    make_images(str(tmp_path / 'A'), ['1.jpg', '2.jpg'])
+    make_images(str(tmp_path / 'B'), ['1.jpg'])
+    manifest = build_manifest({'A': str(tmp_path / 'A'), 'B': str(tmp_path / 'B')})
+    with pytest.raises(ValueError):
+        check_pairs(manifest, 'A', 'B')
+
+
+def test_unreadable_image_is_found(tmp_path):
+    make_images(str(tmp_path / 'A'), ['1.jpg'])
+    with open(str(tmp_path / 'A' / '2.jpg'), 'w') as broken:
+        broken.write('not an image')
+    with pytest.raises(ValueError):
+        build_manifest({'A': str(tmp_path / 'A')})
+
+
+def test_load_rebuilds_only_changed_files(tmp_path):
+    make_images(str(tmp_path / 'A'), ['1.jpg', '2.jpg'])
+    path = str(tmp_path / 'manifest.json')
+    sets = {'A': str(tmp_path / 'A')}
+    first = load_manifest(path, sets)
+    with open(path) as saved:
+        assert json.load(saved) == first
+    Image.new('RGB', (4, 4)).save(str(tmp_path / 'A' / '3.jpg'))
+    second = load_manifest(path, sets)
+    assert [entry['name'] for entry in second['sets']['A']['files']] == ['1.jpg', '2.jpg', '3.jpg']
+    assert second['sets']['A']['files'][:2] == first['sets']['A']['files']
+
+
+def _load(args):
+    return load_manifest(*args)
+
+
+def test_concurrent_loads_save_one_manifest(tmp_path):
+    make_images(str(tmp_path / 'A'), ['%d.jpg' % i for i in range(0, 20)])
+    path = str(tmp_path / 'manifest.json')
+    pool = Pool(4)
+    try:
+        manifests = pool.map(_load, [(path, {'A': str(tmp_path / 'A')})] * 8)
+    finally:
+        pool.close()
+        pool.join()
+    with open(path) as saved:
+        assert json.load(saved) == manifests[0]
+    assert sorted(os.listdir(str(tmp_path))) == ['A', 'manifest.json']
@@ -0,0 +1,94 @@
+import numpy
+import pytest
+
+from planner import (balance, check_plan, load_plans, plan_sessions, plan_version, repeat_lags, repeat_sections,
+                     save_plans, session_plan)
+
+subjects = ['%02d' % i for i in range(1, 13)]
+
+
+@pytest.fixture(scope='module')
+def plans():
+    return plan_sessions(1, subjects, 60, 200, trials_per_task=6, seed=3)
+
+
+def test_pairs_of_subjects_see_each_exemplar_as_a_and_b(plans):
+    exemplars, sets = plans['exemplars'], plans['exemplar_sets']
+    for first in range(0, len(subjects), 2):
+        assert exemplars[first].tolist() == exemplars[first + 1].tolist()
+        assert (sets[first] != sets[first + 1]).all()
+    assert (sets.sum(axis=1) == sets.shape[1] // 2).all()
+
+
+def test_each_subject_draws_distinct_stimuli(plans):
+    for row in range(0, len(subjects)):
+        assert len(set(plans['exemplars'][row].tolist())) == plans['exemplars'].shape[1]
+        assert len(set(plans['fillers'][row].tolist())) == plans['fillers'].shape[1]
+        assert sorted(plans['studied_order'][row].tolist()) == list(range(0, 18))
+
+
+def test_every_trial_takes_every_test_slot_over_a_group(plans):
+    slots = plans['test_slots'].reshape(len(subjects), -1)
+    for first in range(0, len(subjects), 6):
+        for trial in range(0, slots.shape[1]):
+            assert sorted(slots[first:first + 6, trial].tolist()) == [1, 2, 3, 4, 5, 6]
+    for row in slots:
+        assert numpy.bincount(row, minlength=7)[1:].tolist() == [3] * 6
+
+
+def test_pairs_of_subjects_see_the_studied_image_on_opposite_sides(plans):
+    sides = plans['test_sides'].reshape(len(subjects), -1)
+    assert (sides[0::2] != sides[1::2]).all()
+
+
+def test_balanced_cohort_has_no_spread(plans):
+    assert balance(plans) == {'exemplar_sets': 0, 'test_slots': 0, 'test_sides': 0, 'repeat_lags': 0}
+
+
+def test_repeats_take_every_lag_and_never_overlap():
+    plans = plan_sessions(4, subjects, 400, 2000, trials_per_task=80, seed=5)
+    n_stream = 240 + 2 * len(repeat_lags) * repeat_sections
+    lags = plans['repeat_lags'][:, 0, :]
+    for row in range(0, len(subjects)):
+        halves = numpy.split(lags[row], repeat_sections)
+        assert all([sorted(half.tolist()) == sorted(repeat_lags) for half in halves])
+        spans = sorted(zip(plans['repeat_starts'][row, 0].tolist(), lags[row].tolist()))
+        for (start, lag), (next_start, next_lag) in zip(spans, spans[1:]):
+            assert start + lag < next_start
+        assert spans[0][0] >= 0 and spans[-1][0] + spans[-1][1] < n_stream
+    for first in range(0, len(subjects), len(repeat_lags)):
+        for repeat in range(0, lags.shape[1]):
+            assert sorted(lags[first:first + len(repeat_lags), repeat].tolist()) == sorted(repeat_lags)
+
+
+def test_short_study_stream_for_repeats_raises():
+    with pytest.raises(ValueError):
+        plan_sessions(4, subjects, 400, 2000, trials_per_task=1)
+
+
+def test_same_seed_plans_the_same_sessions():
+    first = plan_sessions(4, subjects, 400, 2000, trials_per_task=80, seed=8)
+    second = plan_sessions(4, subjects, 400, 2000, trials_per_task=80, seed=8)
+    assert sorted(first.keys()) == sorted(second.keys())
+    for name in first:
+        assert first[name].tolist() == second[name].tolist()
+
+
+def test_saved_plans_load_as_the_same_session_plans(plans, tmp_path):
+    path = str(tmp_path / 'plans.npz')
+    save_plans(path, plans)
+    loaded = load_plans(path)
+    assert session_plan(loaded, '05') == session_plan(plans, '05')
+    plan = session_plan(loaded, '05')
+    check_plan(plan, 1, 60, 200, 6, 6)
+    with pytest.raises(ValueError):
+        check_plan(plan, 1, 60, 200, 1, 6)
+    with pytest.raises(ValueError):
+        session_plan(loaded, '99')
+
+
+def test_plans_of_another_version_are_refused(plans, tmp_path):
+    path = str(tmp_path / 'plans.npz')
+    save_plans(path, dict(plans, version=numpy.array(plan_version - 1)))
+    with pytest.raises(ValueError):
+        load_plans(path)
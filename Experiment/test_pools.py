@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+from pools import StimulusPool
+
+
+def test_draws_every_item_once():
+    pool = StimulusPool(range(0, 100), rng=random.Random(3))
+    drawn = pool.draw_many(60) + [pool.draw() for i in range(0, 40)]
+    assert sorted(drawn) == list(range(0, 100))
+    assert len(pool) == 0
+
+
+def test_planned_pool_draws_in_order():
+    pool = StimulusPool(['a', 'b', 'c', 'd'], rng=None)
+    assert pool.draw() == 'a'
+    assert pool.draw_many(3) == ['b', 'c', 'd']
+
+
+def test_pool_keeps_its_own_copy():
+    items = [('a', 'A'), ('b', 'B')]
+    pool = StimulusPool(items, rng=None)
+    pool.draw()
+    assert items == [('a', 'A'), ('b', 'B')]
+
+
+def test_same_seed_draws_the_same_items():
+    first = StimulusPool(range(0, 50), rng=random.Random(7)).draw_many(20)
+    second = StimulusPool(range(0, 50), rng=random.Random(7)).draw_many(20)
+    assert first == second
+
+
+def test_draw_from_empty_pool_raises():
+    pool = StimulusPool(['a'])
+    pool.draw()
+    with pytest.raises(IndexError):
+        pool.draw()
+
+
+def test_draw_many_beyond_pool_raises_without_drawing():
+    pool = StimulusPool(['a', 'b'])
+    with pytest.raises(IndexError):
+        pool.draw_many(3)
+    assert len(pool) == 2
@@ -0,0 +1,63 @@
+import csv
+
+import numpy
+import pytest
+
+from records import TrialRecord, experiment_fields, field_columns, trial_fields, write_columns, write_rows
+
+
+def make_trial(**fields):
+    values = {'trial_type': 'studied', 'correct': 1, 'raw_response': 3, 'test_image': 'A/1.jpg',
+              'bait_image': 'B/0001.jpg', 'timestamp': 12.5, 'response_image': 'A/1.jpg', 'rt': .75, 'test_slot': 3}
+    values.update(fields)
+    return TrialRecord(fillers=['F/1.jpg', 'F/2.jpg', 'F/3.jpg', 'F/4.jpg', 'F/5.jpg'], **values)
+
+
+def test_record_fields_by_name_and_position():
+    trial = make_trial()
+    assert len(trial) == len(trial_fields)
+    assert trial.test_image == trial[trial_fields.index('test_image')] == 'A/1.jpg'
+    assert trial.filler5 == 'F/5.jpg'
+    assert trial.lr_response == ''
+    trial.lr_response = 'hit'
+    assert trial[trial_fields.index('lr_response')] == 'hit'
+
+
+def test_unknown_field_raises():
+    with pytest.raises(TypeError):
+        TrialRecord(colour='red')
+
+
+def test_rows_are_written_in_the_experiment_columns(tmp_path):
+    path = str(tmp_path / 'trials.csv')
+    names = experiment_fields[4]
+    trials = [make_trial(), make_trial(trial_type='flipped', lr_response='miss', lr_rt=1.5)]
+    write_rows(path, names, iter(trials), field_columns(names))
+    with open(path, newline='') as data_file:
+        rows = list(csv.reader(data_file))
+    assert rows[0] == names
+    assert rows[1] == [str(getattr(trials[0], name)) for name in names]
+    assert rows[2][names.index('lr_response')] == 'miss'
+
+
+def test_rows_without_columns_take_the_first_fields(tmp_path):
+    path = str(tmp_path / 'nback.csv')
+    write_rows(path, ['response', 'index'], [('hit', 10, 0), ('miss', 40, 30)])
+    with open(path, newline='') as data_file:
+        assert list(csv.reader(data_file)) == [['response', 'index'], ['hit', '10'], ['miss', '40']]
+
+
+def test_columns_keep_their_types_and_mark_empty_values(tmp_path):
+    path = str(tmp_path / 'trials.npz')
+    names = experiment_fields[4]
+    trials = [make_trial(), make_trial(rt='', test_slot='', correct=0, lr_response='f_a', lr_rt=.5)]
+    write_columns(path, names, trials, field_columns(names))
+    with numpy.load(path) as columns:
+        assert sorted(columns.keys()) == sorted(names)
+        assert columns['correct'].dtype == numpy.int8
+        assert columns['correct'].tolist() == [1, 0]
+        assert columns['test_slot'].tolist() == [3, -1]
+        assert columns['rt'][0] == .75 and numpy.isnan(columns['rt'][1])
+        assert numpy.isnan(columns['lr_rt'][0]) and columns['lr_rt'][1] == .5
+        assert columns['lr_response'].tolist() == ['', 'f_a']
+        assert columns['raw_response'].tolist() == ['3', '3']
@@ -0,0 +1,139 @@
+import csv, os
+
+import pytest
+from PIL import Image
+
+from CBLTM import array_slots
+from render_trials import (label_height, placeholder_colour, render_archive, test_colour, trial_layout, window_size,
+                           wrong_colour)
+
+colours = {'exemplarA/1.png': (250, 0, 0), 'exemplarB/1.png': (0, 0, 250)}
+colours.update([('OBJECTSALL/%d.png' % i, (0, 40 * i, 0)) for i in range(1, 7)])
+fillers = ['OBJECTSALL/%d.png' % i for i in range(1, 7)]
+
+
+def legacy_row(**fields):
+    # a row as older sessions logged it: paths relative to the stimuli directory, no test slot and five fillers
+    row = {'trial_type': 'studied', 'correct': '1', 'raw_response': '3', 'test_image': 'exemplarA/1.png',
+           'bait_image': 'exemplarB/1.png'}
+    row.update([('filler%d' % i, fillers[i - 1]) for i in range(1, 6)])
+    row.update(fields)
+    return row
+
+
+def slot_row(**fields):
+    row = {'trial_type': 'studied', 'correct': '0', 'raw_response': '2', 'test_image': 'Stimuli/exemplarA/1.png',
+           'bait_image': 'Stimuli/exemplarB/1.png', 'test_slot': '6'}
+    row.update([('filler%d' % i, 'Stimuli/' + fillers[i - 1]) for i in range(1, 7)])
+    row.update(fields)
+    return row
+
+
+def test_legacy_rows_place_the_test_image_where_it_was_clicked():
+    test_slot, prechange, postchange = trial_layout(legacy_row())
+    assert test_slot == 3
+    assert postchange == {1: fillers[0], 2: fillers[1], 3: 'exemplarA/1.png', 4: fillers[3], 5: fillers[4], 6: None}
+    postchange[3] = 'exemplarB/1.png'
+    assert prechange == postchange
+
+
+def test_wrong_legacy_rows_mark_no_test_slot():
+    test_slot, prechange, postchange = trial_layout(legacy_row(correct='0', raw_response='5'))
+    assert test_slot is None
+    assert postchange == {1: fillers[0], 2: fillers[1], 3: fillers[2], 4: fillers[3], 5: fillers[4], 6: None}
+    assert prechange == postchange
+
+
+def test_rows_with_a_test_slot_show_every_filler_in_its_slot():
+    test_slot, prechange, postchange = trial_layout(slot_row())
+    assert test_slot == 6
+    assert [postchange[slot] for slot in range(1, 7)] == ['Stimuli/' + filler for filler in fillers[:5]] + \
+        ['Stimuli/exemplarA/1.png']
+    assert prechange[6] == 'Stimuli/exemplarB/1.png'
+    # the filler drawn for the test slot was never shown
+    assert 'Stimuli/' + fillers[5] not in postchange.values()
+    assert trial_layout(slot_row(test_slot='2', raw_response='4', filler6=''))[2][6] is None
+
+
+@pytest.mark.parametrize('row', [legacy_row(trial_type='6afc'), slot_row(trial_type='6afc')])
+def test_6afc_rows_have_no_prechange_array(row):
+    test_slot, prechange, postchange = trial_layout(row)
+    assert prechange is None and postchange[test_slot] == row['test_image']
+
+
+def test_test_slot_missing_from_binary_columns_is_unknown():
+    assert trial_layout(slot_row(test_slot='-1'))[0] is None
+
+
+def write_trials(path, rows):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    stimuli_dir = tmp_path / 'Stimuli'
+    for path, colour in colours.items():
+        if not os.path.isdir(str((stimuli_dir / path).parent)):
+            os.makedirs(str((stimuli_dir / path).parent))
+        Image.new('RGB', (20, 20), colour).save(str(stimuli_dir / path))
+    data_dir = tmp_path / 'Experiments' / 'ex1'
+    os.makedirs(str(data_dir))
+    write_trials(str(data_dir / 'legacy.csv'), [legacy_row()])
+    write_trials(str(data_dir / 'slots.csv'), [slot_row(), slot_row(trial_type='6afc', correct='1', raw_response='6')])
+    return tmp_path
+
+
+def slot_pixel(slot, scale):
+    slots, slot_size = array_slots(window_size)
+    x, y = slots[slot - 1]
+    return int(window_size[0] * scale / 2. + x * scale), int(window_size[1] * scale / 2. - y * scale)
+
+
+def test_contact_sheets_show_both_row_formats(archive):
+    scale = .25
+    results = render_archive(str(archive / 'Experiments'), str(archive / 'sheets'), str(archive / 'Stimuli'),
+                             scale=scale, columns=2, processes=1)
+    assert sorted([(os.path.basename(path), trials) for path, trials in results]) == [('legacy.csv', 1),
+                                                                                     ('slots.csv', 2)]
+    width, height = int(window_size[0] * scale), int(window_size[1] * scale)
+    with Image.open(str(archive / 'sheets' / 'ex1' / 'slots.png')) as sheet:
+        sheet = sheet.convert('RGB')
+    assert sheet.size == (2 * (2 * width + 4 + 8), height + label_height + 8)
+    post_left = width + 4
+    x, y = slot_pixel(6, scale)
+    assert sheet.getpixel((x, y)) == colours['exemplarB/1.png']
+    assert sheet.getpixel((post_left + x, y)) == colours['exemplarA/1.png']
+    x, y = slot_pixel(1, scale)
+    assert sheet.getpixel((post_left + x, y)) == colours[fillers[0]]
+    # the test slot is outlined in green and the wrong click in red
+    slots, slot_size = array_slots(window_size)
+    size = int(round(slot_size * scale))
+    for slot, colour in [(6, test_colour), (2, wrong_colour)]:
+        x, y = slot_pixel(slot, scale)
+        assert sheet.getpixel((post_left + x, y - size // 2 - 2)) == colour
+    # the 6AFC trial has no pre-change array, so its first panel is blank
+    second = 2 * width + 4 + 8
+    assert sheet.getpixel((second + 2, 2)) == placeholder_colour
+    with Image.open(str(archive / 'sheets' / 'ex1' / 'legacy.png')) as sheet:
+        sheet = sheet.convert('RGB')
+    x, y = slot_pixel(3, scale)
+    assert sheet.getpixel((x, y)) == colours['exemplarB/1.png']
+    assert sheet.getpixel((post_left + x, y)) == colours['exemplarA/1.png']
+    # the sixth filler of older sessions was never logged
+    x, y = slot_pixel(6, scale)
+    assert sheet.getpixel((post_left + x, y)) == placeholder_colour
+
+
+def test_per_trial_images(archive):
+    results = render_archive(str(archive / 'Experiments'), str(archive / 'trials'), str(archive / 'Stimuli'),
+                             per_trial=True, processes=1)
+    assert sum([trials for path, trials in results]) == 3
+    assert sorted(os.listdir(str(archive / 'trials' / 'ex1' / 'slots'))) == ['001_postchange.png',
+                                                                           '001_prechange.png',
+                                                                           '002_postchange.png']
+    with Image.open(str(archive / 'trials' / 'ex1' / 'legacy' / '001_postchange.png')) as image:
+        assert image.size == window_size
+        assert image.convert('RGB').getpixel(slot_pixel(3, 1.)) == colours['exemplarA/1.png']
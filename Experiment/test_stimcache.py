@@ -0,0 +1,79 @@
+from PIL import Image
+
+from stimcache import StimulusCache
+
+
+class FakeStim(object):
+
+    def __init__(self, window, image, units, size, pos):
+        self.image = image
+        self.units = units
+        self.size = size
+        self.pos = pos
+
+
+class CountingDecoder(object):
+
+    def __init__(self, side=10):
+        self.side = side
+        self.decoded = []
+
+    def __call__(self, path):
+        self.decoded.append(path)
+        return Image.new('RGB', (self.side, self.side))
+
+
+def make_cache(decoder, max_bytes=10 ** 6):
+    return StimulusCache(None, max_bytes=max_bytes, stim_type=FakeStim, decoder=decoder)
+
+
+def test_each_image_is_decoded_once():
+    decoder = CountingDecoder()
+    cache = make_cache(decoder)
+    first = cache.image('a.jpg')
+    assert cache.image('a.jpg') is first
+    assert decoder.decoded == ['a.jpg']
+    cache.close()
+
+
+def test_prefetched_image_is_not_decoded_again():
+    decoder = CountingDecoder()
+    cache = make_cache(decoder)
+    cache.prefetch(['a.jpg', 'b.jpg', 'a.jpg'])
+    cache.image('a.jpg')
+    cache.image('b.jpg')
+    assert sorted(decoder.decoded) == ['a.jpg', 'b.jpg']
+    cache.close()
+
+
+def test_least_recently_used_image_is_evicted():
+    decoder = CountingDecoder(side=10)
+    # room for two 10x10 RGB images
+    cache = make_cache(decoder, max_bytes=2 * 300)
+    cache.image('a.jpg')
+    cache.image('b.jpg')
+    cache.image('a.jpg')
+    cache.image('c.jpg')
+    assert cache.n_bytes == 600
+    cache.image('a.jpg')
+    cache.image('b.jpg')
+    assert decoder.decoded == ['a.jpg', 'b.jpg', 'c.jpg', 'b.jpg']
+    cache.close()
+
+
+def test_image_over_the_limit_is_still_kept():
+    decoder = CountingDecoder(side=100)
+    cache = make_cache(decoder, max_bytes=10)
+    cache.image('a.jpg')
+    cache.image('a.jpg')
+    assert decoder.decoded == ['a.jpg']
+    cache.close()
+
+
+def test_stims_are_reused_and_moved():
+    cache = make_cache(CountingDecoder())
+    stim = cache.stim('a.jpg', size=(5, 5), pos=(0, 0))
+    assert cache.stim('a.jpg', size=(5, 5), pos=(3, 4)) is stim
+    assert stim.pos == (3, 4)
+    assert cache.stim('a.jpg', size=(6, 6)) is not stim
+    cache.close()
@@ -0,0 +1,103 @@
+import csv, random
+
+import pytest
+
+import CBLTM
+from backends import HeadlessBackend, SimulatedObserver
+from pools import StimulusPool
+from streams import min_study_items, place_repeats, study_stream
+
+
+def test_repeats_point_back_to_their_first_showing():
+    rows = list(study_stream(['a', 'b', 'c', 'd'], ['r', 's'], [(1, 2), (4, 3)]))
+    assert [row[1] for row in rows] == ['a', 'r', 'b', 'r', 's', 'c', 'd', 's']
+    assert [row[0] for row in rows] == list(range(0, 8))
+    assert [(row[2], row[3]) for row in rows] == [(0, 0), (1, 0), (2, 0), (1, 1), (4, 0), (5, 0), (6, 0), (4, 1)]
+
+
+def test_stream_without_repeats_is_the_items():
+    assert list(study_stream(iter(['a', 'b']), [], [])) == [(0, 'a', 0, 0), (1, 'b', 1, 0)]
+
+
+def test_colliding_showings_raise():
+    with pytest.raises(ValueError):
+        list(study_stream(['a', 'b', 'c'], ['r', 's'], [(0, 2), (2, 1)]))
+
+
+def test_stream_that_runs_out_of_items_raises():
+    with pytest.raises(ValueError):
+        list(study_stream(['a'], ['r'], [(1, 5)]))
+
+
+def assert_no_overlap(positions, stream_length):
+    spans = sorted(positions)
+    for (start, lag), (next_start, next_lag) in zip(spans, spans[1:]):
+        assert start + lag < next_start
+    assert spans[0][0] >= 0 and spans[-1][0] + spans[-1][1] < stream_length
+
+
+@pytest.mark.parametrize('n_items, lags, sections', [
+    (194, [10, 30, 60, 10, 30, 60], 2),
+    (20000, list(range(1, 100)) * 2, 4),
+    (3, [1], 1),
+])
+def test_repeats_keep_their_lags_and_never_overlap(n_items, lags, sections):
+    rng = random.Random(11)
+    for attempt in range(0, 20):
+        positions = place_repeats(n_items, lags, rng, sections)
+        assert [lag for start, lag in positions] == lags
+        stream_length = n_items + 2 * len(lags)
+        assert_no_overlap(positions, stream_length)
+        # the repeats of each stretch stay in it
+        for s, (first, end) in enumerate([(stream_length * s // sections, stream_length * (s + 1) // sections)
+                                          for s in range(0, sections)]):
+            for start, lag in positions[len(lags) * s // sections:len(lags) * (s + 1) // sections]:
+                assert first <= start and start + lag < end
+        rows = list(study_stream(['item%d' % i for i in range(0, n_items)], ['r%d' % i for i in range(len(lags))],
+                                 positions))
+        assert len(rows) == stream_length
+        for i, (start, lag) in enumerate(positions):
+            assert rows[start][1:] == ('r%d' % i, start, 0)
+            assert rows[start + lag][1:] == ('r%d' % i, start, 1)
+        assert [row[1] for row in rows if row[1].startswith('item')] == ['item%d' % i for i in range(0, n_items)]
+
+
+def test_every_placement_can_be_drawn():
+    # two repeats of lag 1 and two items: the spans take two of four places, 6 ways, in either order
+    rng = random.Random(2)
+    seen = set([tuple(place_repeats(2, [1, 1], rng)) for attempt in range(0, 500)])
+    assert len(seen) == 12
+
+
+def test_fewest_items_fit_and_one_fewer_does_not():
+    lags = [10, 30, 60] * 2
+    n_items = min_study_items(lags, 2)
+    assert n_items == 194
+    place_repeats(n_items, lags, random.Random(0), 2)
+    with pytest.raises(ValueError):
+        place_repeats(n_items - 1, lags, random.Random(0), 2)
+
+
+def test_lags_below_one_raise():
+    with pytest.raises(ValueError):
+        place_repeats(100, [0], random.Random(0))
+
+
+def test_study_task_shows_the_planned_stream(tmp_path):
+    backend = HeadlessBackend(SimulatedObserver(p_spot_repeat=1., p_false_alarm=0., seed=4))
+    CBLTM.use_backend(backend)
+    try:
+        studied = ['Stimuli/study/%03d.jpg' % i for i in range(0, 30)]
+        fillers = StimulusPool(['Stimuli/fillers/%d.jpg' % i for i in range(0, 4)], rng=None)
+        plan_file = str(tmp_path / 'stream.csv')
+        responses = CBLTM.object_study_task(backend.visual.Window([1080, 720]), studied, .1, .1, fillers,
+                                            include_repeats=True, plan_file=plan_file, lags=[3, 7, 5, 2])
+    finally:
+        CBLTM.use_backend(CBLTM.PsychopyBackend())
+    with open(plan_file) as stream_file:
+        rows = list(csv.DictReader(stream_file))
+    assert len(rows) == 38
+    repeats = [(int(row['index']), int(row['first_occurence'])) for row in rows if row['is_repeat'] == '1']
+    assert sorted([index - first for index, first in repeats]) == [2, 3, 5, 7]
+    assert sorted([(kind, index, first) for kind, index, first in responses]) == \
+        sorted([('hit', index, first) for index, first in repeats])
@@ -0,0 +1,60 @@
+from textscreens import InstructionScreens, TypedText
+
+
+class FakeTextStim(object):
+
+    def __init__(self, window, text=''):
+        self.window = window
+        self.text = text
+        self.set = 0
+
+    def setText(self, text):
+        self.text = text
+        self.set += 1
+
+
+def test_each_message_is_laid_out_once():
+    screens = InstructionScreens(FakeTextStim)
+    window = object()
+    first = screens.screen(window, 'Take a break.')
+    other = screens.screen(window, 'Press any key.')
+    assert screens.screen(window, 'Take a break.') is first
+    assert screens.screen(window, 'Press any key.') is other
+    assert first.text == 'Take a break.' and first.window is window
+    assert screens.built == 2
+
+
+def test_screens_of_a_new_window_are_made_for_it():
+    screens = InstructionScreens(FakeTextStim)
+    old, new = object(), object()
+    stale = screens.screen(old, 'Take a break.')
+    fresh = screens.screen(new, 'Take a break.')
+    assert fresh is not stale and fresh.window is new
+    assert screens.screen(new, 'Take a break.') is fresh
+    assert screens.built == 2
+
+
+def test_typed_text_is_only_set_when_a_key_changed_it():
+    stim = FakeTextStim(None)
+    typed = TypedText(stim)
+    assert not typed.update()
+    for key in ['h', 'i', 'space', 'lshift', 't', 'h', 'e', 'r', 'e', 'period']:
+        typed.press(key)
+    assert typed.update()
+    assert stim.text == 'Hi There.' and stim.set == 1
+    # keys that type nothing leave the stimulus alone
+    for key in ['lshift', 'return', 'f1']:
+        typed.press(key)
+    assert not typed.update()
+    assert stim.set == 1
+    typed.press('backspace')
+    assert typed.update() and not typed.update()
+    assert stim.text == 'Hi There' and stim.set == 2
+
+
+def test_backspace_on_nothing_changes_nothing():
+    stim = FakeTextStim(None)
+    typed = TypedText(stim)
+    typed.press('backspace')
+    assert not typed.update()
+    assert stim.set == 0
@@ -0,0 +1,92 @@
+import pytest
+from PIL import Image
+
+from CBLTM import manifest_file, stimulus_sets
+from manifest import build_manifest, load_manifest, manifest_paths
+from stimcache import StimulusCache
+from texturestore import TextureStore, build_texture_store, texture_store_file
+
+sizes = [(4, 4), (6, 3)]
+
+
+class FakeStim(object):
+
+    def __init__(self, window, image, units, size, pos):
+        self.image = image
+        self.size = size
+        self.pos = pos
+
+
+def failing_decoder(path):
+    raise AssertionError('%s was decoded instead of taken from the store' % path)
+
+
+@pytest.fixture
+def store(stimulus_library):
+    manifest = load_manifest(manifest_file, stimulus_sets)
+    path = texture_store_file((1080, 720))
+    build_texture_store(path, manifest, sizes)
+    return path, manifest
+
+
+def test_store_reads_back_every_image_at_every_size(store):
+    path, manifest = store
+    textures = TextureStore(path, manifest)
+    for image_path in sum(manifest_paths(manifest).values(), []):
+        original = Image.open(image_path).convert('RGBA')
+        assert textures.has(image_path)
+        assert textures.image(image_path).tobytes() == original.tobytes()
+        for size in sizes:
+            assert textures.has(image_path, size)
+            assert textures.image(image_path, size).tobytes() == original.resize(size, Image.LANCZOS).tobytes()
+        assert not textures.has(image_path, (5, 5))
+        assert textures.image(image_path, (5, 5)) is None
+    assert textures.image('Stimuli/OBJECTSALL/missing.jpg') is None
+
+
+def test_cache_takes_resized_images_from_the_store(store):
+    path, manifest = store
+    image_path = manifest_paths(manifest)['fillers'][3]
+    cache = StimulusCache(None, stim_type=FakeStim, decoder=failing_decoder, textures=TextureStore(path, manifest))
+    cache.prefetch([image_path])
+    stim = cache.stim(image_path, units='pix', size=(6, 3), pos=(10, 0))
+    assert stim.image.size == (6, 3) and stim.size == (6, 3)
+    # a size the store does not hold is drawn from the stored native image
+    assert cache.stim(image_path, units='pix', size=(5, 5)).image.size == (8, 8)
+    cache.close()
+
+
+def test_images_changed_since_the_store_was_built_are_decoded(store):
+    path, manifest = store
+    changed = manifest_paths(manifest)['exemplarset0'][2]
+    Image.new('RGB', (8, 8), (255, 0, 0)).save(changed)
+    current = build_manifest(stimulus_sets)
+    textures = TextureStore(path, current)
+    assert not textures.has(changed) and not textures.has(changed, (4, 4))
+    assert textures.has(manifest_paths(manifest)['exemplarset0'][3])
+    decoded = []
+
+    def decoder(image_path):
+        decoded.append(image_path)
+        return Image.open(image_path).convert('RGBA')
+
+    cache = StimulusCache(None, stim_type=FakeStim, decoder=decoder, textures=textures)
+    red, green, blue, alpha = cache.stim(changed, units='pix', size=(4, 4)).image.getpixel((0, 0))
+    assert red > 200 and green < 50
+    assert decoded == [changed]
+    cache.close()
+
+
+def test_other_files_and_versions_are_refused(store, tmp_path):
+    path, manifest = store
+    other = str(tmp_path / 'other.rgba')
+    with open(other, 'wb') as other_file:
+        other_file.write(b'not a texture store')
+    with pytest.raises(ValueError):
+        TextureStore(other)
+    with open(path, 'rb') as store_file:
+        data = store_file.read()
+    with open(other, 'wb') as other_file:
+        other_file.write(data.replace(b'"version":1', b'"version":9', 1))
+    with pytest.raises(ValueError):
+        TextureStore(other)
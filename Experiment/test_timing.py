@@ -0,0 +1,153 @@
+import pytest
+
+from timing import FrameScheduler, FrameTimer
+
+
+class FakeStim(object):
+
+    def __init__(self):
+        self.draws = 0
+
+    def draw(self):
+        self.draws += 1
+
+
+class FakeWindow(object):
+    # a window whose flips happen at the given times, in frames of frame_dur seconds
+
+    def __init__(self, frames, frame_dur=.01, stamped=True):
+        self.times = [frame * frame_dur for frame in frames]
+        self.stamped = stamped
+        self.flips = 0
+
+    def flip(self):
+        self.flips += 1
+        t = self.times.pop(0)
+        self.now = t
+        return t if self.stamped else None
+
+
+def test_phase_lasts_from_its_flip_to_the_next_labelled_one():
+    window = FakeWindow([0, 50, 80])
+    timer = FrameTimer(window, None, frame_dur=.01)
+    timer.block, timer.trial = 'study', 3
+    timer.flip('prechange', .5)
+    timer.flip('isi', .3)
+    timer.flip('')
+    assert timer.rows == [['study', 3, 'prechange', .5, 0., .5, .5, 50, 0, 0],
+                          ['study', 3, 'isi', .3, .5, .8, pytest.approx(.3), 30, 0, 0]]
+
+
+def test_flips_outside_a_phase_are_not_recorded():
+    timer = FrameTimer(FakeWindow([0, 1, 2, 10]), None, frame_dur=.01)
+    timer.flip()
+    timer.flip('')
+    timer.flip('fixation', .08)
+    timer.flip()
+    assert timer.rows == []
+
+
+def test_missed_frames_between_flips_are_dropped():
+    # frames 3 and 4 and frame 7 were missed
+    timer = FrameTimer(FakeWindow([0, 1, 2, 5, 6, 8]), None, frame_dur=.01)
+    timer.flip('study', .08)
+    for flip in range(0, 4):
+        timer.flip()
+    timer.flip('')
+    frames, dropped, late = timer.rows[0][7:]
+    assert (frames, dropped, late) == (8, 3, 0)
+
+
+def test_phase_flipped_only_at_its_onset_drops_nothing():
+    timer = FrameTimer(FakeWindow([0, 30]), None, frame_dur=.01)
+    timer.flip('isi', .3)
+    timer.flip('')
+    assert timer.rows[0][7:] == [30, 0, 0]
+
+
+@pytest.mark.parametrize('end, late', [(30, 0), (30.4, 0), (30.6, 1), (29.4, 1), (None, 0)])
+def test_phases_missing_their_duration_by_over_half_a_frame_are_late(end, late):
+    timer = FrameTimer(FakeWindow([0, 30 if end is None else end]), None, frame_dur=.01)
+    timer.flip('prechange', None if end is None else .3)
+    timer.flip('')
+    assert timer.rows[0][9] == late
+
+
+def test_flips_are_stamped_by_the_clock_when_the_window_does_not():
+    window = FakeWindow([0, 20], stamped=False)
+    timer = FrameTimer(window, lambda: window.now, frame_dur=.01)
+    timer.flip('fixation', .2)
+    timer.flip('')
+    assert timer.rows[0][4:8] == [0., .2, .2, 20]
+
+
+def test_frame_period_comes_from_the_window_or_defaults_to_60_hz():
+    window = FakeWindow([])
+    assert FrameTimer(window, None).frame_dur == 1. / 60
+    window.monitorFramePeriod = 1. / 144
+    assert FrameTimer(window, None).frame_dur == 1. / 144
+    assert FrameTimer(window, None, frame_dur=.01).frame_dur == .01
+    window.monitorFramePeriod = None
+    assert FrameTimer(window, None).frame_dur == 1. / 60
+
+
+def test_summary_counts_each_phase():
+    timer = FrameTimer(FakeWindow([0, 30, 31, 32, 63, 65, 66]), None, frame_dur=.01)
+    for phase, intended, continued in [('prechange', .3, 0), ('isi', .02, 1), ('prechange', .3, 0), ('isi', .02, 1)]:
+        timer.flip(phase, intended)
+        for flip in range(0, continued):
+            timer.flip()
+    timer.flip('')
+    # the second pre-change array ran a frame over, and the second isi missed a frame and ran a frame over
+    assert timer.summary() == [['isi', 2, pytest.approx(.025), pytest.approx(.01), 1, 1],
+                               ['prechange', 2, pytest.approx(.305), pytest.approx(.01), 1, 0]]
+
+
+@pytest.mark.parametrize('duration, frames', [(.5, 50), (.014, 1), (.016, 2), (.0049, 1), (0, 1), (1.004, 100)])
+def test_durations_are_held_for_the_nearest_whole_number_of_frames(duration, frames):
+    assert FrameScheduler(FakeWindow([]), frame_dur=.01).frames(duration) == frames
+
+
+def test_scheduler_takes_the_frame_period_from_the_timer_then_the_window():
+    window = FakeWindow([])
+    assert FrameScheduler(window).frame_dur == 1. / 60
+    window.monitorFramePeriod = 1. / 120
+    assert FrameScheduler(window).frame_dur == 1. / 120
+    assert FrameScheduler(window, frame_timer=FrameTimer(window, None, frame_dur=.01)).frame_dur == .01
+    assert FrameScheduler(window, frame_dur=.02, frame_timer=FrameTimer(window, None, frame_dur=.01)).frame_dur == .02
+    assert FrameScheduler(window).frames(.5) == 60
+
+
+def test_show_flips_once_per_frame_and_labels_the_first():
+    window = FakeWindow(range(0, 31))
+    timer = FrameTimer(window, None, frame_dur=.01)
+    scheduler = FrameScheduler(window, frame_timer=timer, durations=[.3])
+    stims = [FakeStim(), FakeStim()]
+    shown = []
+    scheduler.show('prechange', .3, stims, each_frame=shown.append)
+    scheduler.flip('')
+    assert window.flips == 31
+    assert [stim.draws for stim in stims] == [30, 30]
+    assert shown == list(range(0, 30))
+    assert timer.rows == [[None, None, 'prechange', .3, 0., .3, .3, 30, 0, 0]]
+
+
+def test_idle_work_is_advanced_once_per_frame():
+    steps = []
+
+    def work(n):
+        for step in range(0, n):
+            steps.append(step)
+            yield
+
+    scheduler = FrameScheduler(FakeWindow(range(0, 10)), frame_dur=.01)
+    # a shorter iterator than the phase runs out without ending the phase early
+    scheduler.show('isi', .04, idle=work(2))
+    assert steps == [0, 1]
+    assert scheduler.window.flips == 4
+    # and the steps of a longer one that are left over are for the caller to finish
+    leftover = work(6)
+    scheduler.show('isi', .03, idle=leftover)
+    assert steps == [0, 1, 0, 1, 2]
+    assert list(leftover) == [None] * 3
+    assert steps[-3:] == [3, 4, 5]
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from tracing import histogram_edges, span, span_summary_fields, start_tracing, stop_tracing
+
+
+class StepClock(object):
+    # a clock that reads the given times in turn
+
+    def __init__(self, times):
+        self.times = list(times)
+
+    def __call__(self):
+        return self.times.pop(0)
+
+
+@pytest.fixture
+def traced():
+    def start(times):
+        return start_tracing(StepClock(times))
+    yield start
+    stop_tracing()
+
+
+def test_spans_do_nothing_while_tracing_is_off():
+    assert stop_tracing() is None
+    first, second = span('a'), span('b', 'trial', trial=1)
+    assert first is second
+    with first:
+        pass
+    assert stop_tracing() is None
+
+
+def test_span_opened_before_tracing_starts_is_not_recorded(traced):
+    untraced = span('early')
+    tracer = traced([0.])
+    with untraced:
+        pass
+    assert tracer.spans == []
+
+
+def test_chrome_trace_has_a_complete_event_for_every_span(traced, tmp_path):
+    tracer = traced([10., 10., 10.5, 10.5015, 11.0015, 11.5, 11.75])
+    with span('block', 'block', block='study'):
+        with span('trial setup', 'trial', trial=3):
+            pass
+    with span('write'):
+        pass
+    assert stop_tracing() is tracer
+    path = str(tmp_path / 'trace.json')
+    tracer.save_chrome_trace(path)
+    with open(path) as trace_file:
+        events = json.load(trace_file)['traceEvents']
+    assert [event['ph'] for event in events] == ['X'] * 3
+    # spans are recorded as they end, so the inner one comes first
+    assert [(event['name'], event['cat']) for event in events] == [('trial setup', 'trial'), ('block', 'block'),
+                                                                  ('write', '')]
+    assert [event['ts'] for event in events] == pytest.approx([.5e6, 0., 1.5e6])
+    assert [event['dur'] for event in events] == pytest.approx([1500., 1.0015e6, .25e6])
+    assert events[0]['args'] == {'trial': 3} and events[1]['args'] == {'block': 'study'}
+    assert 'args' not in events[2]
+    assert len(set([(event['pid'], event['tid']) for event in events])) == 1
+
+
+def test_span_is_recorded_when_its_code_raises(traced):
+    # the first reading is the start of the trace
+    tracer = traced([0., 1., 3.])
+    with pytest.raises(KeyError):
+        with span('lookup'):
+            raise KeyError('missing')
+    assert [(name, end - start) for name, category, thread, start, end, args in tracer.spans] == [('lookup', 2.)]
+
+
+def test_histogram_buckets_add_up_to_the_spans(traced):
+    durations = [.0005, .001, .003, .003, .02, .1, .5, 2., 5.]
+    # every span starts at 0 so that its duration is exactly as given
+    times = [0.]
+    for duration in durations:
+        times += [0., duration]
+    tracer = traced(times + [0., .25])
+    for duration in durations:
+        with span('trial'):
+            pass
+    with span('other'):
+        pass
+    rows = dict([(row[0], dict(zip(span_summary_fields, row))) for row in tracer.summary()])
+    assert sorted(rows.keys()) == ['other', 'trial']
+    row = rows['trial']
+    buckets = [row[name] for name in span_summary_fields[7:]]
+    assert len(buckets) == len(histogram_edges) + 1
+    assert sum(buckets) == row['n'] == len(durations)
+    # a span as long as an edge counts as over it
+    assert buckets == [1, 3, 0, 1, 1, 1, 2]
+    assert row['total'] == pytest.approx(sum(durations))
+    assert row['mean'] == pytest.approx(sum(durations) / len(durations))
+    assert (row['p50'], row['p95'], row['max']) == pytest.approx((.02, 5., 5.))
@@ -0,0 +1,96 @@
+import csv, glob, os, shutil
+
+import pytest
+
+import CBLTM
+from backends import HeadlessBackend, SimulatedObserver
+from simulate import simulate_session
+from triallog import TrialLog, read_log
+
+
+def test_half_written_line_is_skipped(tmp_path):
+    path = str(tmp_path / 'session.log')
+    log = TrialLog(path)
+    log.write('session', subject='01')
+    log.begin_block('a')
+    log.trial([1, 2])
+    log.checkpoint({'left': [3]})
+    log.close()
+    with open(path, 'a') as logfile:
+        logfile.write('{"kind": "begin", "blo')
+    log = TrialLog(path)
+    log.begin_block('b')
+    log.trial([4])
+    log.checkpoint({'left': []})
+    log.close()
+    session, finished, state = read_log(path)
+    assert session['subject'] == '01'
+    assert finished == {'a': [[1, 2]], 'b': [[4]]}
+    assert state == {'left': []}
+
+
+def test_interrupted_block_is_not_finished(tmp_path):
+    path = str(tmp_path / 'session.log')
+    log = TrialLog(path)
+    log.begin_block('a')
+    log.trial([1])
+    log.checkpoint({'block': 'a'})
+    log.begin_block('b')
+    log.trial([2])
+    log.close()
+    session, finished, state = read_log(path)
+    assert session is None
+    assert finished == {'a': [[1]]}
+    assert state == {'block': 'a'}
+
+
+def stimulus_columns(path):
+    # the stimuli of every trial, leaving out the responses, which differ from run to run
+    with open(path) as data_file:
+        rows = list(csv.DictReader(data_file))
+    names = ['trial_type', 'test_image', 'bait_image', 'filler1', 'filler2', 'filler3', 'filler4', 'filler5',
+             'filler6', 'test_slot']
+    return [[row[name] for name in names if name in row] for row in rows]
+
+
+def test_resumed_session_keeps_its_stimuli(stimulus_library):
+    data_dir = str(stimulus_library / 'data')
+    os.makedirs(data_dir)
+    try:
+        simulate_session(1, 'resume01', 5, data_dir)
+    finally:
+        CBLTM.use_backend(CBLTM.PsychopyBackend())
+    log_path = glob.glob(os.path.join(data_dir, '*.log'))[0]
+    data_path = log_path[:-4] + '.csv'
+    complete = stimulus_columns(data_path)
+    # cut the log off half way through the unstudied block, as a crash would
+    with open(log_path) as logfile:
+        lines = logfile.readlines()
+    begins = [i for i, line in enumerate(lines) if '"begin"' in line and '"unstudied"' in line]
+    with open(log_path, 'w') as logfile:
+        logfile.writelines(lines[:begins[0] + 2])
+        logfile.write(lines[begins[0] + 2][:10])
+    shutil.move(data_path, data_path + '.complete')
+    backend = HeadlessBackend(SimulatedObserver(seed=99), subject='resume01')
+    CBLTM.use_backend(backend)
+    try:
+        CBLTM.run_experiment(1, backend.visual.Window([1080, 720]), resume_log=log_path, data_dir=data_dir)
+    finally:
+        CBLTM.use_backend(CBLTM.PsychopyBackend())
+    assert stimulus_columns(data_path) == complete
+
+
+def test_resuming_a_log_without_a_session_record_raises(stimulus_library):
+    log_path = str(stimulus_library / 'interrupted.log')
+    log = TrialLog(log_path)
+    log.begin_block('study')
+    log.trial([1])
+    log.close()
+    backend = HeadlessBackend(SimulatedObserver(seed=99), subject='resume02')
+    CBLTM.use_backend(backend)
+    try:
+        with pytest.raises(ValueError, match='no session record'):
+            CBLTM.run_experiment(1, backend.visual.Window([1080, 720]), resume_log=log_path,
+                                 data_dir=str(stimulus_library))
+    finally:
+        CBLTM.use_backend(CBLTM.PsychopyBackend())
@@ -0,0 +1,89 @@
+import asyncio, glob, os, socket, sys, time
+
+import CBLTM
+from simulate import simulate_session
+from trialstream import TrialStream, parse_address
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Analysis'))
+from collector import Collector, serve_in_thread
+
+
+def wait_for_merge(collector, timeout=10.):
+    deadline = time.time() + timeout
+    while not collector.merged and time.time() < deadline:
+        time.sleep(.05)
+    return collector.merged
+
+
+def read_bytes(path):
+    with open(path, 'rb') as data_file:
+        return data_file.read()
+
+
+def test_parse_address():
+    assert parse_address('lab-pc:9000') == ('lab-pc', 9000)
+    assert parse_address('lab-pc') == ('lab-pc', 8765)
+    assert parse_address(('10.0.0.2', 81)) == ('10.0.0.2', 81)
+
+
+def test_merged_session_matches_the_station_file(stimulus_library):
+    station_dir = str(stimulus_library / 'station')
+    os.makedirs(station_dir)
+    collector = Collector(str(stimulus_library / 'collected'), str(stimulus_library / 'store'), quiet=True)
+    address, stop = serve_in_thread(collector)
+    try:
+        simulate_session(1, 'stream01', 4, station_dir, collector='%s:%d' % address)
+        merged = wait_for_merge(collector)
+    finally:
+        stop()
+        CBLTM.use_backend(CBLTM.PsychopyBackend())
+    station_file = glob.glob(os.path.join(station_dir, '*_CBLTM_1.csv'))[0]
+    assert [os.path.basename(path) for path in merged] == [os.path.basename(station_file)]
+    assert read_bytes(merged[0]) == read_bytes(station_file)
+    assert collector.summary()[0]['block'] == 'finished'
+
+
+def test_spooled_stream_is_merged_by_replay(tmp_path):
+    spool = str(tmp_path / 'session_stream.jsonl')
+    files = [{'name': 'sub_session.csv', 'fields': ['trial_type', 'correct', 'rt'], 'columns': ['correct', 'rt'],
+              'blocks': ['a', 'b']}]
+    # nothing listens on the collector's address, so every message ends up in the spool
+    stream = TrialStream(('127.0.0.1', 1), 'sub_session.csv', 'sub', 2, files, spool, buffer_size=2,
+                         retry_interval=.01, connect_timeout=.05, close_timeout=.1)
+    rows = [['a', 1, .5], ['b', 0, 1.25], ['a', 0, .75], ['c', 1, 2.0]]
+    for row in rows:
+        stream.trial(row[0], row)
+    stream.close()
+    assert os.path.exists(spool)
+    collector = Collector(str(tmp_path / 'collected'), str(tmp_path / 'store'), quiet=True)
+    assert collector.replay([spool, spool]) == ['sub_session.csv']
+    merged = read_bytes(str(tmp_path / 'collected' / 'ex2' / 'sub_session.csv')).decode('utf-8').splitlines()
+    assert merged == ['correct,rt', '1,0.5', '0,0.75', '0,1.25']
+    # a restarted collector reads its journals and does not merge the session again
+    assert not Collector(str(tmp_path / 'collected'), str(tmp_path / 'store'), quiet=True).complete('sub_session.csv')
+
+
+def test_trials_do_not_cut_the_retry_wait_short(tmp_path, monkeypatch):
+    attempts = []
+    open_connection = asyncio.open_connection
+
+    def counted(*args, **kwargs):
+        attempts.append(time.time())
+        return open_connection(*args, **kwargs)
+
+    monkeypatch.setattr(asyncio, 'open_connection', counted)
+    # a port that was free a moment ago, so connecting to it is refused at once
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        address = probe.getsockname()
+    stream = TrialStream(address, 'sub_session.csv', 'sub', 1, [], str(tmp_path / 'stream.jsonl'), retry_interval=30.,
+                         connect_timeout=.5, close_timeout=.1)
+    for trial in range(0, 20):
+        stream.trial('a', [trial])
+        time.sleep(.01)
+    started = time.time()
+    stream.close()
+    # the first attempt, and one more once the stream is closed
+    assert len(attempts) == 2
+    assert time.time() - started < 5.
+    assert stream.spooled == 22
@@ -0,0 +1,91 @@
+"""
+Text that is only laid out again when it changes.
+
+Psychopy lays out and renders the text of a TextStim whenever one is made or its text is set, which for the long
+instruction strings takes far longer than drawing it. InstructionScreens builds the stimulus for each message once and
+draws it again whenever the message comes back, e.g. the break screen of the study task. TypedText keeps the response a
+subject is typing and only sets it on its stimulus when a key has changed it, so the screen need not be redrawn while
+the subject is thinking.
+"""
+
+# key names that type a character other than their own name
+punctuation = {'period': '.', 'space': ' ', 'apostrophe': "'", 'question': '?', 'exclamation': '!', 'comma': ',',
+               'colon': ':', 'semicolon': ';', 'parenleft': '(', 'parenright': ')'}
+
+
+class InstructionScreens(object):
+    """
+    The text stimuli of the messages shown in a window, each made once.
+    """
+
+    def __init__(self, make_stim):
+        """
+        :param make_stim: A function taking a window and a message and making the stimulus that shows it.
+        """
+        self.make_stim = make_stim
+        self.built = 0
+        self._window = None
+        self._screens = {}
+
+    def screen(self, window, message):
+        """
+        :param window: The window the message is shown in.
+        :param message: String. The text of the screen.
+        :return: The stimulus for the message, made the first time it is asked for. Only the screens of the window
+                last asked about are kept, so a window's screens go with it.
+        """
+        if window is not self._window:
+            self._window = window
+            self._screens = {}
+        stim = self._screens.get(message)
+        if stim is None:
+            stim = self._screens[message] = self.make_stim(window, message)
+            self.built += 1
+        return stim
+
+
+class TypedText(object):
+    """
+    The response a subject types, shown on a text stimulus. The first letter, and the one after each press of left
+    shift, is capitalised.
+    """
+
+    def __init__(self, stim):
+        """
+        :param stim: The text stimulus to show the response on.
+        """
+        self.stim = stim
+        self.text = ''
+        self.cap_next = True
+        self.changed = False
+
+    def press(self, key):
+        """
+        :param key: String. The name of the key pressed.
+        :return: None.
+        """
+        if key == 'lshift':
+            self.cap_next = True
+        elif key == 'backspace':
+            if self.text:
+                self.text = self.text[:-1]
+                self.changed = True
+        elif key in punctuation:
+            self.text += punctuation[key]
+            self.changed = True
+        elif len(key) == 1:
+            self.text += key.capitalize() if self.cap_next else key
+            self.cap_next = False
+            self.changed = True
+
+    def update(self):
+        """
+        Set the response on the stimulus if it has changed since the last update.
+
+        :return: True if it had changed and the screen needs to be redrawn.
+        """
+        if not self.changed:
+            return False
+        self.stim.setText(self.text)
+        self.changed = False
+        return True
@@ -0,0 +1,142 @@
+"""
+Build and read a store of stimulus images that are already decoded and resized, kept in one memory-mapped file.
+
+Each image of the library is stored as raw RGBA pixels at its native size and at every size a window of a given
+resolution draws it at. A session maps the file read-only and hands the pixels to Psychopy without decoding or
+resampling anything, and sessions running side by side share the same pages.
+
+Run from the Experiment directory, with the manifest up to date, to build the store for a window resolution:
+
+    python texturestore.py 1080 720
+"""
+import json, os, struct
+
+store_magic = b'CBLTMTEX'
+store_version = 1
+# entries start on cache line boundaries, and the pixel data on a page boundary after the index
+entry_alignment = 64
+data_alignment = 4096
+
+
+def build_texture_store(path, manifest, sizes):
+    """
+    Decode every image in a manifest and write it, at its native size and resized to each of the given sizes, to a
+    texture store.
+
+    :param path: String. The filename of the store.
+    :param manifest: The stimulus manifest listing the images, as from manifest.load_manifest.
+    :param sizes: A list of (width, height) sizes in pixels to store each image at, besides its native size.
+    :return: None.
+    """
+    from PIL import Image
+    entries = []
+    offset = 0
+    for set_name, image_set in sorted(manifest['sets'].items()):
+        for image in image_set['files']:
+            image_path = os.path.join(image_set['dir'], image['name'])
+            for size in [None] + [tuple(size) for size in sizes]:
+                width, height = size if size is not None else (image['width'], image['height'])
+                entries.append([image_path, image['sha1'], width, height, offset])
+                offset += _aligned(width * height * 4, entry_alignment)
+    header = json.dumps({'version': store_version, 'entries': entries}, separators=(',', ':')).encode('utf-8')
+    data_start = _aligned(len(store_magic) + 8 + len(header), data_alignment)
+    with open(path + '.tmp', 'wb') as store_file:
+        store_file.write(store_magic + struct.pack('<Q', len(header)) + header)
+        decoded = {}
+        for image_path, sha1, width, height, entry_offset in entries:
+            if image_path not in decoded:
+                im = Image.open(image_path)
+                decoded.clear()
+                decoded[image_path] = im.convert('RGBA')
+            im = decoded[image_path]
+            if im.size != (width, height):
+                im = im.resize((width, height), Image.LANCZOS)
+            store_file.seek(data_start + entry_offset)
+            store_file.write(im.tobytes())
+        store_file.truncate(data_start + offset)
+    os.replace(path + '.tmp', path)
+
+
+class TextureStore(object):
+    """
+    Read-only view of a texture store. Images are handed out as PIL images that share the mapped pages, so nothing
+    is copied until the pixels are uploaded to a texture.
+    """
+
+    def __init__(self, path, manifest=None):
+        """
+        :param path: String. The filename of the store.
+        :param manifest: The current stimulus manifest. Images whose content hash no longer matches it are left out,
+                         so that they are decoded from the library instead.
+        """
+        import numpy
+        self.path = path
+        with open(path, 'rb') as store_file:
+            if store_file.read(len(store_magic)) != store_magic:
+                raise ValueError('%s is not a texture store' % path)
+            header_length, = struct.unpack('<Q', store_file.read(8))
+            header = json.loads(store_file.read(header_length).decode('utf-8'))
+        if header['version'] != store_version:
+            raise ValueError('%s is a version %d texture store, not %d' % (path, header['version'], store_version))
+        current = None
+        if manifest is not None:
+            current = dict([(os.path.join(image_set['dir'], image['name']), image['sha1'])
+                            for image_set in manifest['sets'].values() for image in image_set['files']])
+        data_start = _aligned(len(store_magic) + 8 + header_length, data_alignment)
+        self._pixels = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        self._entries = {}
+        self._native = {}
+        for image_path, sha1, width, height, offset in header['entries']:
+            if current is not None and current.get(image_path) != sha1:
+                continue
+            self._entries[(image_path, width, height)] = data_start + offset
+            self._native.setdefault(image_path, (width, height))
+
+    def has(self, path, size=None):
+        """
+        :param path: String. The filepath of the image.
+        :param size: A (width, height) size in pixels, or None for the native size.
+        :return: Whether the store holds the image at that size.
+        """
+        if size is None:
+            return path in self._native
+        return (path, size[0], size[1]) in self._entries
+
+    def image(self, path, size=None):
+        """
+        :param path: String. The filepath of the image.
+        :param size: A (width, height) size in pixels, or None for the native size.
+        :return: The stored RGBA PIL image, or None if the store does not hold it at that size.
+        """
+        from PIL import Image
+        if size is None:
+            size = self._native.get(path)
+            if size is None:
+                return None
+        offset = self._entries.get((path, size[0], size[1]))
+        if offset is None:
+            return None
+        pixels = self._pixels[offset:offset + size[0] * size[1] * 4]
+        return Image.frombuffer('RGBA', size, pixels, 'raw', 'RGBA', 0, 1)
+
+
+def texture_store_file(window_size):
+    """
+    :param window_size: The (width, height) of the window in pixels.
+    :return: The filename of the texture store for that window resolution.
+    """
+    return 'Stimuli/textures_%dx%d.rgba' % (int(window_size[0]), int(window_size[1]))
+
+
+def _aligned(n, alignment):
+    return (n + alignment - 1) // alignment * alignment
+
+
+if __name__ == '__main__':
+    import sys
+    from CBLTM import stimulus_sets, manifest_file, stimulus_sizes
+    from manifest import load_manifest
+    window_size = (int(sys.argv[1]), int(sys.argv[2]))
+    build_texture_store(texture_store_file(window_size), load_manifest(manifest_file, stimulus_sets),
+                        stimulus_sizes(window_size))
+    print('Textures for a %dx%d window saved to %s' % (window_size + (texture_store_file(window_size),)))
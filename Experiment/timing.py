@@ -0,0 +1,153 @@
+timing_fields = ['block', 'trial', 'phase', 'intended', 'onset', 'offset', 'duration', 'frames', 'dropped_frames',
+                 'late']
+timing_summary_fields = ['phase', 'n', 'mean_duration', 'max_error', 'late', 'dropped_frames']
+
+
+class FrameTimer(object):
+    """
+    Record the time of every window flip during timed phases, and what each phase actually lasted.
+
+    A phase starts at a flip labelled with its name and runs until the next labelled flip. Flips in between, as when
+    a stimulus is redrawn every frame, are counted and checked for dropped frames. A phase whose measured duration
+    misses the intended one by more than half a frame is marked late.
+    """
+
+    def __init__(self, window, get_time, frame_dur=None):
+        """
+        :param window: The window to flip.
+        :param get_time: The clock to stamp flips with if window.flip() does not return the flip time.
+        :param frame_dur: The refresh period of the display, in seconds; the window's monitorFramePeriod if not given.
+        """
+        self.window = window
+        self.get_time = get_time
+        self.frame_dur = frame_dur or getattr(window, 'monitorFramePeriod', None) or 1. / 60
+        self.block = None
+        self.trial = None
+        self.rows = []
+        self._phase = None
+        self._flips = []
+
+    def flip(self, phase=None, intended=None):
+        """
+        Flip the window and record when it happened.
+
+        :param phase: String. The phase this flip starts, or None if it continues the current phase. An empty
+                      string ends the current phase without starting a new one.
+        :param intended: How long the new phase is meant to last, in seconds.
+        :return: The time of the flip.
+        """
+        t = self.window.flip()
+        if t is None:
+            t = self.get_time()
+        if phase is None:
+            if self._phase is not None:
+                self._flips.append(t)
+            return t
+        if self._phase is not None:
+            self._close(t)
+        if phase:
+            self._phase = (self.block, self.trial, phase, intended)
+            self._flips = [t]
+        else:
+            self._phase = None
+        return t
+
+    def summary(self):
+        """
+        Summarize the recorded phases by name.
+
+        :return: A list of [phase, n, mean_duration, max_error, late, dropped_frames] rows.
+        """
+        phases = {}
+        for block, trial, phase, intended, onset, offset, duration, frames, dropped, late in self.rows:
+            phases.setdefault(phase, []).append((intended, duration, dropped, late))
+        summary = []
+        for phase, timings in sorted(phases.items()):
+            errors = [abs(duration - intended) for intended, duration, dropped, late in timings if intended is not None]
+            summary.append([phase, len(timings), sum([t[1] for t in timings]) / len(timings),
+                            max(errors) if errors else '', sum([t[3] for t in timings]), sum([t[2] for t in timings])])
+        return summary
+
+    def _close(self, offset):
+        block, trial, phase, intended = self._phase
+        onset = self._flips[0]
+        duration = offset - onset
+        frames = int(round(duration / self.frame_dur))
+        dropped = 0
+        # a phase that was only flipped at its onset has no frame intervals of its own to check
+        if len(self._flips) > 1:
+            stamps = self._flips + [offset]
+            for i in range(1, len(stamps)):
+                interval = stamps[i] - stamps[i - 1]
+                if interval > 1.5 * self.frame_dur:
+                    dropped += int(round(interval / self.frame_dur)) - 1
+        late = int(intended is not None and abs(duration - intended) > self.frame_dur / 2)
+        self.rows.append([block, trial, phase, intended, onset, offset, duration, frames, dropped, late])
+
+
+class FrameScheduler(object):
+    """
+    Present timed phases for a whole number of display frames instead of waiting on the wall clock.
+
+    Durations are converted to frame counts once, and a phase is held by redrawing and flipping for exactly that many
+    frames, so work done between flips cannot stretch it. Work can be handed to a phase as an iterator that is
+    advanced one step after each flip, which spreads it over the idle time left in each frame.
+    """
+
+    def __init__(self, window, frame_dur=None, frame_timer=None, durations=()):
+        """
+        :param window: The window to flip.
+        :param frame_dur: The refresh period of the display, in seconds. Taken from frame_timer or the window's
+                          monitorFramePeriod if not given.
+        :param frame_timer: The FrameTimer to record flips with, or None.
+        :param durations: Durations, in seconds, to convert to frame counts up front.
+        """
+        self.window = window
+        self.frame_timer = frame_timer
+        self.frame_dur = frame_dur or (frame_timer and frame_timer.frame_dur) or \
+            getattr(window, 'monitorFramePeriod', None) or 1. / 60
+        self._frames = {}
+        for duration in durations:
+            self.frames(duration)
+
+    def frames(self, duration):
+        """
+        :param duration: A duration in seconds.
+        :return: The whole number of frames closest to the duration, and at least one.
+        """
+        if duration not in self._frames:
+            self._frames[duration] = max(1, int(round(duration / self.frame_dur)))
+        return self._frames[duration]
+
+    def flip(self, phase=None, intended=None):
+        """
+        Flip the window, through the frame timer if there is one. See FrameTimer.flip.
+
+        :return: None.
+        """
+        if self.frame_timer is None:
+            self.window.flip()
+        else:
+            self.frame_timer.flip(phase, intended)
+
+    def show(self, phase, duration, stims=(), each_frame=None, idle=None):
+        """
+        Show stimuli for the number of frames closest to a duration. The phase lasts until the next flip, which
+        should be the onset of whatever follows it.
+
+        :param phase: String. The name of the phase, for the frame timer.
+        :param duration: How long to show the stimuli for, in seconds.
+        :param stims: The stimuli to draw on every frame.
+        :param each_frame: A function called with the frame number after each flip, or None.
+        :param idle: An iterator advanced one step after each flip, or None. Any steps left over when the phase
+                     ends are left for the caller.
+        :return: None.
+        """
+        for frame in range(0, self.frames(duration)):
+            for stim in stims:
+                stim.draw()
+            self.flip(phase if frame == 0 else None, duration)
+            if each_frame is not None:
+                each_frame(frame)
+            if idle is not None:
+                next(idle, None)
@@ -0,0 +1,159 @@
+"""
+Time the phases of a session and the stages of each trial with spans, and export them for a trace viewer.
+
+Tracing is off unless start_tracing is called. While it is off, span() hands back one shared do-nothing context
+manager, so the spans left around the session's code cost a function call each. While it is on, every span records
+its name, category, thread and start and end times on the performance counter. The spans can then be saved as Chrome
+trace-event JSON, which chrome://tracing and Perfetto open, and summarised per span name as a latency histogram.
+"""
+import json, os, threading, time
+
+# upper edges of the buckets of the latency histograms, in seconds; the last bucket holds everything longer
+histogram_edges = [.001, .004, .016, .064, .256, 1.024]
+span_summary_fields = ['span', 'n', 'total', 'mean', 'p50', 'p95', 'max'] + \
+                      ['under_%gms' % (edge * 1000) for edge in histogram_edges] + \
+                      ['over_%gms' % (histogram_edges[-1] * 1000)]
+
+_tracer = None
+
+
+class Tracer(object):
+    """
+    Records the spans of a session.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        """
+        :param clock: The function giving the current time in seconds.
+        """
+        self.clock = clock
+        self.origin = clock()
+        self.spans = []
+
+    def span(self, name, category='', args=None):
+        """
+        :param name: String. What the span times, e.g. 'cd_task setup'; spans are summarised by name.
+        :param category: String. The kind of span, e.g. 'block' or 'trial'.
+        :param args: A dictionary of details to show with the span, or None.
+        :return: A context manager that records the span when it exits.
+        """
+        return _Span(self, name, category, args)
+
+    def chrome_trace(self):
+        """
+        :return: The spans as a Chrome trace-event dictionary, with complete ('X') events timed in microseconds from
+                the start of tracing.
+        """
+        pid = os.getpid()
+        events = []
+        for name, category, thread, start, end, args in self.spans:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': thread,
+                     'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6}
+            if args:
+                event['args'] = args
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        """
+        :param path: String. The filename for the trace, including the .json extension.
+        :return: None.
+        """
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file, default=str)
+
+    def summary(self):
+        """
+        Summarise the spans by name.
+
+        :return: A list of rows with the columns of span_summary_fields: the span name, how many there were, their
+                total, mean, median, 95th percentile and longest durations in seconds, and how many fell in each
+                bucket of histogram_edges.
+        """
+        durations = {}
+        for name, category, thread, start, end, args in self.spans:
+            durations.setdefault(name, []).append(end - start)
+        rows = []
+        for name in sorted(durations.keys()):
+            times = sorted(durations[name])
+            n = len(times)
+            buckets = [0] * (len(histogram_edges) + 1)
+            for duration in times:
+                bucket = 0
+                while bucket < len(histogram_edges) and duration >= histogram_edges[bucket]:
+                    bucket += 1
+                buckets[bucket] += 1
+            rows.append([name, n, sum(times), sum(times) / n, times[n // 2], times[min(n - 1, int(n * .95))],
+                         times[-1]] + buckets)
+        return rows
+
+
+class _Span(object):
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.spans.append((self.name, self.category, threading.get_ident(), self.start, self.tracer.clock(),
+                                  self.args))
+        return False
+
+
+class _NoSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_no_span = _NoSpan()
+
+
+def span(name, category='', **args):
+    """
+    Time a stretch of code, if tracing is on:
+
+        with span('cd_task setup', 'trial', trial=i):
+            ...
+
+    :param name: String. What the span times; spans are summarised by name.
+    :param category: String. The kind of span, e.g. 'block' or 'trial'.
+    :param args: Details to show with the span in the trace viewer.
+    :return: A context manager.
+    """
+    if _tracer is None:
+        return _no_span
+    return _tracer.span(name, category, args)
+
+
+def start_tracing(clock=time.perf_counter):
+    """
+    Turn tracing on, starting a new trace.
+
+    :param clock: The function giving the current time in seconds.
+    :return: The Tracer recording the spans.
+    """
+    global _tracer
+    _tracer = Tracer(clock)
+    return _tracer
+
+
+def stop_tracing():
+    """
+    Turn tracing off.
+
+    :return: The Tracer that was recording the spans, or None if tracing was off.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
@@ -0,0 +1,151 @@
+import json, os, queue, threading, time
+
+
+class TrialLog(object):
+    """
+    Append-only, crash-safe log of a session, written as one JSON record per line.
+
+    Records are handed to a background thread that writes and flushes them as they arrive and fsyncs in batches,
+    so logging a trial never blocks the presentation loop. Block checkpoints are synced as soon as they are written.
+    Trials can also be passed on to a TrialStream as they are logged.
+    """
+
+    def __init__(self, path, sync_every=20, sync_interval=2.0, stream=None):
+        """
+        :param path: String. The filename of the log; records are appended if it already exists.
+        :param sync_every: Integer. Sync to disk after this many unsynced records.
+        :param sync_interval: Sync to disk if records have been waiting this long, in seconds.
+        :param stream: The trialstream.TrialStream to send each trial to as well, or None.
+        """
+        self.path = path
+        self.stream = stream
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.block = None
+        self._file = open(path, 'a')
+        # a crash can leave the last record half written; start on a fresh line so it stays the only bad one
+        if self._file.tell() and not _ends_with_newline(path):
+            self._file.write('\n')
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def write(self, kind, sync=False, **fields):
+        """
+        Queue a record for the log.
+
+        :param kind: String. The record type, e.g. 'session', 'trial' or 'checkpoint'.
+        :param sync: Whether to sync the log to disk as soon as this record is written.
+        :param fields: The contents of the record. Must be JSON serializable.
+        :return: None.
+        """
+        fields['kind'] = kind
+        self._queue.put((json.dumps(fields), sync))
+
+    def begin_block(self, name):
+        """
+        Mark the start of a block; trials logged from now on belong to it.
+
+        :param name: String. The name of the block, unique within the session.
+        :return: None.
+        """
+        self.block = name
+        self.write('begin', block=name)
+
+    def trial(self, row):
+        """
+        Log one finished trial of the current block.
+
+        :param row: The list of values recorded for the trial.
+        :return: None.
+        """
+        self.write('trial', block=self.block, row=row)
+        if self.stream is not None:
+            self.stream.trial(self.block, row)
+
+    def checkpoint(self, state):
+        """
+        Mark the current block as finished and record everything needed to resume after it.
+
+        :param state: A dictionary of the session state to restore on resume.
+        :return: None.
+        """
+        self.write('checkpoint', sync=True, block=self.block, state=state)
+        self.block = None
+
+    def close(self):
+        """
+        Write out everything still queued, sync it and close the file.
+
+        :return: None.
+        """
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+    def _write_loop(self):
+        unsynced = 0
+        last_sync = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                line, sync = item
+                self._file.write(line + '\n')
+                self._file.flush()
+                unsynced += 1
+            else:
+                sync = False
+            if unsynced and (sync or unsynced >= self.sync_every or time.time() - last_sync >= self.sync_interval):
+                os.fsync(self._file.fileno())
+                unsynced = 0
+                last_sync = time.time()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def read_log(path):
+    """
+    Read a session log back in order to resume it.
+
+    Only blocks that reached their checkpoint count as finished; trials from a block that was interrupted are
+    dropped, since that block is run again from its start. Half-written lines, as left by a crash mid-write, are
+    skipped.
+
+    :param path: String. The filename of the log.
+    :return: A (session, finished, state) tuple: the session record, a dictionary mapping each finished block to its
+            list of trial rows, and the state saved at the last checkpoint.
+    """
+    session = None
+    finished = {}
+    state = None
+    rows = []
+    with open(path) as logfile:
+        for line in logfile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['kind'] == 'session':
+                session = record
+            elif record['kind'] == 'begin':
+                rows = []
+            elif record['kind'] == 'trial':
+                rows.append(record['row'])
+            elif record['kind'] == 'checkpoint':
+                if record['block'] is not None:
+                    finished[record['block']] = rows
+                state = record['state']
+                rows = []
+    return session, finished, state
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as logfile:
+        logfile.seek(-1, os.SEEK_END)
+        return logfile.read(1) == b'\n'
@@ -0,0 +1,226 @@
+"""
+Stream the trials of a session to the lab's collector (Analysis/collector.py) as they finish.
+
+Messages are JSON objects, one per line, each tagged with the session, the station that sent it, the stream it was
+sent on and its number in that stream. The first message of a stream describes the session and the data files it
+makes; then comes one message per trial and, when the session is over, an end message giving how many messages the
+stream sent. The collector acknowledges each message by its stream and number. Messages can arrive more than once and
+in any order, since the collector drops repeats and waits for the whole stream before merging it.
+
+Sending runs on an asyncio loop in a background thread. Handing a trial over to it never waits for the network or the
+disk, so the presentation loop is never held up. At most buffer_size messages are held in memory, sent or waiting to
+be; when the collector is slow or cannot be reached, the rest are appended to a spool file next to the session log,
+which is sent once the collector is back, or kept on disk for collector.py's replay if it never is.
+"""
+from collections import deque, OrderedDict
+import json, os, socket, threading, time, uuid
+
+default_port = 8765
+
+
+def parse_address(address):
+    """
+    :param address: A (host, port) tuple, or a string 'host:port' or 'host', which uses default_port.
+    :return: A (host, port) tuple.
+    """
+    if isinstance(address, str):
+        host, _, port = address.partition(':')
+        return host or '127.0.0.1', int(port) if port else default_port
+    return tuple(address)
+
+
+class TrialStream(object):
+    """
+    Sends the trials of one session, or of one part of a resumed session, to a collector.
+    """
+
+    def __init__(self, address, session, subject, experiment, files, spool_path, station=None, buffer_size=256,
+                 retry_interval=5., connect_timeout=1., close_timeout=5.):
+        """
+        :param address: The collector's address, as for parse_address.
+        :param session: String. The name of the session, unique across stations, e.g. its data file's name.
+        :param subject: String. The subject ID.
+        :param experiment: The integer of the experiment.
+        :param files: A list of the data files the session makes, for the collector to write: a dictionary for each
+                      with its 'name', the 'fields' of a logged trial, the 'columns' to save and the 'blocks' whose
+                      trials it holds, in order.
+        :param spool_path: String. The file to keep messages in that cannot be held in memory or sent; a resumed
+                           session should use the same file so that what is left of it is sent.
+        :param station: String. The name of this computer in the collector's summaries; its hostname by default.
+        :param buffer_size: Integer. The most messages to hold in memory.
+        :param retry_interval: How long to wait before connecting again after the collector could not be reached,
+                               in seconds.
+        :param connect_timeout: How long to wait for the collector to accept a connection, in seconds.
+        :param close_timeout: How long close waits for the collector to take what is left, in seconds.
+        """
+        self.address = parse_address(address)
+        self.session = session
+        self.stream = uuid.uuid4().hex
+        self.station = station or socket.gethostname()
+        self.spool_path = spool_path
+        self.buffer_size = buffer_size
+        self.retry_interval = retry_interval
+        self.connect_timeout = connect_timeout
+        self.close_timeout = close_timeout
+        self.sent = 0
+        self.spooled = 0
+        self.connected = False
+        self._seq = 0
+        self._buffer = deque()
+        self._pending = OrderedDict()
+        self._spool_offset = 0
+        self._closing = False
+        self._deadline = None
+        self._wakeup = None
+        self._closed = None
+        # asyncio takes a while to import, so it is only imported by sessions that stream
+        import asyncio
+        self._loop = asyncio.new_event_loop()
+        self._enqueue_message('session', subject=subject, experiment=experiment, files=files)
+        self._sender = threading.Thread(target=self._loop.run_until_complete, args=(self._run(),))
+        self._sender.daemon = True
+        self._sender.start()
+
+    def trial(self, block, row):
+        """
+        Send one finished trial. Returns at once.
+
+        :param block: String. The block the trial belongs to.
+        :param row: The list of values recorded for the trial.
+        :return: None.
+        """
+        self._loop.call_soon_threadsafe(self._enqueue_message, 'trial', block, list(row))
+
+    def close(self):
+        """
+        Send the end of the stream and stop, waiting at most close_timeout for the collector to take what is left.
+        Whatever it has not taken by then stays in the spool file.
+
+        :return: None.
+        """
+        self._loop.call_soon_threadsafe(self._finish)
+        self._sender.join()
+        self._loop.close()
+
+    def _enqueue_message(self, kind, block=None, row=None, **fields):
+        fields.update({'kind': kind, 'session': self.session, 'stream': self.stream, 'seq': self._seq,
+                       'station': self.station, 'time': time.time()})
+        if block is not None:
+            fields['block'] = block
+        if row is not None:
+            fields['row'] = row
+        self._seq += 1
+        self._enqueue(fields)
+
+    def _enqueue(self, message):
+        if len(self._buffer) + len(self._pending) < self.buffer_size:
+            self._buffer.append(message)
+        else:
+            self._spool([message])
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _finish(self):
+        self._enqueue_message('end', count=self._seq + 1)
+        self._closing = True
+        self._deadline = time.time() + self.close_timeout
+        if self._closed is not None:
+            self._closed.set()
+
+    def _spool(self, messages):
+        with open(self.spool_path, 'a') as spool:
+            for message in messages:
+                spool.write(json.dumps(message) + '\n')
+        self.spooled += len(messages)
+
+    def _refill(self):
+        # take messages back from the spool into the buffer once there is room; the file is emptied once all of
+        # them have been sent and acknowledged
+        if self._buffer or not os.path.exists(self.spool_path):
+            return
+        room = self.buffer_size - len(self._pending)
+        with open(self.spool_path) as spool:
+            spool.seek(self._spool_offset)
+            while room > 0:
+                line = spool.readline()
+                if not line.endswith('\n'):
+                    break
+                self._spool_offset += len(line)
+                try:
+                    self._buffer.append(json.loads(line))
+                except ValueError:
+                    continue
+                room -= 1
+        if not self._buffer and not self._pending and self._spool_offset >= os.path.getsize(self.spool_path):
+            os.remove(self.spool_path)
+            self._spool_offset = 0
+
+    def _done(self):
+        return self._closing and not self._buffer and not self._pending and not os.path.exists(self.spool_path)
+
+    async def _run(self):
+        import asyncio
+        self._wakeup = asyncio.Event()
+        # new trials do not cut the wait between connection attempts short, only closing the stream does
+        self._closed = asyncio.Event()
+        while not self._done():
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.address),
+                                                        self.connect_timeout)
+            except (OSError, asyncio.TimeoutError):
+                writer = None
+            if writer is not None:
+                self.connected = True
+                try:
+                    await self._exchange(reader, writer)
+                except (OSError, ValueError, asyncio.TimeoutError):
+                    pass
+                finally:
+                    self.connected = False
+                    writer.close()
+                # anything not acknowledged is sent again on the next connection
+                self._buffer.extendleft(reversed(list(self._pending.values())))
+                self._pending.clear()
+            if self._closing or self._done():
+                break
+            try:
+                await asyncio.wait_for(self._closed.wait(), self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+        if self._buffer or self._pending:
+            self._spool(list(self._pending.values()) + list(self._buffer))
+            self._buffer.clear()
+            self._pending.clear()
+
+    async def _exchange(self, reader, writer):
+        import asyncio
+        acks = asyncio.ensure_future(self._read_acks(reader))
+        try:
+            while not self._done():
+                self._refill()
+                while self._buffer:
+                    message = self._buffer.popleft()
+                    self._pending[(message['stream'], message['seq'])] = message
+                    writer.write((json.dumps(message) + '\n').encode('utf-8'))
+                    self.sent += 1
+                await writer.drain()
+                self._wakeup.clear()
+                wait = asyncio.ensure_future(self._wakeup.wait())
+                timeout = max(0., self._deadline - time.time()) if self._closing else None
+                finished, unfinished = await asyncio.wait([acks, wait], timeout=timeout,
+                                                          return_when=asyncio.FIRST_COMPLETED)
+                wait.cancel()
+                if acks in finished or not finished:
+                    return
+        finally:
+            acks.cancel()
+
+    async def _read_acks(self, reader):
+        while True:
+            line = await reader.readline()
+            try:
+                stream, seq = json.loads(line.decode('utf-8'))['ack']
+            except (ValueError, KeyError, TypeError):
+                return
+            self._pending.pop((stream, seq), None)
+            self._wakeup.set()